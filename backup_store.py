@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+Backup Store - Content-addressed, deduplicating snapshots of book files
+Each unique file body is kept once under objects/ (named by its sha256)
+and every backup is a small JSON manifest under snapshots/ mapping paths
+to blobs. Blobs are copied with reflinks where the filesystem supports
+them, so backing up or restoring an unchanged file costs no data copy.
+"""
+
+import argparse
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import stat
+from datetime import datetime
+from pathlib import Path
+
+DEFAULT_STORE = 'chapter_backups'
+
+# ioctl(FICLONE): share the source's extents (btrfs, XFS, bcachefs, ...)
+FICLONE = 0x40049409
+
+HASH_CHUNK = 1024 * 1024
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def clone_file(src, dst):
+    """Copy src to dst, as a reflink when possible. Returns True if reflinked."""
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            return True
+        except OSError as e:
+            if e.errno not in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV,
+                               errno.EINVAL, errno.EBADF, errno.ENOSYS):
+                raise
+        shutil.copyfileobj(fsrc, fdst, HASH_CHUNK)
+        return False
+
+
+class BackupStore:
+    """objects/<2 hex>/<62 hex> blobs plus snapshots/<id>.json manifests."""
+
+    def __init__(self, root=DEFAULT_STORE):
+        self.root = Path(root)
+        self.objects_dir = self.root / 'objects'
+        self.snapshots_dir = self.root / 'snapshots'
+        self.stats = {'files': 0, 'hashed': 0, 'stored': 0, 'reflinked': 0, 'bytes_stored': 0}
+
+    def _object_path(self, digest):
+        return self.objects_dir / digest[:2] / digest[2:]
+
+    def _store_blob(self, path, digest):
+        obj = self._object_path(digest)
+        if obj.exists():
+            return
+        obj.parent.mkdir(parents=True, exist_ok=True)
+        tmp = obj.with_name(f"{obj.name}.tmp")
+        if clone_file(path, tmp):
+            self.stats['reflinked'] += 1
+        # Blobs are immutable
+        os.chmod(tmp, 0o444)
+        os.replace(tmp, obj)
+        self.stats['stored'] += 1
+        self.stats['bytes_stored'] += obj.stat().st_size
+
+    # ------------------------------------------------------------------
+    # Snapshots
+
+    def snapshots(self):
+        """Snapshot ids, oldest first."""
+        if not self.snapshots_dir.exists():
+            return []
+        return sorted(p.stem for p in self.snapshots_dir.glob('*.json'))
+
+    def load(self, snapshot_id):
+        with open(self.snapshots_dir / f"{snapshot_id}.json", 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def resolve(self, snapshot_id=None):
+        """Full id for an id prefix, or the latest snapshot if None."""
+        ids = self.snapshots()
+        if snapshot_id is None:
+            if not ids:
+                raise KeyError("No snapshots in store")
+            return ids[-1]
+        matches = [i for i in ids if i.startswith(snapshot_id)]
+        if len(matches) != 1:
+            raise KeyError(f"{'Ambiguous' if matches else 'Unknown'} snapshot: {snapshot_id}")
+        return matches[0]
+
+    def snapshot(self, files, base='.', label=''):
+        """Record files (paths under base) as a new snapshot; returns its id.
+
+        Files whose size and mtime match the latest snapshot reuse its hash
+        instead of being read again, and blobs already in the store are
+        not copied, so the cost follows what changed since the last backup.
+        """
+        base = Path(base)
+        previous = {}
+        if self.snapshots():
+            previous = self.load(self.resolve())['files']
+
+        entries = {}
+        for path in files:
+            path = Path(path)
+            rel = Path(os.path.relpath(path, base)).as_posix()
+            st = path.stat()
+            known = previous.get(rel)
+            if known and known['size'] == st.st_size and known['mtime_ns'] == st.st_mtime_ns:
+                digest = known['sha256']
+            else:
+                digest = file_sha256(path)
+                self.stats['hashed'] += 1
+            self._store_blob(path, digest)
+            entries[rel] = {
+                'sha256': digest,
+                'size': st.st_size,
+                'mtime_ns': st.st_mtime_ns,
+                'mode': stat.S_IMODE(st.st_mode)
+            }
+            self.stats['files'] += 1
+
+        created = datetime.now()
+        manifest_digest = hashlib.sha256(json.dumps(entries, sort_keys=True).encode('utf-8')).hexdigest()
+        snapshot_id = f"{created.strftime('%Y%m%d-%H%M%S-%f')}-{manifest_digest[:8]}"
+        manifest = {
+            'id': snapshot_id,
+            'label': label,
+            'created': created.isoformat(timespec='seconds'),
+            'files': entries
+        }
+
+        self.snapshots_dir.mkdir(parents=True, exist_ok=True)
+        tmp = self.snapshots_dir / f"{snapshot_id}.json.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        os.replace(tmp, self.snapshots_dir / f"{snapshot_id}.json")
+        return snapshot_id
+
+    def restore(self, snapshot_id=None, dest='.'):
+        """Write a snapshot's files under dest; returns (restored, unchanged).
+
+        Files already matching the snapshot are left alone. Files are reflinked
+        from the blobs where possible and copied otherwise, never hardlinked:
+        a write to a hardlinked file would change every snapshot sharing the blob.
+        """
+        manifest = self.load(self.resolve(snapshot_id))
+        dest = Path(dest)
+        restored = unchanged = 0
+        for rel, entry in manifest['files'].items():
+            target = dest / rel
+            if (target.exists() and target.stat().st_size == entry['size'] and
+                    file_sha256(target) == entry['sha256']):
+                unchanged += 1
+                continue
+
+            obj = self._object_path(entry['sha256'])
+            target.parent.mkdir(parents=True, exist_ok=True)
+            tmp = target.with_name(f".{target.name}.restore")
+            if tmp.exists():
+                tmp.unlink()
+            clone_file(obj, tmp)
+            os.chmod(tmp, entry['mode'])
+            os.utime(tmp, ns=(entry['mtime_ns'], entry['mtime_ns']))
+            os.replace(tmp, target)
+            restored += 1
+        return restored, unchanged
+
+    def disk_usage(self):
+        """Bytes held in blobs."""
+        if not self.objects_dir.exists():
+            return 0
+        return sum(p.stat().st_size for p in self.objects_dir.rglob('*') if p.is_file())
+
+
+def _expand(paths):
+    """Files named on the command line, with directories walked in sorted order."""
+    for path in paths:
+        path = Path(path)
+        if path.is_dir():
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    yield Path(root) / name
+        elif path.is_file():
+            yield path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Content-addressed backup snapshots")
+    parser.add_argument('--store', default=DEFAULT_STORE, help=f"store directory (default: {DEFAULT_STORE})")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    snap = commands.add_parser('snapshot', help="back up files or directories")
+    snap.add_argument('paths', nargs='+')
+    snap.add_argument('--label', default='')
+
+    commands.add_parser('list', help="list snapshots")
+
+    rest = commands.add_parser('restore', help="restore a snapshot (default: latest)")
+    rest.add_argument('snapshot', nargs='?')
+    rest.add_argument('--to', default='.', help="directory to restore into")
+
+    args = parser.parse_args()
+    store = BackupStore(args.store)
+
+    if args.command == 'snapshot':
+        snapshot_id = store.snapshot(_expand(args.paths), label=args.label)
+        s = store.stats
+        print(f"✅ Snapshot {snapshot_id}: {s['files']} files, {s['hashed']} hashed, "
+              f"{s['stored']} new blobs ({s['bytes_stored']:,} bytes, {s['reflinked']} reflinked)")
+    elif args.command == 'list':
+        for snapshot_id in store.snapshots():
+            manifest = store.load(snapshot_id)
+            print(f"{snapshot_id}  {len(manifest['files']):4d} files  {manifest['label']}")
+        print(f"📦 Store size: {store.disk_usage():,} bytes")
+    else:
+        try:
+            snapshot_id = store.resolve(args.snapshot)
+        except KeyError as e:
+            print(f"❌ {e.args[0]}")
+            return
+        restored, unchanged = store.restore(snapshot_id, args.to)
+        print(f"✅ Restored {snapshot_id}: {restored} files written, {unchanged} already current")
+
+
+if __name__ == "__main__":
+    main()
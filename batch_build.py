@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Batch EPUB Builder - Build many books concurrently
+Takes book roots (or directories of book roots), orders them by a priority
+policy and builds them in a bounded process pool, one book per worker.
+Per-book timing and status, plus batch throughput, are written as JSON.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from xml.etree.ElementTree import ParseError
+
+from create_final_epub import create_epub
+from epub_packager import resolve_jobs
+from compression_policy import POLICY_MODES
+from package_index import PackageIndex, find_opf_path
+
+DEFAULT_REPORT = 'batch_build_report.json'
+
+# largest: longest job first, which keeps every worker busy to the end and
+#          minimizes total batch time (best books/hour)
+# smallest: first results soonest
+# changed: books edited since their last successful build first (largest first
+#          within each group)
+# given: command-line order
+ORDERS = ('largest', 'smallest', 'changed', 'given')
+
+
+class BookJob:
+    """One book root to build."""
+
+    def __init__(self, source, name):
+        self.source = str(Path(source).resolve())
+        self.name = name
+        self.changed = True
+
+        # Size and newest mtime of what would be packed (not everything under the root)
+        self.size = 0
+        self.source_mtime = 0
+        index = PackageIndex.load(self.source)
+        for path in ['mimetype'] + index.package_order():
+            try:
+                st = os.stat(os.path.join(self.source, path))
+            except OSError:
+                continue
+            self.size += st.st_size
+            self.source_mtime = max(self.source_mtime, st.st_mtime_ns)
+
+    def as_dict(self):
+        return {'book': self.name, 'source': self.source, 'source_bytes': self.size,
+                'source_mtime': self.source_mtime, 'changed': self.changed}
+
+
+def is_book(path):
+    try:
+        find_opf_path(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def find_books(paths):
+    """Book roots among paths: each path is a book, or a directory of books."""
+    books = []
+    for path in paths:
+        path = Path(path)
+        if is_book(path):
+            books.append(path)
+        elif path.is_dir():
+            books.extend(child for child in sorted(path.iterdir()) if child.is_dir() and is_book(child))
+        else:
+            print(f"⚠️  Not a book or directory of books: {path}")
+    return books
+
+
+def order_jobs(jobs, order, previous):
+    """Sort jobs by the priority policy; previous maps source -> last report entry."""
+    for job in jobs:
+        last = previous.get(job.source)
+        job.changed = not (last and last['status'] == 'ok' and
+                           last['source_mtime'] >= job.source_mtime)
+    if order == 'largest':
+        return sorted(jobs, key=lambda job: -job.size)
+    if order == 'smallest':
+        return sorted(jobs, key=lambda job: job.size)
+    if order == 'changed':
+        return sorted(jobs, key=lambda job: (not job.changed, -job.size))
+    return list(jobs)
+
+
+def build_book(job, out_dir, options):
+    """Worker: build one book, capturing its console output in a log file."""
+    log = io.StringIO()
+    result = job.as_dict()
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        with contextlib.redirect_stdout(log):
+            output = create_epub(job.source, os.path.join(out_dir, job.name), **options)
+        if output:
+            result.update(status='ok', output=output, output_bytes=os.path.getsize(output))
+        else:
+            result.update(status='failed', error="create_epub produced no archive")
+    except Exception as e:
+        result.update(status='error', error=f"{type(e).__name__}: {e}")
+    result['seconds'] = round(time.perf_counter() - start, 4)
+    result['cpu_seconds'] = round(time.process_time() - cpu_start, 4)
+
+    log_path = os.path.join(out_dir, f"{job.name}.log")
+    with open(log_path, 'w', encoding='utf-8') as f:
+        f.write(log.getvalue())
+    result['log'] = log_path
+    return result
+
+
+def load_previous(report_path):
+    """source -> entry from the last batch report, for changed-first ordering and skipping."""
+    try:
+        with open(report_path, 'r', encoding='utf-8') as f:
+            return {entry['source']: entry for entry in json.load(f)['books']}
+    except (OSError, ValueError, KeyError):
+        return {}
+
+
+def run_batch(paths, out_dir='batch_output', workers=1, order='largest', report_path=DEFAULT_REPORT,
+              skip_unchanged=False, **options):
+    """Build every book under paths; returns the report dict (also written to report_path)."""
+    os.makedirs(out_dir, exist_ok=True)
+    books = find_books(paths)
+
+    # Output names must be unique; disambiguate same-named roots
+    names = {}
+    jobs = []
+    unreadable = []
+    for book in books:
+        name = book.resolve().name
+        names[name] = names.get(name, 0) + 1
+        name = name if names[name] == 1 else f"{name}-{names[name]}"
+        try:
+            jobs.append(BookJob(book, name))
+        except (ParseError, ValueError, OSError) as e:
+            # One broken OPF fails that book, not the batch
+            unreadable.append({'book': name, 'source': str(book.resolve()), 'source_bytes': 0,
+                               'source_mtime': 0, 'changed': True, 'status': 'error',
+                               'error': f"Unreadable package: {type(e).__name__}: {e}",
+                               'seconds': 0.0, 'cpu_seconds': 0.0})
+            print(f"❌ {name}: {unreadable[-1]['error']}")
+
+    previous = load_previous(report_path)
+    jobs = order_jobs(jobs, order, previous)
+
+    results = unreadable
+    if skip_unchanged:
+        for job in [job for job in jobs if not job.changed]:
+            results.append(dict(previous[job.source], status='ok', skipped=True))
+        jobs = [job for job in jobs if job.changed]
+
+    print(f"📚 Building {len(jobs)} books with {workers} workers ({order} first)")
+    print("=" * 60)
+
+    batch_start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Submitted in priority order; the pool starts them in that order
+        futures = {pool.submit(build_book, job, out_dir, options): job for job in jobs}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                # The worker itself died (e.g. BrokenProcessPool); the rest of the batch still reports
+                result = dict(futures[future].as_dict(), status='error', error=f"{type(e).__name__}: {e}",
+                              seconds=0.0, cpu_seconds=0.0)
+            results.append(result)
+            icon = '✅' if result['status'] == 'ok' else '❌'
+            print(f"{icon} {result['book']}: {result['status']} in {result['seconds']:.2f}s")
+    wall = time.perf_counter() - batch_start
+
+    built = [r for r in results if not r.get('skipped')]
+    ok = sum(1 for r in built if r['status'] == 'ok')
+    source_bytes = sum(r['source_bytes'] for r in built)
+    report = {
+        'summary': {
+            'books': len(built),
+            'succeeded': ok,
+            'failed': len(built) - ok,
+            'skipped': len(results) - len(built),
+            'workers': workers,
+            'order': order,
+            'wall_seconds': round(wall, 4),
+            'books_per_minute': round(len(built) / wall * 60, 2) if wall else 0,
+            'source_bytes_per_second': round(source_bytes / wall) if wall else 0
+        },
+        'books': sorted(results, key=lambda r: r['book'])
+    }
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+
+    summary = report['summary']
+    print(f"\n📊 {summary['succeeded']}/{summary['books']} books built in {summary['wall_seconds']:.2f}s "
+          f"({summary['books_per_minute']} books/min)")
+    print(f"💾 Report saved to: {report_path}")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build many EPUBs concurrently")
+    parser.add_argument('sources', nargs='*', metavar='PATH',
+                        help="book roots, or directories containing book roots")
+    parser.add_argument('--list', metavar='FILE',
+                        help="file with one source path per line")
+    parser.add_argument('--out-dir', default='batch_output', help="where EPUBs and logs go")
+    parser.add_argument('--workers', '-w', type=int, default=0,
+                        help="books built at once (0 = one per CPU)")
+    parser.add_argument('--order', choices=ORDERS, default='largest',
+                        help="build priority (default: largest, for best total throughput)")
+    parser.add_argument('--incremental', action='store_true',
+                        help="reuse unchanged entries from each book's previous build")
+    parser.add_argument('--skip-unchanged', action='store_true',
+                        help="do not rebuild books unchanged since their last successful build")
+    parser.add_argument('--compression', choices=POLICY_MODES, default='table')
+    parser.add_argument('--report', default=DEFAULT_REPORT, help="JSON report path")
+    args = parser.parse_args()
+
+    sources = list(args.sources)
+    if args.list:
+        with open(args.list, 'r', encoding='utf-8') as f:
+            sources.extend(line.strip() for line in f if line.strip() and not line.startswith('#'))
+    if not sources:
+        parser.error("no book sources given")
+
+    report = run_batch(sources, args.out_dir, resolve_jobs(args.workers), args.order, args.report,
+                       args.skip_unchanged, incremental=args.incremental, compression=args.compression)
+    sys.exit(1 if report['summary']['failed'] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+EPUB Benchmark Harness - Time the packaging, fixer and checker scripts
+Generates a synthetic book of the requested size, then runs each target on
+a fresh copy of it in its own process, so wall time, CPU time and peak RSS
+belong to that target alone. Results go to JSON and can be compared with
+a stored baseline; a slowdown beyond the threshold fails the run.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import traceback
+from datetime import datetime
+from pathlib import Path
+
+from package_index import PackageIndex
+from epub_packager import resolve_jobs
+from synthetic_book import generate_book, add_book_arguments, book_options
+
+DEFAULT_RESULTS = 'benchmark_results.json'
+DEFAULT_BASELINE = 'benchmark_baseline.json'
+
+# rebuild_epub always packs this directory of the working directory
+BOOK_DIR = 'test_epub_extract'
+
+
+def _create_epub(jobs):
+    from create_final_epub import create_epub
+    return create_epub(BOOK_DIR, 'benchmark', jobs=jobs) is not None
+
+
+def _rebuild_epub(jobs):
+    from rebuild_epub import rebuild_epub
+    return rebuild_epub(jobs=jobs)
+
+
+def _fix_all_chapters(jobs):
+    from template_fixer import TemplateEnforcer
+    enforcer = TemplateEnforcer()
+    enforcer.oebps_path = Path(BOOK_DIR) / 'OEBPS'
+    enforcer.fix_all_chapters()
+    return True
+
+
+def _simple_analyze_all(jobs):
+    from simple_compliance_check import SimpleComplianceChecker
+    return bool(SimpleComplianceChecker([BOOK_DIR]).analyze_all(jobs=jobs))
+
+
+def _template_analyze_all(jobs):
+    from template_compliance_analysis import TemplateComplianceAnalyzer
+    return bool(TemplateComplianceAnalyzer(BOOK_DIR).analyze_all_chapters(jobs=jobs))
+
+
+# name -> (runner, what throughput counts: every packed file, or chapters only)
+TARGETS = {
+    'create_epub': (_create_epub, 'files'),
+    'rebuild_epub': (_rebuild_epub, 'files'),
+    'TemplateEnforcer.fix_all_chapters': (_fix_all_chapters, 'chapters'),
+    'SimpleComplianceChecker.analyze_all': (_simple_analyze_all, 'chapters'),
+    'TemplateComplianceAnalyzer.analyze_all_chapters': (_template_analyze_all, 'chapters'),
+}
+
+
+def _max_rss_mb(who):
+    # ru_maxrss is in KiB on Linux
+    return round(resource.getrusage(who).ru_maxrss / 1024, 1)
+
+
+def _run_target(name, workdir, jobs, conn):
+    """Child process: run one target in workdir and send back its measurements."""
+    os.chdir(workdir)
+    runner = TARGETS[name][0]
+    log = io.StringIO()
+    result = {'start_rss_mb': _max_rss_mb(resource.RUSAGE_SELF)}
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        with contextlib.redirect_stdout(log):
+            result['ok'] = bool(runner(jobs))
+    except Exception:
+        result['ok'] = False
+        result['error'] = traceback.format_exc(limit=3)
+    result['seconds'] = round(time.perf_counter() - start, 4)
+    result['cpu_seconds'] = round(time.process_time() - cpu_start, 4)
+    result['peak_rss_mb'] = _max_rss_mb(resource.RUSAGE_SELF)
+    result['peak_worker_rss_mb'] = _max_rss_mb(resource.RUSAGE_CHILDREN)
+    conn.send(result)
+    conn.close()
+
+
+def measure(name, book, scratch, jobs, run_no):
+    """One timed run of a target on a fresh copy of book; returns its measurements."""
+    workdir = os.path.join(scratch, f"run-{name.replace('.', '-')}-{run_no}")
+    shutil.copytree(book, os.path.join(workdir, BOOK_DIR))
+
+    # A fresh interpreter per run: peak RSS is not inherited from earlier runs
+    context = multiprocessing.get_context('spawn')
+    parent, child = context.Pipe(duplex=False)
+    process = context.Process(target=_run_target, args=(name, workdir, jobs, child))
+    process.start()
+    child.close()
+    try:
+        result = parent.recv()
+    except EOFError:
+        result = {'ok': False, 'error': 'benchmark process died'}
+    process.join()
+    shutil.rmtree(workdir, ignore_errors=True)
+    return result
+
+
+def book_stats(book):
+    """What the targets process: packed files and chapters, with their sizes."""
+    index = PackageIndex.load(book)
+    files = ['mimetype'] + index.package_order()
+    chapters = [index.full_path(item) for item in index.chapters()]
+    return {
+        'files': len(files),
+        'bytes': sum(os.path.getsize(os.path.join(book, path)) for path in files),
+        'chapters': len(chapters),
+        'chapter_bytes': sum(os.path.getsize(path) for path in chapters)
+    }
+
+
+def summarize(runs, units, unit_bytes):
+    ok_runs = [run for run in runs if run.get('ok')]
+    summary = {'runs': runs, 'ok': len(ok_runs) == len(runs)}
+    if not ok_runs:
+        return summary
+    median = statistics.median(run['seconds'] for run in ok_runs)
+    summary.update(
+        median_seconds=round(median, 4),
+        min_seconds=min(run['seconds'] for run in ok_runs),
+        median_cpu_seconds=round(statistics.median(run['cpu_seconds'] for run in ok_runs), 4),
+        peak_rss_mb=max(run['peak_rss_mb'] for run in ok_runs),
+        peak_worker_rss_mb=max(run['peak_worker_rss_mb'] for run in ok_runs),
+        units_per_second=round(units / median, 2) if median else None,
+        mb_per_second=round(unit_bytes / median / (1024 * 1024), 2) if median else None
+    )
+    return summary
+
+
+def compare(results, baseline, threshold):
+    """Per-target median time against the baseline's; returns (comparison, regressions)."""
+    comparison, regressions = {}, []
+    if baseline.get('book') != results['book'] or baseline.get('jobs') != results['jobs']:
+        print("⚠️  Baseline was measured on a different book or job count; ratios are indicative only")
+    for name, target in results['targets'].items():
+        before = baseline.get('targets', {}).get(name, {}).get('median_seconds')
+        after = target.get('median_seconds')
+        if not before or after is None:
+            continue
+        ratio = after / before
+        status = 'slower' if ratio > 1 + threshold else 'faster' if ratio < 1 - threshold else 'same'
+        comparison[name] = {'baseline_seconds': before, 'seconds': after,
+                            'ratio': round(ratio, 3), 'status': status}
+        if status == 'slower':
+            regressions.append(name)
+    return comparison, regressions
+
+
+def run_benchmarks(targets, options, repeat=3, jobs=1, scratch=None, keep=False):
+    """Generate the book and measure every target repeat times; returns the results dict."""
+    scratch = scratch or tempfile.mkdtemp(prefix='epub-benchmark-')
+    book = os.path.join(scratch, 'book')
+    try:
+        start = time.perf_counter()
+        generated = generate_book(book, **options)
+        stats = book_stats(book)
+        print(f"📚 Synthetic book: {stats['files']} files ({stats['bytes']:,} bytes), "
+              f"{stats['chapters']} chapters, generated in {time.perf_counter() - start:.2f}s")
+
+        results = {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'jobs': jobs,
+            'repeat': repeat,
+            'book': dict(options, **stats, defective_chapters=generated['defective_chapters']),
+            'targets': {}
+        }
+        for name in targets:
+            units_kind = TARGETS[name][1]
+            units = stats[units_kind]
+            unit_bytes = stats['bytes' if units_kind == 'files' else 'chapter_bytes']
+            runs = [measure(name, book, scratch, jobs, run_no) for run_no in range(repeat)]
+            target = summarize(runs, units, unit_bytes)
+            target['units'] = units_kind
+            results['targets'][name] = target
+            if target['ok']:
+                print(f"  ⏱️  {name}: {target['median_seconds']:.3f}s median, "
+                      f"{target['units_per_second']:,} {units_kind}/s, "
+                      f"{target['mb_per_second']} MB/s, peak RSS {target['peak_rss_mb']} MB")
+            else:
+                error = next((run.get('error') for run in runs if not run.get('ok')), '')
+                print(f"  ❌ {name}: failed\n{error}")
+        return results
+    finally:
+        if keep:
+            print(f"📁 Scratch directory kept: {scratch}")
+        else:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the EPUB scripts on a synthetic book")
+    add_book_arguments(parser)
+    parser.add_argument('--target', action='append', choices=list(TARGETS), dest='targets',
+                        help="target to run (repeatable; default: all)")
+    parser.add_argument('--repeat', type=int, default=3, help="timed runs per target (median is reported)")
+    parser.add_argument('--jobs', '-j', type=int, default=1, help="jobs passed to each target (0 = one per CPU)")
+    parser.add_argument('--output', default=DEFAULT_RESULTS, help="results JSON path")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="baseline JSON to compare against")
+    parser.add_argument('--save-baseline', action='store_true', help="store these results as the baseline")
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help="slowdown over the baseline counted as a regression (default 0.10 = 10%%)")
+    parser.add_argument('--work-dir', help="scratch directory (default: a temporary one)")
+    parser.add_argument('--keep', action='store_true', help="keep the scratch directory")
+    args = parser.parse_args()
+
+    print("🏁 EPUB benchmark")
+    print("=" * 60)
+    results = run_benchmarks(args.targets or list(TARGETS), book_options(args), args.repeat,
+                             resolve_jobs(args.jobs), args.work_dir, args.keep)
+
+    regressions = []
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        results['comparison'], regressions = compare(results, baseline, args.threshold)
+        print(f"\n📊 Against baseline {args.baseline} (created {baseline.get('created')}):")
+        for name, entry in results['comparison'].items():
+            icon = {'slower': '🔺', 'faster': '🔻', 'same': '='}[entry['status']]
+            print(f"  {icon} {name}: {entry['baseline_seconds']:.3f}s → {entry['seconds']:.3f}s "
+                  f"(x{entry['ratio']})")
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"\n💾 Results saved to: {args.output}")
+    if args.save_baseline:
+        shutil.copyfile(args.output, args.baseline)
+        print(f"📌 Baseline saved to: {args.baseline}")
+
+    failed = [name for name, target in results['targets'].items() if not target['ok']]
+    if failed or regressions:
+        print(f"❌ {len(failed)} failed, {len(regressions)} slower than baseline")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
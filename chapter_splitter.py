@@ -0,0 +1,428 @@
+#!/usr/bin/env python3
+"""
+EPUB Chapter Splitter - Break oversized spine documents into smaller ones
+Reading systems load and paginate one spine item at a time, so a long
+chapter costs open time and memory all at once. Each spine document is
+measured (bytes and element count); one over budget is cut at h2/section
+boundaries into several files, with the enclosing containers closed and
+reopened around each cut. The OPF manifest and spine gain the new parts,
+and every intra-book link (nav.xhtml and an EPUB 2 toc.ncx included) is
+pointed at the part that now holds its #fragment. Results go to a cache; the sources are not
+changed unless --in-place is given.
+"""
+
+import argparse
+import bisect
+import hashlib
+import json
+import os
+import posixpath
+import re
+import sys
+import shutil
+from urllib.parse import quote
+from xml.parsers import expat
+
+from package_index import PackageIndex, PackageError
+from reference_checker import resolve
+
+SPLIT_CACHE_NAME = '.split-cache'
+
+# Bump when splitting or link rewriting changes, so cached results are redone
+SPLITTER_VERSION = 1
+
+DEFAULT_MAX_KB = 32
+DEFAULT_MAX_ELEMENTS = 1500
+
+# No part smaller than this share of the byte budget is cut off on its own
+MIN_PART_SHARE = 0.25
+
+# Elements a cut may happen in front of
+CUT_TAGS = ('h2', 'section')
+# Containers that may be closed and reopened around a cut
+CONTAINER_TAGS = ('body', 'section', 'div', 'article', 'main', 'aside')
+# Attributes dropped from reopened containers: ids stay unique to the first part
+CLONE_DROP = re.compile(rb'\s(?:id|aria-labelledby|aria-describedby)\s*=\s*(?:"[^"]*"|\'[^\']*\')')
+
+START_TAG = re.compile(rb'<(?:[^>"\']|"[^"]*"|\'[^\']*\')*>')
+LINK_ATTR = re.compile(rb'(\s(?:href|xlink:href)\s*=\s*)(["\'])(.*?)\2', re.DOTALL)
+# <content src="..."/> of NCX navPoints
+NCX_SRC = re.compile(rb'(<content\s(?:[^>]*\s)?src\s*=\s*)(["\'])(.*?)\2', re.DOTALL)
+ATTR = r'(\s{name}\s*=\s*)(["\'])(.*?)\2'
+
+XHTML_TYPE = 'application/xhtml+xml'
+NCX_TYPE = 'application/x-dtbncx+xml'
+
+
+class DocumentScan:
+    """Offsets of the elements of one XHTML document and of the places it may be cut."""
+
+    def __init__(self, data):
+        self.data = data
+        self.starts = []              # byte offset of every element's start tag
+        self.ids = []                 # (offset, id)
+        self.cuts = []                # (offset, ((open tag bytes, tag name), ...) of containers to reopen)
+        self.body_start = self.body_end = None
+        self._body_depth = None
+        self._stack = []              # [tag, start tag bytes, children so far, is a cut point]
+
+        parser = expat.ParserCreate()
+        self._parser = parser
+        parser.StartElementHandler = self._start
+        parser.EndElementHandler = self._end
+        parser.Parse(data, True)
+
+    def _start(self, name, attrs):
+        offset = self._parser.CurrentByteIndex
+        tag = name.rpartition(':')[2].lower()
+        start_tag = START_TAG.match(self.data, offset).group(0)
+        self.starts.append(offset)
+        if 'id' in attrs:
+            self.ids.append((offset, attrs['id']))
+
+        parent = self._stack[-1] if self._stack else None
+        is_cut = False
+        if tag in CUT_TAGS and self.body_start is not None and parent is not None:
+            inner = self._stack[self._body_depth + 1:]
+            # Not the first child of an element we would cut in front of anyway
+            first_of_cut = parent[3] and parent[2] == 0
+            if all(entry[0] in CONTAINER_TAGS for entry in inner) and not first_of_cut:
+                self.cuts.append((offset, tuple((entry[1], entry[0]) for entry in inner)))
+                is_cut = True
+        if parent is not None:
+            parent[2] += 1
+        if tag == 'body':
+            self.body_start = offset + len(start_tag)
+            self._body_depth = len(self._stack)
+        self._stack.append([tag, start_tag, 0, is_cut])
+
+    def _end(self, name):
+        entry = self._stack.pop()
+        if entry[0] == 'body':
+            self.body_end = self._parser.CurrentByteIndex
+
+    def elements_between(self, start, end):
+        return bisect.bisect_left(self.starts, end) - bisect.bisect_left(self.starts, start)
+
+
+def plan_cuts(scan, max_bytes, max_elements):
+    """Cut points (indexes into scan.cuts) keeping every part within budget where the cuts allow."""
+    overhead = len(scan.data) - (scan.body_end - scan.body_start)
+    min_bytes = max_bytes * MIN_PART_SHARE
+
+    def too_big(start, end):
+        return (overhead + end - start > max_bytes or
+                scan.elements_between(start, end) > max_elements)
+
+    def worth_cutting(start, cut):
+        # Both sides of the cut must be more than a sliver
+        return cut - start >= min_bytes and scan.body_end - cut >= min_bytes
+
+    chosen = []
+    part_start = scan.body_start
+    previous = None
+    for number, (offset, _) in enumerate(scan.cuts):
+        if (too_big(part_start, offset) and previous is not None and
+                worth_cutting(part_start, scan.cuts[previous][0])):
+            chosen.append(previous)
+            part_start = scan.cuts[previous][0]
+        previous = number
+    if (too_big(part_start, scan.body_end) and previous is not None and
+            scan.cuts[previous][0] > part_start and worth_cutting(part_start, scan.cuts[previous][0])):
+        chosen.append(previous)
+    return chosen
+
+
+def split_document(scan, chosen):
+    """[(part bytes, (start offset, end offset) of its body slice)] of the document cut at the chosen points."""
+    data = scan.data
+    head = data[:scan.body_start]
+    tail = data[scan.body_end:]
+    bounds = [scan.body_start] + [scan.cuts[n][0] for n in chosen] + [scan.body_end]
+    ancestors = [()] + [scan.cuts[n][1] for n in chosen] + [()]
+
+    parts = []
+    for number in range(len(bounds) - 1):
+        start, end = bounds[number], bounds[number + 1]
+        reopen = b''.join(CLONE_DROP.sub(b'', tag) + b'\n' for tag, _ in ancestors[number])
+        close = b''.join(f'</{name}>\n'.encode('ascii') for _, name in reversed(ancestors[number + 1]))
+        # Text before the first cut keeps the body's own leading whitespace
+        parts.append((head + b'\n' + reopen + data[start:end] + close + tail if number else
+                      head + data[start:end] + close + tail, (start, end)))
+    return parts
+
+
+def _part_path(path, number):
+    stem, ext = posixpath.splitext(path)
+    return path if number == 0 else f"{stem}-part{number + 1}{ext}"
+
+
+def _set_attr(tag, name, value):
+    """Start tag (bytes) with attribute name set to value (or removed if value is None)."""
+    pattern = re.compile(ATTR.format(name=re.escape(name)).encode('ascii'), re.DOTALL)
+    if value is None:
+        return pattern.sub(b'', tag)
+    encoded = value.encode('utf-8')
+    if pattern.search(tag):
+        return pattern.sub(lambda m: m.group(1) + m.group(2) + encoded + m.group(2), tag, count=1)
+    end = -2 if tag.endswith(b'/>') else -1
+    return tag[:end].rstrip() + f' {name}="{value}"'.encode('utf-8') + tag[end:]
+
+
+def rewrite_links(data, doc_path, base_path, owners, pattern=LINK_ATTR):
+    """Point links into split documents at the part holding their fragment.
+
+    doc_path is where the document will live; base_path is the path its
+    links were written against (the original document, for a part).
+    pattern matches (attribute prefix, quote, link); NCX_SRC for an NCX.
+    """
+    doc_dir = posixpath.dirname(doc_path)
+
+    def replace(match):
+        raw = match.group(3).decode('utf-8')
+        resolved = resolve(base_path, raw)
+        if resolved is None or resolved[0] not in owners:
+            return match.group(0)
+        target, fragment = resolved
+        new_target = owners[target].get(fragment, target) if fragment else target
+        if new_target == doc_path and raw.startswith('#'):
+            return match.group(0)
+        if new_target == target and doc_path == base_path:
+            return match.group(0)
+        if new_target == doc_path:
+            value = f"#{quote(fragment)}"
+        else:
+            value = quote(posixpath.relpath(new_target, doc_dir)) + (f"#{quote(fragment)}" if fragment else '')
+        return match.group(1) + match.group(2) + value.encode('utf-8') + match.group(2)
+
+    return pattern.sub(replace, data)
+
+
+def _opf_with_parts(opf_data, item, part_paths, opf_dir, taken_ids):
+    """OPF bytes with a manifest item and spine itemref added after item's for each extra part."""
+    id_pattern = re.escape(item.id).encode('utf-8')
+    item_tag = re.search(rb'<item\s[^>]*\bid\s*=\s*["\']' + id_pattern + rb'["\'][^>]*>', opf_data)
+    ref_tag = re.search(rb'<itemref\s[^>]*\bidref\s*=\s*["\']' + id_pattern + rb'["\'][^>]*>', opf_data)
+    if item_tag is None:
+        return opf_data
+
+    items, refs = b'', b''
+    for number, (part_path, properties) in enumerate(part_paths[1:], start=2):
+        new_id = f"{item.id}-part{number}"
+        while new_id in taken_ids:
+            new_id += '-x'
+        taken_ids.add(new_id)
+        tag = _set_attr(item_tag.group(0), 'id', new_id)
+        tag = _set_attr(tag, 'href', quote(posixpath.relpath(part_path, opf_dir) if opf_dir else part_path))
+        tag = _set_attr(tag, 'properties', ' '.join(properties) or None)
+        items += b'\n' + _indent(opf_data, item_tag.start()) + tag
+        if ref_tag is not None:
+            refs += b'\n' + _indent(opf_data, ref_tag.start()) + _set_attr(ref_tag.group(0), 'idref', new_id)
+
+    # Insert at line ends, so comments after the original tags stay with them;
+    # the later position first, so the earlier one's offset is still valid
+    inserts = [(_line_end(opf_data, item_tag.end()), items)]
+    if ref_tag is not None:
+        inserts.append((_line_end(opf_data, ref_tag.end()), refs))
+    for position, text in sorted(inserts, reverse=True):
+        opf_data = opf_data[:position] + text + opf_data[position:]
+    return opf_data
+
+
+def _indent(data, position):
+    line_start = data.rfind(b'\n', 0, position) + 1
+    return re.match(rb'[ \t]*', data[line_start:position]).group(0)
+
+
+def _line_end(data, position):
+    end = data.find(b'\n', position)
+    return len(data) if end < 0 else end
+
+
+def _part_properties(properties, part):
+    """Manifest properties for one part: svg/scripted only where the part needs them."""
+    kept = [p for p in properties.split() if p not in ('svg', 'scripted')]
+    if b'<svg' in part:
+        kept.append('svg')
+    if b'<script' in part:
+        kept.append('scripted')
+    return kept
+
+
+def measure_spine(index):
+    """[(item, bytes, elements, DocumentScan or None)] for every XHTML spine document."""
+    rows = []
+    for item in index.spine:
+        if item.media_type != XHTML_TYPE or 'nav' in item.properties.split():
+            continue
+        with open(index.full_path(item), 'rb') as f:
+            data = f.read()
+        try:
+            scan = DocumentScan(data)
+        except expat.ExpatError:
+            scan = None
+        rows.append((item, len(data), len(scan.starts) if scan else None, scan))
+    return rows
+
+
+def split_book(index, max_bytes, max_elements):
+    """Split what is over budget; returns ({book-relative path: new bytes}, {original path: [part paths]})."""
+    outputs = {}
+    owners = {}                       # original path -> {id: part path}
+    splits = {}
+    taken_ids = set(index.by_id)
+    with open(os.path.join(index.root, *index.opf_path.split('/')), 'rb') as f:
+        opf_data = f.read()
+
+    for item, size, elements, scan in measure_spine(index):
+        if scan is None:
+            print(f"  ⚠️  {item.path}: not well-formed, left whole")
+            continue
+        if size <= max_bytes and elements <= max_elements:
+            continue
+        if scan.body_start is None or scan.body_end is None:
+            continue
+        chosen = plan_cuts(scan, max_bytes, max_elements)
+        if not chosen:
+            print(f"  ⚠️  {item.path}: {size:,} bytes, {elements} elements, but no h2/section boundary to cut at")
+            continue
+
+        parts = split_document(scan, chosen)
+        paths = [_part_path(item.path, number) for number in range(len(parts))]
+        # Each id belongs to the part its element starts in (head ids: the first part)
+        cut_offsets = [scan.cuts[n][0] for n in chosen]
+        owners[item.path] = {}
+        for offset, element_id in scan.ids:
+            owners[item.path].setdefault(element_id, paths[bisect.bisect_right(cut_offsets, offset)])
+        for part_path, (part, _) in zip(paths, parts):
+            outputs[part_path] = (part, item.path)
+        splits[item.path] = paths
+
+        props = [(path, _part_properties(item.properties, part)) for path, (part, _) in zip(paths, parts)]
+        opf_data = _opf_with_parts(opf_data, item, props, index.opf_dir, taken_ids)
+        if props[0][1] != item.properties.split():
+            # The first part may have lost an svg/scripted property
+            tag = re.search(rb'<item\s[^>]*\bid\s*=\s*["\']' + re.escape(item.id).encode('utf-8') +
+                            rb'["\'][^>]*>', opf_data)
+            opf_data = (opf_data[:tag.start()] +
+                        _set_attr(tag.group(0), 'properties', ' '.join(props[0][1]) or None) +
+                        opf_data[tag.end():])
+        print(f"  ✂️  {item.path}: {size:,} bytes, {elements} elements → {len(parts)} parts "
+              f"({', '.join(f'{len(part):,}' for part, _ in parts)} bytes)")
+
+    if not splits:
+        return {}, {}
+
+    # Every XHTML document (the new parts included) and NCX gets its links re-pointed
+    documents = dict(outputs)
+    for item in index.items:
+        if item.media_type in (XHTML_TYPE, NCX_TYPE) and item.path not in documents:
+            with open(index.full_path(item), 'rb') as f:
+                documents[item.path] = (f.read(), item.path)
+    result = {}
+    for path, (data, base) in documents.items():
+        pattern = NCX_SRC if index.media_type(path) == NCX_TYPE else LINK_ATTR
+        rewritten = rewrite_links(data, path, base, owners, pattern)
+        if rewritten != data or path in outputs:
+            result[path] = rewritten
+    result[index.opf_path] = opf_data
+    return result, splits
+
+
+def prune_cache(cache_dir, keep):
+    """Remove the result directories of cache_dir other than keep (earlier versions of the book)."""
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if os.path.isdir(path) and not os.path.samefile(path, keep):
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def split_chapters(index, max_kb=DEFAULT_MAX_KB, max_elements=DEFAULT_MAX_ELEMENTS, cache_dir=None):
+    """Split oversized spine documents of a book, into the split cache.
+
+    Returns (index of the split book, {book-relative path: cached file} for
+    every file that is new or changed); when nothing needs splitting, the
+    original index and an empty mapping.
+    """
+    cache_dir = cache_dir or os.path.join(index.root, SPLIT_CACHE_NAME)
+    key = hashlib.sha256(f"{SPLITTER_VERSION}:{max_kb}:{max_elements}".encode('ascii'))
+    for path in [index.opf_path] + [item.path for item in index.items if item.media_type in (XHTML_TYPE, NCX_TYPE)]:
+        full_path = os.path.join(index.root, *path.split('/'))
+        if os.path.exists(full_path):
+            with open(full_path, 'rb') as f:
+                key.update(path.encode('utf-8') + b'\0' + hashlib.sha256(f.read()).digest())
+    out_dir = os.path.join(cache_dir, key.hexdigest()[:32])
+    listing = os.path.join(out_dir, 'split.json')
+
+    if os.path.exists(listing):
+        with open(listing, 'r', encoding='utf-8') as f:
+            files = json.load(f)
+        if files:
+            print(f"  ♻️  Reusing split book ({len(files)} files) from {out_dir}")
+    else:
+        outputs, splits = split_book(index, max_kb * 1024, max_elements)
+        files = {}
+        if splits:
+            for path, data in outputs.items():
+                target = os.path.join(out_dir, *path.split('/'))
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                with open(target, 'wb') as f:
+                    f.write(data)
+                files[path] = target
+        os.makedirs(out_dir, exist_ok=True)
+        tmp_path = f"{listing}.{os.getpid()}.part"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(files, f)
+        os.replace(tmp_path, listing)
+        prune_cache(cache_dir, out_dir)
+
+    if not files:
+        return index, {}
+    with open(files[index.opf_path], 'rb') as f:
+        return PackageIndex.from_opf_bytes(f.read(), index.opf_path, index.root), files
+
+
+def print_measurements(index, max_kb, max_elements):
+    print(f"📏 Spine documents (budget {max_kb} KB, {max_elements} elements)")
+    for item, size, elements, _ in measure_spine(index):
+        over = size > max_kb * 1024 or (elements or 0) > max_elements
+        print(f"  {'⚠️ ' if over else '✅'} {item.name}: {size:,} bytes, "
+              f"{elements if elements is not None else 'not well-formed'} elements")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Split oversized spine documents at h2/section boundaries")
+    parser.add_argument('--source', default='.', metavar='DIR', help="book root")
+    parser.add_argument('--max-kb', type=int, default=DEFAULT_MAX_KB, help="size budget per spine document")
+    parser.add_argument('--max-elements', type=int, default=DEFAULT_MAX_ELEMENTS,
+                        help="element budget per spine document")
+    parser.add_argument('--measure', action='store_true', help="only report sizes and element counts")
+    parser.add_argument('--in-place', action='store_true',
+                        help="write the split documents, OPF and links into the book itself")
+    args = parser.parse_args()
+
+    try:
+        index = PackageIndex.load(args.source)
+    except (FileNotFoundError, PackageError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    if args.measure:
+        print_measurements(index, args.max_kb, args.max_elements)
+        return
+
+    print("✂️  Splitting oversized spine documents...")
+    split_index, files = split_chapters(index, args.max_kb, args.max_elements)
+    if not files:
+        print("✅ Nothing to split")
+        return
+    if args.in_place:
+        for path, cached in files.items():
+            shutil.copyfile(cached, os.path.join(args.source, *path.split('/')))
+        print(f"✅ {len(files)} files written into {args.source}")
+    else:
+        print(f"✅ {len(files)} split files ready in {os.path.join(args.source, SPLIT_CACHE_NAME)} "
+              f"({len(split_index.spine)} spine items)")
+
+
+if __name__ == "__main__":
+    main()
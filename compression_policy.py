@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+EPUB Compression Policy - Choose STORED or a deflate level per entry
+JPEG, PNG and woff2 payloads are already compressed, so deflating them
+burns CPU for a handful of bytes. The policy table picks a method per
+media type and size, and the "auto" mode measures a sample instead.
+"""
+
+import os
+import zipfile
+import zlib
+
+# Media types for the extensions found in OEBPS (case-insensitive)
+MEDIA_TYPES = {
+    '.xhtml': 'application/xhtml+xml',
+    '.html': 'application/xhtml+xml',
+    '.opf': 'application/oebps-package+xml',
+    '.ncx': 'application/x-dtbncx+xml',
+    '.xml': 'application/xml',
+    '.css': 'text/css',
+    '.js': 'application/javascript',
+    '.svg': 'image/svg+xml',
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.gif': 'image/gif',
+    '.webp': 'image/webp',
+    '.woff2': 'font/woff2',
+    '.woff': 'font/woff',
+    '.ttf': 'font/ttf',
+    '.otf': 'font/otf',
+    '.epub': 'application/epub+zip',
+}
+
+# Entries at or below this size are never worth a deflate stream
+MIN_DEFLATE_SIZE = 64
+
+# media type -> [(max_size or None, compress_type, level)], first matching row wins.
+# Media types not listed fall back to '*'. Text keeps the deflate level the
+# builds have always used (6); only already-compressed payloads change, to STORED.
+POLICY_TABLE = {
+    'image/jpeg': [(None, zipfile.ZIP_STORED, None)],
+    'image/png': [(None, zipfile.ZIP_STORED, None)],
+    'image/gif': [(None, zipfile.ZIP_STORED, None)],
+    'image/webp': [(None, zipfile.ZIP_STORED, None)],
+    'font/woff2': [(None, zipfile.ZIP_STORED, None)],
+    'font/woff': [(None, zipfile.ZIP_STORED, None)],
+    'application/epub+zip': [(None, zipfile.ZIP_STORED, None)],
+    'application/xhtml+xml': [(MIN_DEFLATE_SIZE, zipfile.ZIP_STORED, None),
+                              (None, zipfile.ZIP_DEFLATED, 6)],
+    'text/css': [(MIN_DEFLATE_SIZE, zipfile.ZIP_STORED, None),
+                 (None, zipfile.ZIP_DEFLATED, 6)],
+    '*': [(MIN_DEFLATE_SIZE, zipfile.ZIP_STORED, None),
+          (None, zipfile.ZIP_DEFLATED, 6)],
+}
+
+POLICY_MODES = ('fixed', 'table', 'auto')
+
+# Deflate levels tried by auto mode, cheapest first
+AUTO_LEVELS = (1, 6, 9)
+
+
+def guess_media_type(arcname):
+    """Media type for an archive path, based on its extension."""
+    ext = os.path.splitext(arcname)[1].lower()
+    return MEDIA_TYPES.get(ext, 'application/octet-stream')
+
+
+class CompressionPolicy:
+    """Maps (media type, size) to a compression strategy.
+
+    Strategies are plain tuples so they can be sent to worker processes and
+    stored in the build manifest:
+
+    - ('fixed', compress_type, level): use exactly this method
+    - ('auto', min_saving, tolerance, sample_size): decide from a trial
+      compression of the first sample_size bytes (see choose_auto)
+    """
+
+    def __init__(self, mode='table', level=6, table=None, min_saving=0.05,
+                 tolerance=0.02, sample_size=64 * 1024):
+        if mode not in POLICY_MODES:
+            raise ValueError(f"Unknown compression mode: {mode}")
+        self.mode = mode
+        self.level = level
+        self.table = table or POLICY_TABLE
+        self.min_saving = min_saving
+        self.tolerance = tolerance
+        self.sample_size = sample_size
+
+    def strategy_for(self, media_type, size):
+        if self.mode == 'fixed':
+            return ('fixed', zipfile.ZIP_DEFLATED, self.level)
+        if self.mode == 'auto':
+            return ('auto', self.min_saving, self.tolerance, self.sample_size)
+
+        rows = self.table.get(media_type, self.table['*'])
+        for max_size, compress_type, level in rows:
+            if max_size is None or size <= max_size:
+                return ('fixed', compress_type, level)
+        return ('fixed', zipfile.ZIP_DEFLATED, self.level)
+
+
+def fixed_strategy(compress_type, level):
+    """Strategy for callers that request an explicit method (e.g. mimetype)."""
+    if compress_type == zipfile.ZIP_STORED:
+        level = None
+    return ('fixed', compress_type, level)
+
+
+def choose_auto(data, strategy):
+    """Pick the cheapest deflate level whose output is within tolerance of the best.
+
+    If even the best level saves less than min_saving of the sample, the
+    entry is STORED. Returns (compress_type, level).
+    """
+    _, min_saving, tolerance, sample_size = strategy
+    sample = data[:sample_size]
+    if len(sample) <= MIN_DEFLATE_SIZE:
+        return zipfile.ZIP_STORED, None
+
+    sizes = []
+    for level in AUTO_LEVELS:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        sizes.append((level, len(compressor.compress(sample) + compressor.flush())))
+
+    best = min(size for _, size in sizes)
+    if best > len(sample) * (1 - min_saving):
+        return zipfile.ZIP_STORED, None
+
+    for level, size in sizes:
+        if size <= best * (1 + tolerance):
+            return zipfile.ZIP_DEFLATED, level
+    return zipfile.ZIP_DEFLATED, AUTO_LEVELS[-1]
+
+
+def resolve_strategy(data, strategy):
+    """Turn a strategy tuple into a concrete (compress_type, level) for this data."""
+    if strategy[0] == 'auto':
+        return choose_auto(data, strategy)
+    return strategy[1], strategy[2]
+
+
+class CompressionStats:
+    """Per-media-type totals of entries, bytes and compression CPU time."""
+
+    def __init__(self):
+        self.by_type = {}
+
+    def record(self, media_type, compress_type, file_size, compress_size, cpu_seconds, reused=False):
+        row = self.by_type.setdefault(media_type, {
+            'files': 0, 'reused': 0, 'stored': 0,
+            'bytes_in': 0, 'bytes_out': 0, 'cpu_seconds': 0.0
+        })
+        row['files'] += 1
+        row['bytes_in'] += file_size
+        row['bytes_out'] += compress_size
+        row['cpu_seconds'] += cpu_seconds
+        if reused:
+            row['reused'] += 1
+        if compress_type == zipfile.ZIP_STORED:
+            row['stored'] += 1
+
+    def as_dict(self):
+        return {media_type: dict(row, bytes_saved=row['bytes_in'] - row['bytes_out'])
+                for media_type, row in sorted(self.by_type.items())}
+
+    def print_report(self):
+        if not self.by_type:
+            return
+
+        print(f"\n📦 COMPRESSION REPORT")
+        print("=" * 60)
+        print(f"{'Media type':<31}{'Files':>6}{'Saved':>12}{'Ratio':>8}{'CPU ms':>9}")
+        total_in = total_out = 0
+        total_cpu = 0.0
+        for media_type, row in self.as_dict().items():
+            ratio = row['bytes_out'] / row['bytes_in'] if row['bytes_in'] else 1.0
+            print(f"{media_type:<31}{row['files']:>6}{row['bytes_saved']:>12,}"
+                  f"{ratio:>8.2f}{row['cpu_seconds'] * 1000:>9.1f}")
+            total_in += row['bytes_in']
+            total_out += row['bytes_out']
+            total_cpu += row['cpu_seconds']
+        print(f"{'Total':<31}{'':>6}{total_in - total_out:>12,}"
+              f"{(total_out / total_in if total_in else 1.0):>8.2f}{total_cpu * 1000:>9.1f}")
+
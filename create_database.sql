@@ -1,5 +1,6 @@
 -- SQLite Database Schema for XHTML Processing
 -- Run this manually if SQLite becomes available
+-- (results_store.py creates or migrates these tables and indexes automatically)
 
 CREATE TABLE IF NOT EXISTS validation_results (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -8,6 +9,7 @@ CREATE TABLE IF NOT EXISTS validation_results (
     validation_status TEXT,
     errors_found TEXT,
     fix_suggestions TEXT,
+    duration_seconds REAL,
     timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
 );
 
@@ -39,3 +41,24 @@ CREATE TABLE IF NOT EXISTS processing_state (
     results_summary TEXT,
     timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
 );
+
+CREATE INDEX IF NOT EXISTS idx_validation_results_file_path ON validation_results (file_path);
+CREATE INDEX IF NOT EXISTS idx_validation_results_batch_number ON validation_results (batch_number);
+CREATE INDEX IF NOT EXISTS idx_validation_results_timestamp ON validation_results (timestamp);
+CREATE INDEX IF NOT EXISTS idx_factcheck_results_file_path ON factcheck_results (file_path);
+CREATE INDEX IF NOT EXISTS idx_factcheck_results_timestamp ON factcheck_results (timestamp);
+CREATE INDEX IF NOT EXISTS idx_consistency_analysis_file_path ON consistency_analysis (file_path);
+CREATE INDEX IF NOT EXISTS idx_consistency_analysis_timestamp ON consistency_analysis (timestamp);
+CREATE INDEX IF NOT EXISTS idx_processing_state_batch_number ON processing_state (batch_number);
+CREATE INDEX IF NOT EXISTS idx_processing_state_timestamp ON processing_state (timestamp);
+
+-- Compliance results cache (created automatically by result_cache.py)
+CREATE TABLE IF NOT EXISTS check_cache (
+    file_path TEXT NOT NULL,
+    checker TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    ruleset_hash TEXT NOT NULL,
+    result TEXT NOT NULL,
+    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (file_path, checker)
+);
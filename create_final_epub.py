@@ -9,155 +9,148 @@ This script creates a professional, bestseller-quality EPUB with:
 """
 
 import os
+import sys
 import zipfile
 import time
+import argparse
+import contextlib
 from datetime import datetime
 
-def create_epub(source_dir="/root/repo", output_name="Curls-Contemplation-Stylists-Journey-PROFESSIONAL-BESTSELLER"):
-    """Create production-ready EPUB from source directory."""
+from epub_packager import EpubPackager, add_packaging_arguments, resolve_jobs
+from compression_policy import CompressionPolicy
+from package_index import PackageIndex, PackageError, INDEX_CACHE_NAME
+from image_optimizer import optimize_images, print_image_report, add_image_arguments
+from font_subsetter import subset_fonts
+from css_pruner import prune_stylesheets
+from chapter_splitter import split_chapters, DEFAULT_MAX_KB
+from search_index import build_search_index
+from package_gate import (gate_package, print_gate_report, add_budget_arguments,
+                          DEFAULT_MAX_ENTRY_KB, DEFAULT_MAX_TOTAL_MB)
+from instrumentation import active, add_instrumentation_arguments, instrumented_from_args
+
+def create_epub(source_dir=".", output_name="Curls-Contemplation-Stylists-Journey-PROFESSIONAL-BESTSELLER",
+                incremental=False, jobs=1, compression='table', output=None, image_profile=None,
+                subset=False, prune_css=False, minify_css=False, timestamp=True, split_kb=None,
+                search_index=None, max_entry_kb=DEFAULT_MAX_ENTRY_KB, max_total_mb=DEFAULT_MAX_TOTAL_MB):
+    """Create production-ready EPUB from source directory (the book root).
+
+    With incremental=True, a build manifest ({output_name}.manifest.json) records
+    the content hash of every entry, and entries unchanged since the previous
+    build are raw-copied from that build's archive instead of recompressed.
+    With jobs > 1, entries are compressed in that many worker processes.
+    compression selects the CompressionPolicy mode ('fixed', 'table' or 'auto').
+    image_profile (e.g. 'tablet') packs JPEG/PNG images downscaled and
+    re-encoded for that device profile, from the image cache.
+    subset=True packs embedded woff2 fonts cut down to the glyphs the book uses.
+    prune_css=True packs stylesheets without the rules no spine document can
+    match (minify_css=True also minifies them); the sources are not changed.
+    timestamp=False writes {output_name}.epub, replacing the previous build,
+    instead of a new timestamped file.
+    split_kb packs spine documents larger than that many KB split at h2/section
+    boundaries, with the OPF, nav and links rewritten to match (from the split
+    cache; the sources are not changed).
+    search_index writes a full-text index of the packed spine to that path.
+    Only mimetype, the container, the OPF and manifest items are packed;
+    byte-identical resources are packed once. No file is written (and None
+    is returned) if an entry is over max_entry_kb or all of them together
+    over max_total_mb, before compression; 0 disables either budget.
+
+    If output is a writable binary file object (stdout, a pipe, a socket file),
+    the EPUB is streamed into it with constant memory instead of being written
+    to a timestamped file; output cannot be combined with incremental.
+    """
     
-    # Create timestamp for unique filename
-    timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
-    epub_filename = f"{output_name}-{timestamp}.epub"
+    if output is not None:
+        epub_filename = getattr(output, 'name', '<stream>')
+        target = output
+    else:
+        # Create timestamp for unique filename
+        if timestamp:
+            epub_filename = f"{output_name}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.epub"
+        else:
+            epub_filename = f"{output_name}.epub"
+        target = epub_filename
+    manifest_path = f"{output_name}.manifest.json" if incremental else None
     
     print(f"Creating production-ready EPUB: {epub_filename}")
     print("=" * 60)
     
-    # Files to include in EPUB (in order)
-    file_structure = [
-        'mimetype',
-        'META-INF/container.xml',
-        'OEBPS/content.opf',
-        'OEBPS/text/nav.xhtml',
-        # Stylesheets
-        'OEBPS/styles/style.css',
-        'OEBPS/styles/fonts.css', 
-        'OEBPS/styles/print.css',
-        # Fonts
-        'OEBPS/fonts/Montserrat-Regular.woff2',
-        'OEBPS/fonts/Montserrat-Bold.woff2',
-        'OEBPS/fonts/librebaskerville-regular.woff2',
-        'OEBPS/fonts/librebaskerville-italic.woff2',
-        'OEBPS/fonts/librebaskerville-bold.woff2',
-        'OEBPS/fonts/CinzelDecorative.woff2'
-    ]
-    
-    # Add all text files in order
-    text_files = [
-        '1-TitlePage.xhtml',
-        '2-Copyright.xhtml',
-        '3-TableOfContents.xhtml',
-        '4-Dedication.xhtml',
-        '5-SelfAssessment.xhtml',
-        '6-affirmation-odyssey.xhtml',
-        '7-Preface.xhtml',
-        '8-Part-I-Foundations-of-Creative-Hairstyling.xhtml',
-        '9-chapter-i-unveiling-your-creative-odyssey.xhtml',
-        '10-chapter-ii-refining-your-creative-toolkit.xhtml',
-        '11-chapter-iii-reigniting-your-creative-fire.xhtml',
-        '12-Part-II-Building-Your-Professional-Practice.xhtml',
-        '13-chapter-iv-the-art-of-networking-in-freelance-hairstyling.xhtml',
-        '14-chapter-v-cultivating-creative-excellence-through-mentorship.xhtml',
-        '15-chapter-vi-mastering-the-business-of-hairstyling.xhtml',
-        '16-chapter-vii-embracing-wellness-and-self-care.xhtml',
-        '17-chapter-viii-advancing-skills-through-continuous-education.xhtml',
-        '18-Part-III-Advanced-Business-Strategies.xhtml',
-        '19-chapter-ix-stepping-into-leadership.xhtml',
-        '20-chapter-x-crafting-enduring-legacies.xhtml',
-        '21-chapter-xi-advanced-digital-strategies-for-freelance-hairstylists.xhtml',
-        '22-chapter-xii-financial-wisdom-building-sustainable-ventures.xhtml',
-        '23-chapter-xiii-embracing-ethics-and-sustainability-in-hairstyling.xhtml',
-        '24-Part-IV-Future-Focused-Growth.xhtml',
-        '25-chapter-xiv-the-impact-of-ai-on-the-beauty-industry.xhtml',
-        '26-chapter-xv-cultivating-resilience-and-well-being-in-hairstyling.xhtml',
-        '27-chapter-xvi-tresses-and-textures-embracing-diversity-in-hairstyling.xhtml',
-        '28-Conclusion.xhtml',
-        '29QuizKey.xhtml',
-        '30-SelfAssessment.xhtml',
-        '31-affirmations-close.xhtml',
-        '32-continued-learning-commitment.xhtml',
-        '33-Acknowledgments.xhtml',
-        '34-AbouttheAuthor.xhtml',
-        '35-CurlsContempCollective.xhtml',
-        '36-JournalingStart.xhtml',
-        '37-ManifestingJournal.xhtml',
-        '38-journal-page.xhtml',
-        '39-professional-development.xhtml',
-        '40-SMARTGoals.xhtml',
-        '41-self-care-journal.xhtml',
-        '42-VisionJournal.xhtml',
-        '43-DoodlePage.xhtml',
-        '44-bibliography.xhtml'
-    ]
+    metrics = active()
     
-    # Add text files to structure
-    for text_file in text_files:
-        file_structure.append(f'OEBPS/text/{text_file}')
+    # Files to include in EPUB (in order), straight from the OPF manifest and spine
+    try:
+        with metrics.stage('index'):
+            index = PackageIndex.load(source_dir, cache_path=(os.path.join(source_dir, INDEX_CACHE_NAME)
+                                                              if incremental else None))
+    except (FileNotFoundError, PackageError) as e:
+        print(f"❌ {e}")
+        return None
     
-    # Add all image files
-    image_files = [
-        'decorative-line.JPEG',
-        'endnote-marker.PNG',
-        'chapter-iv-quote.JPEG',
-        'toc-divider.PNG',
-        'Michael.JPEG',
-        'brushstroke.JPEG',
-        'part-border.JPEG',
-        'chapter-xiv-quote.JPEG',
-        'chapter-iii-quote.JPEG',
-        'quote-marks.PNG',
-        'chapter-xi-quote.JPEG',
-        'chapter-v-quote.JPEG',
-        'chapter-vii-quote.JPEG',
-        'chapter-x-quote.JPEG',
-        'preface-quote.JPEG',
-        'chapter-xiii-quote.JPEG',
-        'chapter-vi-quote.JPEG',
-        'chapter-frame.PNG',
-        'chapter-ii-quote.JPEG',
-        'quiz-checkbox.PNG',
-        'chapter-viii-quote.JPEG',
-        'conclusion-quote.JPEG',
-        'chapter-xvi-quote.JPEG',
-        'crown-ornament.PNG',
-        'chapter-xii-quote.JPEG',
-        'chapter-ix-quote.JPEG',
-        'chapter-i-quote.JPEG',
-        'ruled-paper.JPEG',
-        'chapter-xv-quote.JPEG'
-    ]
+    # Optimized image copies, by book-relative path (cached across builds)
+    images, fonts, styles = {}, {}, {}
+    if image_profile:
+        with metrics.stage('images'):
+            images = optimize_images(index, image_profile, jobs=jobs)
+    if subset:
+        with metrics.stage('fonts'):
+            fonts = subset_fonts(index)
+    if prune_css:
+        with metrics.stage('css'):
+            styles = prune_stylesheets(index, minify_css)
+    split_files = {}
+    if split_kb:
+        with metrics.stage('split'):
+            index, split_files = split_chapters(index, split_kb)
+    if search_index:
+        with metrics.stage('search'):
+            documents, paragraphs, terms = build_search_index(index, search_index, split_files)
+        print(f"🔎 Search index: {documents} documents, {paragraphs:,} paragraphs, {terms:,} terms → {search_index}")
     
-    # Add image files to structure
-    for image_file in image_files:
-        file_structure.append(f'OEBPS/images/{image_file}')
+    # The file each entry is packed from: optimized copies win over the sources
+    candidates = []
+    for file_path in ['mimetype'] + index.package_order():
+        source_path = (images[file_path].path if file_path in images else
+                       fonts.get(file_path) or styles.get(file_path) or split_files.get(file_path) or
+                       os.path.join(source_dir, file_path))
+        candidates.append((file_path, source_path))
+    with metrics.stage('gate'):
+        gate = gate_package(index, candidates, max_entry_kb, max_total_mb)
+    index = gate.index
+    print_gate_report(gate)
+    if not gate.ok:
+        print("❌ Package over its size budget; no EPUB written")
+        return None
     
     # Create the EPUB
-    with zipfile.ZipFile(epub_filename, 'w', zipfile.ZIP_DEFLATED, compresslevel=6) as epub:
+    policy = CompressionPolicy(compression, level=6)
+    with EpubPackager(target, compresslevel=6, manifest_path=manifest_path,
+                      jobs=jobs, policy=policy) as epub:
         
-        # Add mimetype first (uncompressed)
-        if os.path.exists('mimetype'):
-            epub.write('mimetype', compress_type=zipfile.ZIP_STORED)
-            print("✓ Added mimetype (uncompressed)")
-        
-        # Add all other files
+        # Add mimetype first (uncompressed), then every other entry the gate let through
         files_added = 0
-        for file_path in file_structure[1:]:  # Skip mimetype since we already added it
-            if os.path.exists(file_path):
-                epub.write(file_path)
-                files_added += 1
-                if files_added % 10 == 0:
-                    print(f"  Added {files_added} files...")
-            else:
-                print(f"  ⚠ Warning: File not found: {file_path}")
+        for entry in gate.entries:
+            if entry.arcname == 'mimetype':
+                epub.write(entry.source, 'mimetype', compress_type=zipfile.ZIP_STORED, digest=entry.digest)
+                print("✓ Added mimetype (uncompressed)")
+                continue
+            epub.write(entry.source, entry.arcname, media_type=index.media_type(entry.arcname),
+                       digest=entry.digest)
+            files_added += 1
+            if files_added % 10 == 0:
+                print(f"  Added {files_added} files...")
     
     # Get file size
-    file_size = os.path.getsize(epub_filename)
+    file_size = epub.bytes_written
     size_mb = file_size / (1024 * 1024)
     
     print(f"\n✅ EPUB created successfully!")
     print(f"📁 Filename: {epub_filename}")
     print(f"📊 File size: {size_mb:.2f} MB ({file_size:,} bytes)")
     print(f"📋 Files included: {files_added + 1}")  # +1 for mimetype
+    if incremental:
+        print(f"♻️  Reused {epub.reused} unchanged entries, compressed {epub.compressed}")
+    epub.stats.print_report()
+    print_image_report(images, image_profile)
     
     print(f"\n🎯 PROFESSIONAL FEATURES INCLUDED:")
     print("   ✅ EPUB Accessibility 1.1 metadata")
@@ -174,5 +167,61 @@ def create_epub(source_dir="/root/repo", output_name="Curls-Contemplation-Stylis
     return epub_filename
 
 if __name__ == "__main__":
-    final_epub = create_epub()
-    print(f"\n🚀 Ready for bestseller distribution: {final_epub}")
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Create production-ready EPUB")
+    parser.add_argument('--source', default='.', metavar='DIR',
+                        help="book root holding mimetype, META-INF and OEBPS (default: current directory)")
+    parser.add_argument('--incremental', action='store_true',
+                        help="reuse compressed entries from the previous build when unchanged")
+    parser.add_argument('--output', '-o', metavar='PATH',
+                        help="stream the EPUB to PATH (a pipe or FIFO works) or '-' for stdout")
+    add_packaging_arguments(parser)
+    add_image_arguments(parser)
+    add_instrumentation_arguments(parser)
+    add_budget_arguments(parser)
+    parser.add_argument('--subset-fonts', action='store_true',
+                        help="pack fonts subset to the glyphs the book uses (needs fontTools)")
+    parser.add_argument('--prune-css', action='store_true',
+                        help="pack stylesheets without rules the book never uses")
+    parser.add_argument('--minify-css', action='store_true',
+                        help="also minify the pruned stylesheets (implies --prune-css)")
+    parser.add_argument('--split-chapters', type=int, nargs='?', const=DEFAULT_MAX_KB, metavar='KB',
+                        help=f"pack spine documents over KB (default {DEFAULT_MAX_KB}) split at h2/section boundaries")
+    parser.add_argument('--search-index', metavar='PATH',
+                        help="also write a full-text search index of the book to PATH (see search_index.py)")
+    args = parser.parse_args()
+
+    if args.output and args.incremental:
+        parser.error("--output cannot be combined with --incremental")
+    metrics = instrumented_from_args('create_epub', args)
+
+    if args.output == '-':
+        # Keep stdout for EPUB bytes; progress goes to stderr
+        epub_stream = sys.stdout.buffer
+        with contextlib.redirect_stdout(sys.stderr), metrics:
+            final_epub = create_epub(args.source, jobs=resolve_jobs(args.jobs), compression=args.compression,
+                                     image_profile=args.images, subset=args.subset_fonts,
+                                     prune_css=args.prune_css or args.minify_css, minify_css=args.minify_css,
+                                     split_kb=args.split_chapters,
+                                     search_index=args.search_index, max_entry_kb=args.max_entry_kb,
+                                     max_total_mb=args.max_total_mb, output=epub_stream)
+    elif args.output:
+        with open(args.output, 'wb') as output, metrics:
+            final_epub = create_epub(args.source, jobs=resolve_jobs(args.jobs), compression=args.compression,
+                                     image_profile=args.images, subset=args.subset_fonts,
+                                     prune_css=args.prune_css or args.minify_css, minify_css=args.minify_css,
+                                     split_kb=args.split_chapters,
+                                     search_index=args.search_index, max_entry_kb=args.max_entry_kb,
+                                     max_total_mb=args.max_total_mb, output=output)
+    else:
+        with metrics:
+            final_epub = create_epub(args.source, incremental=args.incremental, jobs=resolve_jobs(args.jobs),
+                                     compression=args.compression, image_profile=args.images,
+                                     subset=args.subset_fonts, prune_css=args.prune_css or args.minify_css,
+                                     minify_css=args.minify_css, split_kb=args.split_chapters,
+                                     search_index=args.search_index, max_entry_kb=args.max_entry_kb,
+                                     max_total_mb=args.max_total_mb)
+
+    if final_epub is None:
+        sys.exit(1)
+    print(f"\n🚀 Ready for bestseller distribution: {final_epub}",
+          file=sys.stderr if args.output == '-' else sys.stdout)
\ No newline at end of file
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+EPUB CSS Pruner - Drop selectors no content document can match
+One pass over the XHTML documents of the manifest (spine and navigation
+document alike) collects every element name, class and id in use.
+Stylesheet rules whose selectors need a class, id or element that never
+occurs are removed (a selector is kept unless it provably cannot match),
+and the result can optionally be minified. Pruned copies are cached; the
+source stylesheets are not modified.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+from xml.parsers import expat
+
+from package_index import PackageIndex, PackageError
+
+CSS_CACHE_NAME = '.css-cache'
+
+# Bump when pruning or minifying changes, so cached results are redone
+PRUNER_VERSION = 1
+
+# Classes the chapter template relies on; always kept even if a build of
+# the book happens not to use them yet
+TEMPLATE_CLASSES = ('chapter-number-container', 'chapter-title-container', 'chapter-title-word')
+
+CSS_COMMENT = re.compile(r'/\*.*?\*/', re.DOTALL)
+CSS_STRING = re.compile(r'"(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\'')
+# Functional pseudo-classes whose arguments do not have to be present
+# (:not(.x) matches without .x; :is()/:where() need only one alternative)
+OPTIONAL_ARGUMENTS = re.compile(r':(?:not|is|where|has|matches|-\w+-any)\(')
+
+
+class UsageIndex:
+    """Element names, classes and ids used in any XHTML document of the book."""
+
+    def __init__(self):
+        self.tags = set()
+        self.classes = set(TEMPLATE_CLASSES)
+        self.ids = set()
+
+    def _start(self, name, attrs):
+        self.tags.add(name.rpartition(':')[2].lower())
+        self.classes.update(attrs.get('class', '').split())
+        if 'id' in attrs:
+            self.ids.add(attrs['id'])
+
+    def add_document(self, data):
+        parser = expat.ParserCreate()
+        parser.StartElementHandler = self._start
+        try:
+            parser.Parse(data, True)
+        except expat.ExpatError:
+            # Not well-formed: fall back to a tag/attribute regex over the whole file
+            text = data.decode('utf-8', 'ignore')
+            self.tags.update(t.lower() for t in re.findall(r'<([A-Za-z][\w:-]*)', text))
+            for value in re.findall(r'\bclass\s*=\s*["\']([^"\']*)["\']', text):
+                self.classes.update(value.split())
+            self.ids.update(re.findall(r'\bid\s*=\s*["\']([^"\']*)["\']', text))
+
+    @classmethod
+    def from_documents(cls, index):
+        usage = cls()
+        for item in index.items:
+            # Not just the spine: the nav document and other non-linear pages are styled too
+            if item.media_type != 'application/xhtml+xml' or not os.path.exists(index.full_path(item)):
+                continue
+            with open(index.full_path(item), 'rb') as f:
+                usage.add_document(f.read())
+        return usage
+
+    def signature(self):
+        data = json.dumps([sorted(self.tags), sorted(self.classes), sorted(self.ids)])
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def _strip_optional(selector):
+    """Remove :not()/:is()/... arguments, which a match does not require."""
+    while True:
+        match = OPTIONAL_ARGUMENTS.search(selector)
+        if not match:
+            return selector
+        depth, end = 1, match.end()
+        while depth and end < len(selector):
+            depth += {'(': 1, ')': -1}.get(selector[end], 0)
+            end += 1
+        selector = selector[:match.start()] + selector[end:]
+
+
+def selector_can_match(selector, usage):
+    """False only if the selector requires a class, id or element no document uses."""
+    selector = _strip_optional(selector)
+    selector = re.sub(r'\[[^\]]*\]', '', selector)
+    selector = re.sub(r'::?[\w-]+(\([^)]*\))?', '', selector)
+    for compound in re.split(r'[\s>+~]+', selector.strip()):
+        tag = re.match(r'[A-Za-z][\w-]*', compound)
+        if tag and tag.group(0).lower() not in usage.tags:
+            return False
+        if any(cls not in usage.classes for cls in re.findall(r'\.([\w-]+)', compound)):
+            return False
+        if any(i not in usage.ids for i in re.findall(r'#([\w-]+)', compound)):
+            return False
+    return True
+
+
+def split_selectors(prelude):
+    """Split a selector list on top-level commas."""
+    parts, depth, start = [], 0, 0
+    for pos, char in enumerate(prelude):
+        if char in '([':
+            depth += 1
+        elif char in ')]':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            parts.append(prelude[start:pos])
+            start = pos + 1
+    parts.append(prelude[start:])
+    return [part.strip() for part in parts if part.strip()]
+
+
+def _blocks(text):
+    """Yield (prelude, body or None) for each top-level statement of comment-free CSS."""
+    pos = 0
+    length = len(text)
+    while pos < length:
+        # Scan to the next '{' or ';' outside strings
+        start = pos
+        while pos < length and text[pos] not in '{;':
+            if text[pos] in '"\'':
+                match = CSS_STRING.match(text, pos)
+                pos = match.end() if match else pos + 1
+            else:
+                pos += 1
+        if pos >= length:
+            if text[start:].strip():
+                yield text[start:].strip(), None
+            return
+        if text[pos] == ';':
+            yield text[start:pos + 1].strip(), None
+            pos += 1
+            continue
+
+        prelude = text[start:pos].strip()
+        depth, body_start = 1, pos + 1
+        pos += 1
+        while pos < length and depth:
+            char = text[pos]
+            if char in '"\'':
+                match = CSS_STRING.match(text, pos)
+                pos = match.end() if match else pos + 1
+                continue
+            if char == '{':
+                depth += 1
+            elif char == '}':
+                depth -= 1
+            pos += 1
+        yield prelude, text[body_start:pos - 1]
+
+
+def prune_css(text, usage, stats=None):
+    """CSS text with unmatched selectors (and rules left empty) removed."""
+    stats = stats if stats is not None else {'rules_kept': 0, 'rules_dropped': 0, 'selectors_dropped': 0}
+    out = []
+    for prelude, body in _blocks(CSS_COMMENT.sub('', text)):
+        if body is None:
+            out.append(prelude)
+            continue
+        lowered = prelude.lower()
+        if lowered.startswith(('@media', '@supports', '@layer', '@document')):
+            inner = prune_css(body, usage, stats)
+            if inner.strip():
+                out.append(f"{prelude} {{\n{inner}\n}}")
+        elif lowered.startswith('@'):
+            # @font-face, @page, @keyframes, ...: not selector-based
+            out.append(f"{prelude} {{{body}}}")
+        else:
+            selectors = split_selectors(prelude)
+            kept = [s for s in selectors if selector_can_match(s, usage)]
+            stats['selectors_dropped'] += len(selectors) - len(kept)
+            if kept:
+                stats['rules_kept'] += 1
+                if len(kept) < len(selectors):
+                    prelude = ',\n'.join(kept)
+                out.append(f"{prelude} {{{body}}}")
+            else:
+                stats['rules_dropped'] += 1
+    return '\n\n'.join(out)
+
+
+def minify_css(text):
+    """Collapse whitespace around punctuation; strings are left untouched."""
+    strings = []
+
+    def stash(match):
+        strings.append(match.group(0))
+        return f"\0{len(strings) - 1}\0"
+
+    text = CSS_STRING.sub(stash, CSS_COMMENT.sub('', text))
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r'\s*([{};,])\s*', r'\1', text)
+    text = re.sub(r';}', '}', text)
+    text = re.sub(r'\0(\d+)\0', lambda m: strings[int(m.group(1))], text)
+    return text.strip()
+
+
+def prune_stylesheets(index, minify=False, cache_dir=None):
+    """Pruned (and optionally minified) copies of every manifest stylesheet.
+
+    Returns {book-relative css path: cached file path} for those that got smaller.
+    """
+    usage = UsageIndex.from_documents(index)
+    cache_dir = cache_dir or os.path.join(index.root, CSS_CACHE_NAME)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    pruned = {}
+    for item in index.items:
+        if item.media_type != 'text/css':
+            continue
+        source = index.full_path(item)
+        if not os.path.exists(source):
+            continue
+        with open(source, 'rb') as f:
+            data = f.read()
+
+        key = hashlib.sha256(data)
+        key.update(f"{PRUNER_VERSION}:{usage.signature()}:{int(minify)}".encode('ascii'))
+        cached_path = os.path.join(cache_dir, f"{key.hexdigest()}.css")
+        hit = os.path.exists(cached_path)
+        if not hit:
+            stats = {'rules_kept': 0, 'rules_dropped': 0, 'selectors_dropped': 0}
+            text = prune_css(data.decode('utf-8'), usage, stats)
+            text = minify_css(text) if minify else text + '\n'
+            tmp_path = f"{cached_path}.{os.getpid()}.part"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(text)
+            os.replace(tmp_path, cached_path)
+            print(f"  ✂️  {item.path}: dropped {stats['rules_dropped']} rules, "
+                  f"{stats['selectors_dropped']} selectors")
+
+        size = os.path.getsize(cached_path)
+        print(f"  {'♻️ ' if hit else '✅'} {item.path}: {len(data):,} → {size:,} bytes")
+        if size < len(data):
+            pruned[item.path] = cached_path
+    return pruned
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Remove CSS rules no document of the book uses")
+    parser.add_argument('--source', default='.', metavar='DIR', help="book root")
+    parser.add_argument('--minify', action='store_true', help="also minify the pruned CSS")
+    args = parser.parse_args()
+
+    print("🧹 Pruning unused CSS...")
+    try:
+        index = PackageIndex.load(args.source)
+    except (FileNotFoundError, PackageError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    pruned = prune_stylesheets(index, minify=args.minify)
+    print(f"✅ {len(pruned)} pruned stylesheets ready in {os.path.join(args.source, CSS_CACHE_NAME)}")
+
+
+if __name__ == "__main__":
+    main()
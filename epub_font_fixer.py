@@ -5,44 +5,62 @@ EPUB Font Link Fixer - Remove Google Fonts for EPUB compliance
 
 import os
 import re
+import sys
+import argparse
 from pathlib import Path
 
+from package_index import PackageIndex, PackageError
+from transform_pipeline import TransformPipeline
+from instrumentation import active, add_instrumentation_arguments, instrumented_from_args
+
+# The Google Fonts link line, with its surrounding whitespace
+GOOGLE_FONTS_PATTERN = r'\s*<link href="https://fonts\.googleapis\.com/css2[^>]*>\s*\n?'
+
+def remove_google_fonts(content, chapter_file, fixes):
+    """Transform-pipeline stage: drop the Google Fonts link line."""
+    if re.search(GOOGLE_FONTS_PATTERN, content):
+        content = re.sub(GOOGLE_FONTS_PATTERN, '', content)
+        fixes.append('Removed Google Fonts link')
+    return content
+
 def fix_google_fonts_in_chapters():
     """Remove Google Fonts links from all chapters for EPUB compliance."""
     
-    text_dir = Path('OEBPS/text')
-    chapter_files = list(text_dir.glob('*chapter*.xhtml'))
+    try:
+        index = PackageIndex.load('.')
+    except (FileNotFoundError, PackageError) as e:
+        print(f"❌ {e}")
+        return None
+    chapter_files = [Path(index.full_path(item)) for item in index.chapters()]
     
     print(f"🔧 Fixing Google Fonts links in {len(chapter_files)} chapters...")
     
+    pipeline = TransformPipeline()
+    pipeline.register('fonts', remove_google_fonts)
     fixed_count = 0
     
-    for chapter_file in chapter_files:
-        try:
-            with open(chapter_file, 'r', encoding='utf-8') as f:
-                content = f.read()
-            
-            # Remove the Google Fonts link line
-            google_fonts_pattern = r'\s*<link href="https://fonts\.googleapis\.com/css2[^>]*>\s*\n?'
-            
-            if re.search(google_fonts_pattern, content):
-                content = re.sub(google_fonts_pattern, '', content)
+    with active().stage('fix'):
+        for chapter_file in chapter_files:
+            try:
+                changed, notes = pipeline.run_file(chapter_file)
                 
-                with open(chapter_file, 'w', encoding='utf-8') as f:
-                    f.write(content)
-                
-                print(f"  ✅ Fixed: {chapter_file.name}")
-                fixed_count += 1
-            else:
-                print(f"  ℹ️  No Google Fonts found: {chapter_file.name}")
-                
-        except Exception as e:
-            print(f"  ❌ Error fixing {chapter_file.name}: {str(e)}")
+                if notes['fonts']:
+                    print(f"  ✅ Fixed: {chapter_file.name}")
+                    fixed_count += 1
+                else:
+                    print(f"  ℹ️  No Google Fonts found: {chapter_file.name}")
+                    
+            except Exception as e:
+                print(f"  ❌ Error fixing {chapter_file.name}: {str(e)}")
     
     print(f"\n📊 Summary: Fixed {fixed_count} out of {len(chapter_files)} chapters")
     return fixed_count
 
 def main():
+    parser = argparse.ArgumentParser(description="Remove Google Fonts links from all chapters")
+    add_instrumentation_arguments(parser)
+    args = parser.parse_args()
+    
     print("🚀 Starting EPUB Font Compliance Fix...")
     print("=" * 50)
     
@@ -50,7 +68,10 @@ def main():
         print("❌ OEBPS/text directory not found!")
         return
     
-    fixed_count = fix_google_fonts_in_chapters()
+    with instrumented_from_args('epub_font_fixer', args):
+        fixed_count = fix_google_fonts_in_chapters()
+    if fixed_count is None:
+        sys.exit(1)
     
     print(f"\n🎉 EPUB font compliance fix complete!")
     print(f"✅ {fixed_count} chapters now use local fonts only")
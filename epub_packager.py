@@ -0,0 +1,491 @@
+#!/usr/bin/env python3
+"""
+EPUB Packager - Low-level ZIP writer shared by the EPUB build scripts
+Writes every entry from its compressed bytes, so entries that have not
+changed since the previous build can be raw-copied out of the old archive
+instead of being decompressed and deflated again.
+"""
+
+import hashlib
+import json
+import os
+import struct
+import time
+import zipfile
+import zlib
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from compression_policy import (CompressionPolicy, CompressionStats, POLICY_MODES,
+                                fixed_strategy, guess_media_type, resolve_strategy)
+from instrumentation import active
+# Re-exported: the build scripts take --jobs from here along with the packager
+from parallel_checks import resolve_jobs
+
+LOCAL_HEADER = struct.Struct('<4s5H3L2H')
+CENTRAL_HEADER = struct.Struct('<4s6H3L5H2L')
+END_RECORD = struct.Struct('<4s4H2LH')
+DATA_DESCRIPTOR = struct.Struct('<4s3L')
+
+ZIP_VERSION = 20
+ZIP_MAX = 0xFFFFFFFF
+UTF8_FLAG = 0x800
+DESCRIPTOR_FLAG = 0x08
+
+# Read size for streaming output; bounds memory per entry
+STREAM_CHUNK = 64 * 1024
+
+CompressResult = namedtuple('CompressResult', [
+    'digest', 'file_size', 'crc', 'payload', 'compress_type', 'level', 'cpu_seconds'])
+
+
+def file_digest(data):
+    """Content hash used to decide whether an entry changed between builds."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def deflate(data, level):
+    """Raw deflate (no zlib header) as stored inside ZIP entries."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress_job(job):
+    """Read, hash and compress one file; runs in worker processes.
+
+    job is (filename, strategy, known_digest, digest). When the file's hash
+    equals known_digest the payload is returned as None so the caller can
+    reuse the previous build's bytes without compressing at all. digest, if
+    the caller already hashed the file, saves hashing it again (and, when it
+    matches known_digest, reading it at all).
+    """
+    filename, strategy, known_digest, digest = job
+    if digest is not None and digest == known_digest:
+        return CompressResult(digest, os.path.getsize(filename), None, None, None, None, 0.0)
+    with open(filename, 'rb') as f:
+        data = f.read()
+
+    digest = digest or file_digest(data)
+    if known_digest is not None and digest == known_digest:
+        return CompressResult(digest, len(data), None, None, None, None, 0.0)
+
+    cpu_start = time.process_time()
+    compress_type, level = resolve_strategy(data, strategy)
+    if compress_type == zipfile.ZIP_STORED:
+        payload = data
+    else:
+        payload = deflate(data, level)
+    crc = zlib.crc32(data)
+    cpu_seconds = time.process_time() - cpu_start
+    return CompressResult(digest, len(data), crc, payload, compress_type, level, cpu_seconds)
+
+
+def add_packaging_arguments(parser):
+    """Options shared by create_final_epub.py and rebuild_epub.py."""
+    parser.add_argument('--jobs', '-j', type=int, default=1, metavar='N',
+                        help="compress entries in N worker processes (0 = one per CPU)")
+    parser.add_argument('--compression', choices=POLICY_MODES, default='table',
+                        help="fixed: deflate everything; table: per media type (default); "
+                             "auto: trial-compress a sample of each entry")
+
+
+def _dos_datetime(date_time):
+    year, month, day, hour, minute, second = date_time
+    dos_date = (year - 1980) << 9 | month << 5 | day
+    dos_time = hour << 11 | minute << 5 | second // 2
+    return dos_time, dos_date
+
+
+class PackedEntry:
+    """One archive member with its payload already compressed."""
+
+    def __init__(self, info, payload, digest, level, strategy, cpu_seconds=0.0, reused=False):
+        self.info = info
+        self.payload = payload
+        self.digest = digest
+        self.level = level
+        self.strategy = strategy
+        self.cpu_seconds = cpu_seconds
+        self.reused = reused
+
+
+class PreviousBuild:
+    """Read-only view of the last build's manifest and archive."""
+
+    def __init__(self, manifest_path):
+        self.entries = {}
+        self.archive = None
+        self._zip = None
+        self._fp = None
+
+        if not manifest_path or not os.path.exists(manifest_path):
+            return
+
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        archive = manifest.get('archive')
+        if not archive or not os.path.exists(archive):
+            return
+
+        try:
+            self._zip = zipfile.ZipFile(archive, 'r')
+            self._fp = open(archive, 'rb')
+        except (OSError, zipfile.BadZipFile):
+            self.close()
+            return
+
+        self.archive = archive
+        self.entries = manifest.get('entries', {})
+
+    def known_digest(self, arcname, strategy):
+        """Hash recorded for arcname if it was built with the same strategy."""
+        recorded = self.entries.get(arcname)
+        if not recorded or recorded.get('strategy') != list(strategy):
+            return None
+        return recorded.get('sha256')
+
+    def raw_payload(self, arcname, digest, strategy):
+        """Return (payload, crc, compress_type, level) of an unchanged entry, or None."""
+        if self._zip is None or self.known_digest(arcname, strategy) != digest:
+            return None
+        recorded = self.entries[arcname]
+
+        try:
+            old_info = self._zip.getinfo(arcname)
+        except KeyError:
+            return None
+        if old_info.compress_type != recorded.get('compress_type'):
+            return None
+
+        self._fp.seek(old_info.header_offset)
+        header = self._fp.read(LOCAL_HEADER.size)
+        if len(header) != LOCAL_HEADER.size:
+            return None
+        fields = LOCAL_HEADER.unpack(header)
+        if fields[0] != b'PK\x03\x04':
+            return None
+        name_len, extra_len = fields[9], fields[10]
+        self._fp.seek(old_info.header_offset + LOCAL_HEADER.size + name_len + extra_len)
+        payload = self._fp.read(old_info.compress_size)
+        if len(payload) != old_info.compress_size:
+            return None
+        return payload, old_info.CRC, old_info.compress_type, recorded.get('level')
+
+    def close(self):
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+        if self._zip is not None:
+            self._zip.close()
+            self._zip = None
+
+
+class EpubPackager:
+    """Minimal ZipFile-like writer with optional incremental reuse.
+
+    Usage mirrors zipfile.ZipFile::
+
+        with EpubPackager('book.epub', manifest_path='book.manifest.json') as epub:
+            epub.write('mimetype', compress_type=zipfile.ZIP_STORED)
+            epub.write('OEBPS/content.opf')
+
+    Entries are queued by write() and compressed on close(), across
+    ``jobs`` worker processes when jobs > 1, then written in the order they
+    were queued so the archive is identical to a serial build.
+
+    The compression method of each entry comes from ``policy`` (a
+    CompressionPolicy); without one every entry is deflated at
+    compresslevel. An explicit compress_type passed to write() always wins.
+
+    When manifest_path is given, entries whose content hash and compression
+    strategy match the previous build are copied byte-for-byte from the
+    previous archive. A fresh manifest is written on close().
+
+    ``filename`` may also be a writable binary file object, including a
+    non-seekable one such as sys.stdout.buffer or a pipe. Entries are then
+    streamed in STREAM_CHUNK pieces: deflated entries carry a data
+    descriptor after their payload, STORED entries are CRC'd in a first read
+    so their local header is complete (readers cannot find the end of a
+    STORED entry otherwise). Memory stays bounded by the chunk size, so
+    streaming is serial and does not support manifests.
+    """
+
+    def __init__(self, filename, compresslevel=6, manifest_path=None, jobs=1, policy=None):
+        self._stream = hasattr(filename, 'write')
+        if self._stream and manifest_path:
+            raise ValueError("Incremental builds need a named output archive, not a stream")
+
+        self.filename = filename
+        self.compresslevel = compresslevel
+        self.manifest_path = manifest_path
+        self.jobs = jobs
+        self.policy = policy or CompressionPolicy('fixed', level=compresslevel)
+        self.stats = CompressionStats()
+        self.reused = 0
+        self.compressed = 0
+
+        self._previous = PreviousBuild(manifest_path)
+        if self._stream:
+            self._partial = None
+            self._fp = filename
+        else:
+            self._partial = f"{filename}.part"
+            self._fp = open(self._partial, 'wb')
+        self._offset = 0
+        self._pending = []
+        self._central = []
+        self._manifest_entries = {}
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write(self, filename, arcname=None, compress_type=None, media_type=None, digest=None):
+        """Queue a file from disk; entries are compressed and written on close().
+
+        digest is the file's file_digest() when the caller has already computed it.
+        """
+        if arcname is None:
+            arcname = filename
+        arcname = os.path.normpath(os.path.splitdrive(arcname)[1]).lstrip(os.sep)
+        arcname = arcname.replace(os.sep, '/')
+
+        if compress_type not in (None, zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+            raise NotImplementedError(f"Unsupported compression method: {compress_type}")
+
+        info = zipfile.ZipInfo.from_file(filename, arcname)
+        media_type = media_type or guess_media_type(arcname)
+        if compress_type is None:
+            strategy = self.policy.strategy_for(media_type, info.file_size)
+        else:
+            strategy = fixed_strategy(compress_type, self.compresslevel)
+        self._pending.append((filename, info, media_type, strategy, digest))
+
+    def _pack_pending(self):
+        """Compress queued entries (in a process pool when jobs > 1) and append them in queue order."""
+        pending, self._pending = self._pending, []
+        if self._stream:
+            for filename, info, media_type, strategy, digest in pending:
+                self._stream_entry(filename, info, media_type, strategy)
+            return
+
+        jobs = [(filename, strategy, self._previous.known_digest(info.filename, strategy), digest)
+                for filename, info, media_type, strategy, digest in pending]
+
+        if self.jobs > 1 and len(jobs) > 1:
+            chunksize = max(1, len(jobs) // (self.jobs * 4))
+            with ProcessPoolExecutor(max_workers=self.jobs) as pool:
+                self._append_results(pending, pool.map(compress_job, jobs, chunksize=chunksize))
+        else:
+            self._append_results(pending, map(compress_job, jobs))
+
+    def _append_results(self, pending, results):
+        # pool.map yields in submission order, so the archive layout never depends on scheduling
+        metrics = active()
+        for (filename, info, media_type, strategy, digest), result in zip(pending, results):
+            entry = self._finish(filename, info, strategy, result)
+            self.stats.record(media_type, info.compress_type, info.file_size, info.compress_size,
+                              entry.cpu_seconds, reused=entry.reused)
+            self._measure(metrics, info, entry.cpu_seconds, entry.reused)
+            self.add_entry(entry)
+
+    @staticmethod
+    def _measure(metrics, info, cpu_seconds, reused=False):
+        # Every source is read in full (to hash it, at least); reused entries are not recompressed
+        metrics.count('bytes_read', info.file_size)
+        if reused:
+            return
+        metrics.record_file('compress', info.filename, cpu_seconds)
+        if info.compress_type == zipfile.ZIP_DEFLATED:
+            metrics.count('bytes_compressed', info.compress_size)
+
+    def _finish(self, filename, info, strategy, result):
+        if result.payload is None:
+            reused = self._previous.raw_payload(info.filename, result.digest, strategy)
+            if reused is not None:
+                payload, info.CRC, info.compress_type, level = reused
+                info.file_size = result.file_size
+                info.compress_size = len(payload)
+                self.reused += 1
+                return PackedEntry(info, payload, result.digest, level, strategy, reused=True)
+            # Recorded hash matched but the old archive could not supply the bytes
+            result = compress_job((filename, strategy, None, result.digest))
+
+        info.file_size = result.file_size
+        info.CRC = result.crc
+        info.compress_type = result.compress_type
+        info.compress_size = len(result.payload)
+        self.compressed += 1
+        return PackedEntry(info, result.payload, result.digest, result.level, strategy,
+                           cpu_seconds=result.cpu_seconds)
+
+    def _stream_entry(self, filename, info, media_type, strategy):
+        """Write one entry in chunks without holding it in memory."""
+        cpu_start = time.process_time()
+        with open(filename, 'rb') as f:
+            head = f.read(max(STREAM_CHUNK, strategy[3] if strategy[0] == 'auto' else 0))
+            compress_type, level = resolve_strategy(head, strategy)
+            info.compress_type = compress_type
+            digest = hashlib.sha256()
+
+            if compress_type == zipfile.ZIP_STORED:
+                crc, size = 0, 0
+                chunk = head
+                while chunk:
+                    crc = zlib.crc32(chunk, crc)
+                    size += len(chunk)
+                    chunk = f.read(STREAM_CHUNK)
+                info.CRC, info.file_size, info.compress_size = crc, size, size
+                self._write_local_header(info, 0)
+                f.seek(0)
+                chunk = f.read(STREAM_CHUNK)
+                while chunk:
+                    digest.update(chunk)
+                    self._emit(chunk)
+                    chunk = f.read(STREAM_CHUNK)
+            else:
+                info.CRC = info.file_size = info.compress_size = 0
+                self._write_local_header(info, DESCRIPTOR_FLAG)
+                compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+                crc, size, compress_size = 0, 0, 0
+                chunk = head
+                while chunk:
+                    crc = zlib.crc32(chunk, crc)
+                    size += len(chunk)
+                    digest.update(chunk)
+                    out = compressor.compress(chunk)
+                    compress_size += len(out)
+                    self._emit(out)
+                    chunk = f.read(STREAM_CHUNK)
+                out = compressor.flush()
+                compress_size += len(out)
+                self._emit(out)
+
+                info.CRC, info.file_size, info.compress_size = crc, size, compress_size
+                self._check_limits(info)
+                self._emit(DATA_DESCRIPTOR.pack(b'PK\x07\x08', crc, compress_size, size))
+
+        cpu_seconds = time.process_time() - cpu_start
+        self.compressed += 1
+        self.stats.record(media_type, compress_type, info.file_size, info.compress_size, cpu_seconds)
+        self._measure(active(), info, cpu_seconds)
+        self._record_manifest(info, digest.hexdigest(), level, strategy)
+
+    def _emit(self, data):
+        self._fp.write(data)
+        self._offset += len(data)
+
+    def _check_limits(self, info):
+        if max(info.file_size, info.compress_size, self._offset) > ZIP_MAX:
+            raise zipfile.LargeZipFile("EPUB entries larger than 4 GiB are not supported")
+
+    def _write_local_header(self, info, flags):
+        self._check_limits(info)
+        name = info.filename.encode('utf-8')
+        if not info.filename.isascii():
+            flags |= UTF8_FLAG
+        dos_time, dos_date = _dos_datetime(info.date_time)
+
+        header = LOCAL_HEADER.pack(
+            b'PK\x03\x04', ZIP_VERSION, flags, info.compress_type,
+            dos_time, dos_date, info.CRC, info.compress_size, info.file_size,
+            len(name), 0)
+
+        self._central.append((info, name, flags, dos_time, dos_date, self._offset))
+        self._emit(header)
+        self._emit(name)
+
+    def add_entry(self, entry):
+        """Append an already-compressed entry to the archive."""
+        info = entry.info
+        self._write_local_header(info, 0)
+        self._emit(entry.payload)
+        self._record_manifest(info, entry.digest, entry.level, entry.strategy)
+
+    def _record_manifest(self, info, digest, level, strategy):
+        self._manifest_entries[info.filename] = {
+            'sha256': digest,
+            'compress_type': info.compress_type,
+            'level': level,
+            'strategy': list(strategy),
+            'size': info.file_size,
+            'compress_size': info.compress_size
+        }
+
+    @property
+    def bytes_written(self):
+        """Archive size so far; the final size once close() has run."""
+        return self._offset
+
+    def _write_central_directory(self):
+        start = self._offset
+        for info, name, flags, dos_time, dos_date, offset in self._central:
+            record = CENTRAL_HEADER.pack(
+                b'PK\x01\x02', ZIP_VERSION | (3 << 8), ZIP_VERSION, flags,
+                info.compress_type, dos_time, dos_date, info.CRC,
+                info.compress_size, info.file_size, len(name), 0, 0, 0, 0,
+                info.external_attr, offset)
+            self._emit(record)
+            self._emit(name)
+
+        size = self._offset - start
+        if len(self._central) > 0xFFFF or self._offset > ZIP_MAX:
+            raise zipfile.LargeZipFile("EPUB archive exceeds ZIP32 limits")
+        self._emit(END_RECORD.pack(
+            b'PK\x05\x06', 0, 0, len(self._central), len(self._central), size, start, 0))
+
+    def _write_manifest(self):
+        manifest = {
+            'archive': os.path.abspath(self.filename),
+            'entries': self._manifest_entries
+        }
+        tmp_path = f"{self.manifest_path}.part"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def close(self):
+        """Finish the archive and record the manifest for the next build."""
+        if self._closed:
+            return
+        try:
+            with active().stage('package'):
+                self._pack_pending()
+                self._write_central_directory()
+        except BaseException:
+            self.abort()
+            raise
+        active().count('bytes_written', self._offset)
+        self._closed = True
+        self._previous.close()
+        if self._stream:
+            self._fp.flush()
+            return
+        self._fp.close()
+        os.replace(self._partial, self.filename)
+        if self.manifest_path:
+            self._write_manifest()
+
+    def abort(self):
+        """Discard a partially written archive."""
+        if self._closed:
+            return
+        self._closed = True
+        self._pending = []
+        self._previous.close()
+        if self._stream:
+            # Bytes already sent down a stream cannot be taken back
+            return
+        self._fp.close()
+        if os.path.exists(self._partial):
+            os.remove(self._partial)
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+EPUB Sources - Read chapters from a book directory or straight out of a .epub
+The checkers take either kind of source. Chapters inside an archive are
+EpubMember objects that decompress their zip member only when read, so
+auditing a built .epub needs no extraction step.
+"""
+
+import hashlib
+import io
+import os
+import zipfile
+from collections import OrderedDict
+from pathlib import Path
+
+from package_index import PackageIndex
+
+# Open ZipFiles, so the central directory is parsed once however many
+# members are read. Keyed by pid as well: a forked worker must not share the
+# parent's file offset. Least recently used first; at most MAX_OPEN_ARCHIVES
+# stay open, so auditing many books does not run out of file descriptors.
+_archives = OrderedDict()
+MAX_OPEN_ARCHIVES = 8
+
+# Read size when hashing archive members
+HASH_CHUNK = 64 * 1024
+
+
+def _archive(epub_path):
+    key = (os.getpid(), epub_path)
+    zf = _archives.get(key)
+    if zf is not None:
+        _archives.move_to_end(key)
+        return zf
+    zf = _archives[key] = zipfile.ZipFile(epub_path)
+    while len(_archives) > MAX_OPEN_ARCHIVES:
+        _, evicted = _archives.popitem(last=False)
+        evicted.close()
+    return zf
+
+
+def close_archives():
+    """Close every archive this process opened (call once a run is finished)."""
+    for key in [key for key in _archives if key[0] == os.getpid()]:
+        _archives.pop(key).close()
+
+
+class EpubMember:
+    """A spine document inside a packed .epub."""
+
+    def __init__(self, epub_path, arcname):
+        self.epub_path = os.path.abspath(epub_path)
+        self.arcname = arcname
+
+    @property
+    def name(self):
+        return self.arcname.rsplit('/', 1)[-1]
+
+    @property
+    def label(self):
+        """Name qualified by its archive, for reports covering several books."""
+        return f"{os.path.basename(self.epub_path)}/{self.name}"
+
+    def open(self, encoding='utf-8', errors='strict'):
+        """Text stream over the member, with the newline handling of open()."""
+        return io.TextIOWrapper(_archive(self.epub_path).open(self.arcname),
+                                encoding=encoding, errors=errors)
+
+    @property
+    def size(self):
+        """Uncompressed size of the member."""
+        return _archive(self.epub_path).getinfo(self.arcname).file_size
+
+    def fingerprint(self):
+        """SHA-256 of the member's uncompressed bytes, as for chapters on disk."""
+        digest = hashlib.sha256()
+        with _archive(self.epub_path).open(self.arcname) as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def __str__(self):
+        return f"{self.epub_path}/{self.arcname}"
+
+    def __repr__(self):
+        return f"EpubMember({self.epub_path!r}, {self.arcname!r})"
+
+
+def is_epub(path):
+    return str(path).lower().endswith('.epub') and os.path.isfile(path)
+
+
+def chapter_sources(source):
+    """Chapters of one book, in spine order: Paths for a directory, EpubMembers for a .epub.
+
+    A .epub that is not a readable zip archive is reported and yields no
+    chapters. Raises FileNotFoundError if the book has no OPF.
+    """
+    if is_epub(source):
+        try:
+            index = PackageIndex.load_epub(source)
+        except zipfile.BadZipFile as e:
+            print(f"❌ Not a valid EPUB archive: {source} ({e})")
+            return []
+        return [EpubMember(source, item.path) for item in index.chapters()]
+    index = PackageIndex.load(source)
+    return [Path(index.full_path(item)) for item in index.chapters()]
+
+
+def open_chapter(chapter_file, encoding='utf-8', errors='strict'):
+    """Open a chapter from either kind of source for reading as text."""
+    if isinstance(chapter_file, EpubMember):
+        return chapter_file.open(encoding, errors)
+    return open(chapter_file, 'r', encoding=encoding, errors=errors)
+
+
+def chapter_key(chapter_file):
+    """Stable identity of a chapter across runs (e.g. for the result cache)."""
+    if isinstance(chapter_file, EpubMember):
+        return str(chapter_file)
+    return os.path.abspath(chapter_file)
+
+
+def chapter_size(chapter_file):
+    """Bytes a chapter holds (0 if it cannot be read)."""
+    try:
+        if isinstance(chapter_file, EpubMember):
+            return chapter_file.size
+        return os.path.getsize(chapter_file)
+    except (OSError, KeyError, zipfile.BadZipFile):
+        return 0
+
+
+def chapter_digest(chapter_file):
+    """Content hash of a chapter, or None if it cannot be read."""
+    try:
+        if isinstance(chapter_file, EpubMember):
+            return chapter_file.fingerprint()
+        with open(chapter_file, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except (OSError, KeyError, zipfile.BadZipFile):
+        return None
@@ -0,0 +1,423 @@
+#!/usr/bin/env python3
+"""
+EPUB Structural Validator - The epubcheck rules this book keeps hitting, in-process
+One pass over a book directory or a packed .epub checks container and
+mimetype placement, OPF manifest/spine consistency, media types against
+file signatures and manifest properties, and well-formedness and the XHTML
+namespace of every content document. Messages use epubcheck's IDs and
+layout, so reports can be compared line for line; it is not a replacement
+for a full epubcheck run before publishing.
+"""
+
+import argparse
+import json
+import os
+import posixpath
+import sys
+import zipfile
+from urllib.parse import unquote
+from xml.parsers import expat
+
+from package_index import CONTAINER_PATH, rootfile_path
+from instrumentation import active, add_instrumentation_arguments, instrumented_from_args
+
+MIMETYPE = 'application/epub+zip'
+XHTML_NS = 'http://www.w3.org/1999/xhtml'
+SVG_NS = 'http://www.w3.org/2000/svg'
+OPF_NS = 'http://www.idpf.org/2007/opf'
+
+XHTML_TYPE = 'application/xhtml+xml'
+
+# Leading bytes of the binary formats a book carries -> media types they may be declared as
+SIGNATURES = (
+    (b'\xff\xd8\xff', 'JPEG', ('image/jpeg',)),
+    (b'\x89PNG\r\n\x1a\n', 'PNG', ('image/png',)),
+    (b'GIF8', 'GIF', ('image/gif',)),
+    (b'wOF2', 'WOFF2', ('font/woff2', 'application/font-woff2')),
+    (b'wOFF', 'WOFF', ('font/woff', 'application/font-woff')),
+    (b'OTTO', 'OpenType', ('font/otf', 'application/font-sfnt', 'application/vnd.ms-opentype')),
+    (b'\x00\x01\x00\x00', 'TrueType', ('font/ttf', 'application/font-sfnt', 'application/x-font-ttf')),
+)
+
+# Image extensions and the format they promise (PKG-022)
+IMAGE_EXTENSIONS = {'.jpg': 'JPEG', '.jpeg': 'JPEG', '.png': 'PNG', '.gif': 'GIF'}
+
+# Severity of each message ID used, as epubcheck 5 reports them
+SEVERITY = {
+    'PKG-005': 'ERROR',     # mimetype entry has an extra field
+    'PKG-006': 'ERROR',     # mimetype missing or not the first entry
+    'PKG-007': 'ERROR',     # mimetype content wrong or compressed
+    'PKG-022': 'WARNING',   # image extension does not match its format
+    'RSC-001': 'ERROR',     # manifest file not found
+    'RSC-002': 'FATAL',     # container.xml missing
+    'RSC-003': 'ERROR',     # no rootfile in container.xml
+    'RSC-005': 'ERROR',     # content model / namespace error
+    'RSC-016': 'FATAL',     # not well-formed
+    'OPF-003': 'USAGE',     # file in the container but not in the manifest
+    'OPF-014': 'ERROR',     # content needs a property the manifest lacks
+    'OPF-015': 'ERROR',     # manifest declares a property the content does not need
+    'OPF-029': 'ERROR',     # file does not match its declared media type
+    'OPF-034': 'ERROR',     # spine references an item twice
+    'OPF-049': 'ERROR',     # spine idref not in the manifest
+    'OPF-074': 'ERROR',     # resource declared by several manifest items
+    'OPF-043': 'ERROR',     # non-content-document spine item
+}
+SEVERITY_ORDER = ('FATAL', 'ERROR', 'WARNING', 'USAGE', 'INFO')
+
+
+class Message:
+    """One finding, printed the way epubcheck prints it."""
+
+    def __init__(self, code, path, text, line=-1, column=-1):
+        self.code = code
+        self.severity = SEVERITY[code]
+        self.path = path
+        self.text = text
+        self.line = line
+        self.column = column
+
+    def format(self, book_name):
+        location = '/'.join(part for part in (book_name, self.path) if part)
+        return f"{self.severity}({self.code}): {location}({self.line},{self.column}): {self.text}"
+
+    def as_dict(self):
+        return {'severity': self.severity, 'id': self.code, 'path': self.path,
+                'line': self.line, 'column': self.column, 'message': self.text}
+
+
+class DirectoryBook:
+    """An unpacked book: files under root."""
+
+    def __init__(self, root):
+        self.root = str(root)
+        self.name = os.path.basename(os.path.abspath(self.root))
+
+    def exists(self, path):
+        return os.path.isfile(os.path.join(self.root, *path.split('/')))
+
+    def read(self, path, size=-1):
+        with open(os.path.join(self.root, *path.split('/')), 'rb') as f:
+            data = f.read(size)
+        active().count('bytes_read', len(data))
+        return data
+
+    def names(self, top):
+        """Book-relative paths of the files under top (hidden files skipped)."""
+        found = []
+        for dirpath, dirnames, filenames in os.walk(os.path.join(self.root, top)):
+            dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+            for name in sorted(filenames):
+                if not name.startswith('.'):
+                    relative = os.path.relpath(os.path.join(dirpath, name), self.root)
+                    found.append(relative.replace(os.sep, '/'))
+        return found
+
+    def close(self):
+        pass
+
+
+class ArchiveBook:
+    """A packed .epub, read straight from the zip."""
+
+    def __init__(self, epub_path):
+        self.zf = zipfile.ZipFile(epub_path)
+        self.name = os.path.basename(epub_path)
+        self.entries = {info.filename: info for info in self.zf.infolist()}
+
+    def exists(self, path):
+        return path in self.entries
+
+    def read(self, path, size=-1):
+        with self.zf.open(path) as f:
+            data = f.read(size)
+        active().count('bytes_read', len(data))
+        return data
+
+    def names(self, top):
+        prefix = f"{top}/" if top else ''
+        return [name for name in self.entries if name.startswith(prefix) and not name.endswith('/')]
+
+    def close(self):
+        self.zf.close()
+
+
+class BookValidator:
+    """Run every check over one book and collect the messages."""
+
+    def __init__(self, book):
+        self.book = book
+        self.messages = []
+        self.items = {}               # manifest id -> (path, media type, properties)
+
+    def report(self, code, path, text, line=-1, column=-1):
+        self.messages.append(Message(code, path, text, line, column))
+
+    # ------------------------------------------------------------------
+    # Container
+
+    def check_mimetype(self):
+        book = self.book
+        if isinstance(book, ArchiveBook):
+            infos = book.zf.infolist()
+            if not infos or infos[0].filename != 'mimetype':
+                self.report('PKG-006', '', "Mimetype file entry is missing or is not the first file in the archive.")
+            if 'mimetype' not in book.entries:
+                return
+            info = book.entries['mimetype']
+            if info.compress_type != zipfile.ZIP_STORED:
+                self.report('PKG-007', 'mimetype', "Mimetype file should only contain the string "
+                            "\"application/epub+zip\" and should not be compressed.")
+            if info.extra:
+                self.report('PKG-005', 'mimetype', f"The mimetype file has an extra field of length {len(info.extra)}. "
+                            "The use of the extra field feature of the ZIP format is not permitted for the mimetype file.")
+        elif not book.exists('mimetype'):
+            self.report('PKG-006', '', "Mimetype file entry is missing or is not the first file in the archive.")
+            return
+        if book.read('mimetype') != MIMETYPE.encode('ascii'):
+            self.report('PKG-007', 'mimetype', "Mimetype file should only contain the string "
+                        "\"application/epub+zip\" and should not be compressed.")
+
+    def find_package(self):
+        """Book-relative OPF path from container.xml, or None (after reporting why)."""
+        if not self.book.exists(CONTAINER_PATH):
+            self.report('RSC-002', CONTAINER_PATH, "Required META-INF/container.xml resource could not be found.")
+            return None
+        opf_path = rootfile_path(self.book.read(CONTAINER_PATH))
+        if not opf_path:
+            self.report('RSC-003', CONTAINER_PATH,
+                        "No rootfile tag with media type \"application/oebps-package+xml\" was found in the container.")
+            return None
+        if not self.book.exists(opf_path):
+            self.report('RSC-001', CONTAINER_PATH, f"File \"{opf_path}\" could not be found.")
+            return None
+        return opf_path
+
+    # ------------------------------------------------------------------
+    # Package document
+
+    def check_package(self, opf_path):
+        """Manifest and spine consistency; returns the manifest as {path: (id, media type, properties)}."""
+        opf_dir = posixpath.dirname(opf_path)
+        root = self.parse(opf_path, self.book.read(opf_path), keep=('item', 'itemref'))
+        if root is None:
+            return {}
+
+        manifest = {}
+        for item in root.iter(f'{{{OPF_NS}}}item'):
+            href = item.get('href', '')
+            path = posixpath.normpath(posixpath.join(opf_dir, unquote(href)))
+            entry = (item.get('id', ''), item.get('media-type', ''), item.get('properties', '').split())
+            if path in manifest:
+                self.report('OPF-074', opf_path, f"The package resource \"{path}\" is declared in several "
+                            "manifest items.", item.sourceline, -1)
+                continue
+            manifest[path] = entry
+            self.items[entry[0]] = (path,) + entry[1:]
+            if not self.book.exists(path):
+                self.report('RSC-001', opf_path, f"File \"{path}\" could not be found.", item.sourceline, -1)
+
+        seen = set()
+        for itemref in root.iter(f'{{{OPF_NS}}}itemref'):
+            idref = itemref.get('idref', '')
+            if idref not in self.items:
+                self.report('OPF-049', opf_path, f"Item id \"{idref}\" was not found in the manifest.",
+                            itemref.sourceline, -1)
+                continue
+            if idref in seen:
+                self.report('OPF-034', opf_path, f"The spine contains multiple references to the manifest "
+                            f"item with id \"{idref}\".", itemref.sourceline, -1)
+            seen.add(idref)
+            path, media_type, _ = self.items[idref]
+            if media_type not in (XHTML_TYPE, 'image/svg+xml'):
+                self.report('OPF-043', opf_path, f"Spine item \"{path}\" with non-standard media-type "
+                            f"\"{media_type}\" has no fallback to a content document.", itemref.sourceline, -1)
+
+        for path in self.book.names(opf_dir):
+            if path not in manifest and path != opf_path and path != 'mimetype':
+                self.report('OPF-003', path, f"Item \"{path}\" exists in the EPUB, but is not declared in the OPF manifest.")
+        return manifest
+
+    # ------------------------------------------------------------------
+    # Resources
+
+    def check_media_type(self, path, media_type):
+        """Declared media type against the file's signature and extension."""
+        head = self.book.read(path, 16)
+        found = next(((name, types) for magic, name, types in SIGNATURES if head.startswith(magic)), None)
+        expected = IMAGE_EXTENSIONS.get(os.path.splitext(path)[1].lower())
+        if found is None:
+            if any(media_type in types for _, _, types in SIGNATURES):
+                self.report('OPF-029', path, f"The file \"{path}\" does not appear to match the media type "
+                            f"{media_type}, as specified in the OPF file.")
+            return
+        name, types = found
+        if media_type not in types:
+            self.report('OPF-029', path, f"The file \"{path}\" does not appear to match the media type "
+                        f"{media_type}, as specified in the OPF file.")
+        if expected and expected != name:
+            self.report('PKG-022', path, f"Wrong file extension for image. The image is a \"{name}\" file "
+                        f"but has the file extension \"{os.path.splitext(path)[1][1:]}\".")
+
+    def check_document(self, path, properties):
+        """Well-formedness, the XHTML namespace and the svg/scripted manifest properties."""
+        features = set()
+        root = self.parse(path, self.book.read(path), features)
+        if root is None:
+            return
+        if root.tag != f'{{{XHTML_NS}}}html':
+            self.report('RSC-005', path, "Error while parsing file: the root element must be \"html\" "
+                        f"in the namespace \"{XHTML_NS}\".", root.sourceline, -1)
+        for feature in ('svg', 'scripted'):
+            if feature in features and feature not in properties:
+                self.report('OPF-014', path, f"The property \"{feature}\" should be declared in the OPF file.")
+            elif feature not in features and feature in properties:
+                self.report('OPF-015', path, f"The property \"{feature}\" should not be declared in the OPF file.")
+
+    def parse(self, path, data, features=None, keep=()):
+        """Root element (holding any descendants named in keep), or None (RSC-016) if not well-formed."""
+        parser = expat.ParserCreate(namespace_separator='}')
+        root = []
+
+        def start(name, attrs):
+            if not root:
+                root.append(_Element(name, attrs, parser.CurrentLineNumber))
+            elif name.rpartition('}')[2] in keep:
+                root[0].add(name, attrs, parser.CurrentLineNumber)
+            if features is not None:
+                if name.startswith(SVG_NS):
+                    features.add('svg')
+                elif name == f'{XHTML_NS}}}script':
+                    features.add('scripted')
+
+        parser.StartElementHandler = start
+        try:
+            parser.Parse(data, True)
+        except expat.ExpatError as e:
+            self.report('RSC-016', path, f"Fatal Error while parsing file: {expat.ErrorString(e.code)}.",
+                        e.lineno, e.offset + 1)
+            return None
+        return root[0] if root else None
+
+    # ------------------------------------------------------------------
+
+    def run(self):
+        metrics = active()
+        with metrics.stage('container'):
+            self.check_mimetype()
+            opf_path = self.find_package()
+        if opf_path is None:
+            return self.messages
+        with metrics.stage('package'):
+            manifest = self.check_package(opf_path)
+        with metrics.stage('resources'):
+            for path, (_, media_type, properties) in manifest.items():
+                if not self.book.exists(path):
+                    continue
+                with metrics.file('validate', path):
+                    if media_type == XHTML_TYPE:
+                        self.check_document(path, properties)
+                    else:
+                        self.check_media_type(path, media_type)
+        return self.messages
+
+
+class _Element:
+    """Root element plus selected elements beneath it: as much of a tree as the checks need."""
+
+    def __init__(self, name, attrs, line):
+        self.tag = '{' + name if '}' in name else name
+        self.attrs = attrs
+        self.sourceline = line
+        self.descendants = []
+
+    def add(self, name, attrs, line):
+        self.descendants.append(_Element(name, attrs, line))
+
+    def get(self, key, default=None):
+        return self.attrs.get(key, default)
+
+    def iter(self, tag):
+        return (e for e in self.descendants if e.tag == tag)
+
+
+def validate_documents(paths):
+    """Well-formedness and namespace checks of loose XHTML files (the old validate-xml.sh)."""
+    messages = []
+    for path in paths:
+        book = DirectoryBook(os.path.dirname(path) or '.')
+        validator = BookValidator(book)
+        validator.check_document(os.path.basename(path), [])
+        for message in validator.messages:
+            if message.code in ('RSC-016', 'RSC-005'):
+                message.path = path
+                messages.append(message)
+    return messages
+
+
+def validate(source):
+    """All messages for a book directory or .epub, most severe first."""
+    book = ArchiveBook(source) if os.path.isfile(source) else DirectoryBook(source)
+    try:
+        messages = BookValidator(book).run()
+    finally:
+        book.close()
+    messages.sort(key=lambda m: (SEVERITY_ORDER.index(m.severity), m.path, m.line))
+    return book.name, messages
+
+
+def print_messages(book_name, messages):
+    for message in messages:
+        print(message.format(book_name))
+    counts = {severity: sum(1 for m in messages if m.severity == severity) for severity in SEVERITY_ORDER}
+    print()
+    if counts['FATAL'] or counts['ERROR']:
+        print("❌ Check finished with errors")
+    elif counts['WARNING']:
+        print("⚠️  Check finished with warnings")
+    else:
+        print("✅ No errors or warnings detected")
+    print(f"Messages: {counts['FATAL']} fatals / {counts['ERROR']} errors / {counts['WARNING']} warnings / "
+          f"{counts['USAGE'] + counts['INFO']} infos")
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Validate EPUB structure in-process (epubcheck message IDs)")
+    parser.add_argument('paths', nargs='*', default=['.'],
+                        help="book directory or .epub (default: current directory), or individual XHTML files")
+    parser.add_argument('--json', metavar='PATH', help="also write the messages as JSON")
+    add_instrumentation_arguments(parser)
+    args = parser.parse_args()
+
+    documents = [p for p in args.paths if os.path.isfile(p) and not zipfile.is_zipfile(p)]
+    books = [p for p in args.paths if p not in documents]
+    results = {}
+    failed = False
+    with instrumented_from_args('epub_validator', args):
+        if documents:
+            messages = validate_documents(documents)
+            print(f"🔍 Validating {len(documents)} XHTML files")
+            counts = print_messages('', messages)
+            results['documents'] = [m.as_dict() for m in messages]
+            failed |= bool(counts['FATAL'] or counts['ERROR'])
+        for source in books:
+            if not os.path.exists(source):
+                print(f"❌ Not found: {source}")
+                failed = True
+                continue
+            print(f"🔍 Validating {source}")
+            book_name, messages = validate(source)
+            counts = print_messages(book_name, messages)
+            results[source] = [m.as_dict() for m in messages]
+            failed |= bool(counts['FATAL'] or counts['ERROR'])
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"💾 Messages saved to: {args.json}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
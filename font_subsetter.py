@@ -0,0 +1,429 @@
+#!/usr/bin/env python3
+"""
+EPUB Font Subsetter - Keep only the glyphs each embedded font family draws
+All spine documents are scanned once; each text node is attributed to the
+font-family the CSS cascade gives its element (inline style, linked
+stylesheets and their @imports, inheritance), and every @font-face file
+of that family is subset to those codepoints. Subsets are cached by font
+hash plus codepoint-set hash. Requires fontTools (and brotli for woff2).
+"""
+
+import argparse
+import hashlib
+import logging
+import os
+import posixpath
+import re
+import sys
+from urllib.parse import unquote
+from xml.parsers import expat
+
+try:
+    from fontTools import subset as ft_subset
+    from fontTools.ttLib import TTFont
+except ImportError:
+    ft_subset = None
+
+from package_index import PackageIndex, PackageError
+
+FONT_CACHE_NAME = '.font-cache'
+
+# Bump when the subsetting options change, so cached subsets are redone
+SUBSETTER_VERSION = 1
+
+# Always kept: space, no-break space, digits and list/counter punctuation
+BASELINE_CHARS = '\u0020\u00a00123456789.'
+
+# Elements whose text is never drawn
+HIDDEN_ELEMENTS = ('head', 'script', 'style')
+
+CSS_COMMENT = re.compile(r'/\*.*?\*/', re.DOTALL)
+CSS_IMPORT = re.compile(r'@import\s+(?:url\()?\s*[\'"]?([^\'")\s;]+)[\'"]?\s*\)?[^;]*;')
+CSS_STRING = re.compile(r'"((?:[^"\\]|\\.)*)"|\'((?:[^\'\\]|\\.)*)\'')
+FONT_SHORTHAND_FAMILY = re.compile(
+    r'(?:^|\s)(?:[\d.]+(?:px|em|rem|%|pt|pc|ex|ch|vw|vh|mm|cm|in)|'
+    r'xx-small|x-small|small|medium|large|x-large|xx-large|smaller|larger)(?:/\S+)?\s+(.+)$')
+
+
+def _family_names(value):
+    """Normalized family names from a font-family value."""
+    names = []
+    for part in value.split(','):
+        name = part.strip().strip('\'"').strip().lower()
+        if name:
+            names.append(name)
+    return names
+
+
+def _declarations(block):
+    """{property: (value, important)} from a declaration block."""
+    decls = {}
+    for decl in block.split(';'):
+        if ':' not in decl:
+            continue
+        prop, value = decl.split(':', 1)
+        value = value.strip()
+        important = value.lower().endswith('!important')
+        if important:
+            value = value[:-len('!important')].strip()
+        decls[prop.strip().lower()] = (value, important)
+    return decls
+
+
+def _font_family_of(decls):
+    """(families, important) declared by a rule, or None."""
+    if 'font-family' in decls:
+        value, important = decls['font-family']
+        return _family_names(value), important
+    if 'font' in decls:
+        value, important = decls['font']
+        match = FONT_SHORTHAND_FAMILY.search(value)
+        if match:
+            return _family_names(match.group(1)), important
+    return None
+
+
+def _generated_chars(value):
+    """Characters a content: value can draw."""
+    chars = ''.join(a or b for a, b in CSS_STRING.findall(value))
+    if 'counter' in value:
+        chars += BASELINE_CHARS
+    return chars
+
+
+class Compound:
+    """One compound selector (tag, #ids, .classes); attributes and pseudo-classes are ignored."""
+
+    def __init__(self, text):
+        text = re.sub(r'\[[^\]]*\]', '', text)
+        text = re.sub(r'::?[\w-]+(\([^)]*\))?', '', text)
+        match = re.match(r'[\w-]+|\*', text)
+        self.tag = match.group(0).lower() if match and match.group(0) != '*' else None
+        self.ids = set(re.findall(r'#([\w-]+)', text))
+        self.classes = set(re.findall(r'\.([\w-]+)', text))
+
+    def matches(self, element):
+        tag, element_id, classes = element
+        return ((self.tag is None or self.tag == tag) and
+                (not self.ids or self.ids == {element_id}) and
+                self.classes <= classes)
+
+
+class CssRule:
+    def __init__(self, selector, decls, order):
+        self.order = order
+        self.decls = decls
+        self.pseudo_content = bool(re.search(r'::?(before|after)\b', selector))
+        # Attribute selectors only narrow matches, but their values can hold
+        # combinator characters ([class~="note"], [title="a b"]); empty them first
+        selector = re.sub(r'\[[^\]]*\]', '[]', selector)
+        # Sibling combinators only narrow matches; keep the part right of them
+        selector = re.split(r'[+~]', selector)[-1]
+        parts = re.split(r'\s*>\s*|\s+', selector.strip())
+        self.compounds = [Compound(part) for part in parts if part]
+        ids = len(re.findall(r'#[\w-]+', selector))
+        classes = len(re.findall(r'\.[\w-]+|\[[^\]]*\]|(?<!:):[\w-]+', selector))
+        types = len(re.findall(r'(?:^|[\s>+~])[a-zA-Z][\w-]*', selector))
+        self.specificity = (ids, classes, types)
+
+    def key(self):
+        """Index key from the rightmost compound: ('id', x), ('class', x), ('tag', x) or None."""
+        last = self.compounds[-1] if self.compounds else None
+        if last is None:
+            return None
+        if last.ids:
+            return ('id', next(iter(last.ids)))
+        if last.classes:
+            return ('class', next(iter(last.classes)))
+        if last.tag:
+            return ('tag', last.tag)
+        return None
+
+    def matches(self, stack):
+        """Right-to-left descendant match against the element stack."""
+        if not self.compounds or not self.compounds[-1].matches(stack[-1]):
+            return False
+        pos = len(stack) - 2
+        for compound in reversed(self.compounds[:-1]):
+            while pos >= 0 and not compound.matches(stack[pos]):
+                pos -= 1
+            if pos < 0:
+                return False
+            pos -= 1
+        return True
+
+
+class Stylesheet:
+    """Rules affecting font choice, plus @font-face families, from one CSS file and its imports."""
+
+    def __init__(self):
+        self.rules = []
+        self.buckets = {}
+        self.font_faces = {}   # family -> [book-relative font paths]
+
+    def add_css(self, text, css_path, root, seen):
+        text = CSS_COMMENT.sub('', text)
+        for href in CSS_IMPORT.findall(text):
+            imported = posixpath.normpath(posixpath.join(posixpath.dirname(css_path), unquote(href)))
+            self.load(imported, root, seen)
+        text = CSS_IMPORT.sub('', text)
+        self._add_block(text, css_path)
+
+    def load(self, css_path, root, seen):
+        if css_path in seen:
+            return
+        seen.add(css_path)
+        try:
+            with open(os.path.join(root, *css_path.split('/')), 'r', encoding='utf-8') as f:
+                self.add_css(f.read(), css_path, root, seen)
+        except OSError:
+            pass
+
+    def _add_block(self, text, css_path):
+        pos = 0
+        while True:
+            brace = text.find('{', pos)
+            if brace < 0:
+                return
+            prelude = text[pos:brace].strip()
+            # Find the matching close brace
+            depth, end = 1, brace + 1
+            while depth and end < len(text):
+                if text[end] == '{':
+                    depth += 1
+                elif text[end] == '}':
+                    depth -= 1
+                end += 1
+            body = text[brace + 1:end - 1]
+            pos = end
+
+            lowered = prelude.lower()
+            if lowered.startswith('@font-face'):
+                self._add_font_face(_declarations(body), css_path)
+            elif lowered.startswith(('@media', '@supports', '@layer')):
+                # Conditional rules may apply on some reader; keep them all
+                self._add_block(body, css_path)
+            elif not lowered.startswith('@'):
+                decls = _declarations(body)
+                if _font_family_of(decls) is None and 'content' not in decls:
+                    continue
+                for selector in prelude.split(','):
+                    rule = CssRule(selector, decls, len(self.rules))
+                    self.rules.append(rule)
+                    self.buckets.setdefault(rule.key(), []).append(rule)
+
+    def _add_font_face(self, decls, css_path):
+        if 'font-family' not in decls or 'src' not in decls:
+            return
+        family = _family_names(decls['font-family'][0])[0]
+        for url in re.findall(r'url\(\s*[\'"]?([^\'")]+)[\'"]?\s*\)', decls['src'][0]):
+            path = posixpath.normpath(posixpath.join(posixpath.dirname(css_path), unquote(url)))
+            self.font_faces.setdefault(family, [])
+            if path not in self.font_faces[family]:
+                self.font_faces[family].append(path)
+
+    def matching(self, stack):
+        tag, element_id, classes = stack[-1]
+        candidates = list(self.buckets.get(None, ()))
+        candidates += self.buckets.get(('tag', tag), ())
+        if element_id:
+            candidates += self.buckets.get(('id', element_id), ())
+        for cls in classes:
+            candidates += self.buckets.get(('class', cls), ())
+        return [rule for rule in candidates if rule.matches(stack)]
+
+
+class GlyphCollector:
+    """Streams XHTML documents, adding each drawn character to its element's families."""
+
+    def __init__(self, stylesheet):
+        self.css = stylesheet
+        self.embedded = set(stylesheet.font_faces)
+        self.codepoints = {family: set(BASELINE_CHARS) for family in self.embedded}
+
+    def _add(self, families, chars):
+        for family in families:
+            if family in self.embedded:
+                self.codepoints[family].update(chars)
+
+    def scan(self, data):
+        stack = []       # (tag, id, classes) per open element
+        families = []    # resolved family list per open element
+        hidden = [0]
+
+        def start(name, attrs):
+            tag = name.rpartition(':')[2].lower()
+            stack.append((tag, attrs.get('id'), set(attrs.get('class', '').split())))
+            inherited = families[-1] if families else []
+            if tag in HIDDEN_ELEMENTS:
+                hidden[0] += 1
+
+            best = None
+            for rule in self.css.matching(stack):
+                if rule.pseudo_content:
+                    if 'content' in rule.decls:
+                        declared = _font_family_of(rule.decls)
+                        self._add(declared[0] if declared else self.embedded,
+                                  _generated_chars(rule.decls['content'][0]))
+                    continue
+                declared = _font_family_of(rule.decls)
+                if declared:
+                    rank = (declared[1], rule.specificity, rule.order)
+                    if best is None or rank > best[0]:
+                        best = (rank, declared[0])
+
+            resolved = best[1] if best else inherited
+            inline = _font_family_of(_declarations(attrs.get('style', '')))
+            if inline and not (best and best[0][0]):
+                resolved = inline[0]
+            if resolved and resolved[0] in ('inherit', 'unset'):
+                resolved = inherited
+            families.append(resolved)
+
+        def end(name):
+            if stack.pop()[0] in HIDDEN_ELEMENTS:
+                hidden[0] -= 1
+            families.pop()
+
+        def text(chars):
+            if not hidden[0] and families and chars.strip():
+                # text-transform and small-caps can draw either case
+                self._add(families[-1], chars + chars.swapcase())
+
+        parser = expat.ParserCreate()
+        parser.StartElementHandler = start
+        parser.EndElementHandler = end
+        parser.CharacterDataHandler = text
+        parser.Parse(data, True)
+
+
+def collect_codepoints(index):
+    """Scan every XHTML document once; returns (Stylesheet, {family: set of chars})."""
+    stylesheet = Stylesheet()
+    seen = set()
+    inline = set()
+    style_pattern = re.compile(rb'<link\b[^>]*>|<style\b[^>]*>(.*?)</style\s*>', re.IGNORECASE | re.DOTALL)
+    href_pattern = re.compile(rb'href\s*=\s*["\']([^"\']+)["\']')
+
+    documents = []
+    for item in index.items:
+        # The nav document and non-linear pages draw glyphs too, not only the spine
+        if item.media_type != 'application/xhtml+xml' or not os.path.exists(index.full_path(item)):
+            continue
+        with open(index.full_path(item), 'rb') as f:
+            data = f.read()
+        documents.append(data)
+        for match in style_pattern.finditer(data):
+            tag = match.group(0)
+            if tag[:6].lower() == b'<style':
+                # Applied book-wide like linked sheets: at worst a subset keeps a few extra glyphs
+                block = match.group(1).decode('utf-8', 'ignore')
+                if block not in inline:
+                    inline.add(block)
+                    stylesheet.add_css(block, item.path, index.root, seen)
+            elif b'stylesheet' in tag.lower():
+                href = href_pattern.search(tag)
+                if href:
+                    css_path = posixpath.normpath(posixpath.join(
+                        posixpath.dirname(item.path), unquote(href.group(1).decode('utf-8'))))
+                    stylesheet.load(css_path, index.root, seen)
+
+    collector = GlyphCollector(stylesheet)
+    for data in documents:
+        try:
+            collector.scan(data)
+        except expat.ExpatError:
+            # Unparseable document: keep every character of its text for all families
+            text = re.sub(rb'<[^>]*>', b' ', data).decode('utf-8', 'ignore')
+            collector._add(collector.embedded, text + text.swapcase())
+    return stylesheet, collector.codepoints
+
+
+def fonttools_available():
+    return ft_subset is not None
+
+
+def subset_font(font_path, chars, cache_dir):
+    """Subset one font to chars as woff2 in cache_dir; returns (cached path, from cache)."""
+    with open(font_path, 'rb') as f:
+        font_data = f.read()
+    codepoints = sorted({ord(c) for c in chars})
+    codepoint_hash = hashlib.sha256(','.join(map(str, codepoints)).encode('ascii')).hexdigest()
+    font_hash = hashlib.sha256(font_data).hexdigest()
+    key = hashlib.sha256(f"{SUBSETTER_VERSION}:{font_hash}:{codepoint_hash}".encode('ascii')).hexdigest()
+    cached_path = os.path.join(cache_dir, f"{key}.woff2")
+    if os.path.exists(cached_path):
+        return cached_path, True
+
+    # fontTools logs every table it cannot subset (e.g. FFTM); those are just dropped
+    logging.getLogger('fontTools.subset').setLevel(logging.ERROR)
+    options = ft_subset.Options()
+    options.flavor = 'woff2'
+    options.layout_features = ['*']
+    options.name_IDs = ['*']
+    options.notdef_outline = True
+    font = TTFont(font_path)
+    subsetter = ft_subset.Subsetter(options)
+    subsetter.populate(unicodes=codepoints)
+    subsetter.subset(font)
+
+    tmp_path = f"{cached_path}.{os.getpid()}.part"
+    ft_subset.save_font(font, tmp_path, options)
+    os.replace(tmp_path, cached_path)
+    return cached_path, False
+
+
+def subset_fonts(index, cache_dir=None):
+    """Subset every @font-face woff2 the book uses.
+
+    Returns {book-relative font path: cached subset path}; empty (with a
+    warning) when fontTools is not installed.
+    """
+    if not fonttools_available():
+        print("⚠️  fontTools not installed; fonts are packed unsubset (pip install fonttools brotli)")
+        return {}
+
+    cache_dir = cache_dir or os.path.join(index.root, FONT_CACHE_NAME)
+    os.makedirs(cache_dir, exist_ok=True)
+    stylesheet, codepoints = collect_codepoints(index)
+
+    subsets = {}
+    for family, paths in sorted(stylesheet.font_faces.items()):
+        for path in paths:
+            font_file = os.path.join(index.root, *path.split('/'))
+            if not path.lower().endswith('.woff2') or not os.path.exists(font_file):
+                continue
+            cached_path, hit = subset_font(font_file, codepoints[family], cache_dir)
+            original, subset = os.path.getsize(font_file), os.path.getsize(cached_path)
+            print(f"  {'♻️ ' if hit else '✂️ '} {path}: {len(codepoints[family])} characters, "
+                  f"{original:,} → {subset:,} bytes")
+            if subset < original:
+                subsets[path] = cached_path
+    return subsets
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Subset embedded fonts to the glyphs the book uses")
+    parser.add_argument('--source', default='.', metavar='DIR', help="book root")
+    parser.add_argument('--list', action='store_true',
+                        help="only print the characters used per font family")
+    args = parser.parse_args()
+
+    try:
+        index = PackageIndex.load(args.source)
+    except (FileNotFoundError, PackageError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    if args.list:
+        _, codepoints = collect_codepoints(index)
+        for family, chars in sorted(codepoints.items()):
+            print(f"{family} ({len(chars)}): {''.join(sorted(chars))}")
+        return
+
+    print("✂️  Subsetting fonts...")
+    subsets = subset_fonts(index)
+    print(f"✅ {len(subsets)} subset fonts ready in {os.path.join(args.source, FONT_CACHE_NAME)}")
+
+
+if __name__ == "__main__":
+    main()
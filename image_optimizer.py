@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+EPUB Image Optimizer - Downscale and re-encode images for a device profile
+Optimized copies live in a cache keyed by the source image's hash and the
+settings used, so each image is processed once and every later build
+reuses the result. Requires Pillow; without it images are packed as-is.
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+from package_index import PackageIndex, PackageError
+from epub_packager import resolve_jobs
+
+IMAGE_CACHE_NAME = '.image-cache'
+
+# Longest edge in pixels (None = keep size) and JPEG quality per reading device
+DEVICE_PROFILES = {
+    'phone': {'max_dimension': 1080, 'jpeg_quality': 80},
+    'tablet': {'max_dimension': 1600, 'jpeg_quality': 85},
+    'eink': {'max_dimension': 1264, 'jpeg_quality': 75},
+    'print': {'max_dimension': None, 'jpeg_quality': 92},
+}
+
+OPTIMIZED_TYPES = ('image/jpeg', 'image/png')
+
+# Bump when the encoding code changes, so cached results are redone
+OPTIMIZER_VERSION = 1
+
+
+class OptimizedImage:
+    """Outcome for one source image."""
+
+    def __init__(self, source, path, source_bytes, output_bytes, cached, seconds=0.0):
+        self.source = source
+        self.path = path                  # file to pack: cached copy, or the source itself
+        self.source_bytes = source_bytes
+        self.output_bytes = output_bytes
+        self.cached = cached
+        self.seconds = seconds
+
+
+def pillow_available():
+    return Image is not None
+
+
+def settings_for(profile):
+    if profile not in DEVICE_PROFILES:
+        raise ValueError(f"Unknown device profile: {profile}")
+    return dict(DEVICE_PROFILES[profile], version=OPTIMIZER_VERSION)
+
+
+def encode_image(data, media_type, settings):
+    """Downscale and re-encode image bytes; returns the new bytes.
+
+    JPEGs are re-encoded at the profile's quality (progressive, optimized
+    Huffman tables); PNGs are only re-compressed, which is lossless.
+    Metadata other than the ICC profile is dropped.
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        icc_profile = image.info.get('icc_profile')
+        image = ImageOps.exif_transpose(image)
+
+        max_dimension = settings['max_dimension']
+        if max_dimension and max(image.size) > max_dimension:
+            image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+
+        out = io.BytesIO()
+        if media_type == 'image/jpeg':
+            if image.mode not in ('RGB', 'L', 'CMYK'):
+                image = image.convert('RGB')
+            image.save(out, 'JPEG', quality=settings['jpeg_quality'], optimize=True,
+                       progressive=True, icc_profile=icc_profile)
+        else:
+            image.save(out, 'PNG', optimize=True, icc_profile=icc_profile)
+        return out.getvalue()
+
+
+def _optimize_one(job):
+    """Worker: (source, media_type, settings, cache_dir) -> OptimizedImage."""
+    source, media_type, settings, cache_dir = job
+    with open(source, 'rb') as f:
+        data = f.read()
+
+    key = hashlib.sha256(data)
+    key.update(json.dumps(settings, sort_keys=True).encode('utf-8'))
+    cached_path = os.path.join(cache_dir, key.hexdigest() + os.path.splitext(source)[1].lower())
+    if os.path.exists(cached_path):
+        return OptimizedImage(source, cached_path, len(data), os.path.getsize(cached_path), True)
+
+    start = time.perf_counter()
+    try:
+        optimized = encode_image(data, media_type, settings)
+    except (OSError, ValueError, SyntaxError, Image.DecompressionBombError):
+        # Not decodable (or not really an image); cache the original bytes
+        optimized = data
+    if len(optimized) >= len(data):
+        optimized = data
+
+    tmp_path = f"{cached_path}.{os.getpid()}.part"
+    with open(tmp_path, 'wb') as f:
+        f.write(optimized)
+    os.replace(tmp_path, cached_path)
+    return OptimizedImage(source, cached_path, len(data), len(optimized), False,
+                          time.perf_counter() - start)
+
+
+def optimize_images(index, profile='tablet', cache_dir=None, jobs=1):
+    """Optimize every JPEG/PNG in the manifest of index.
+
+    Returns {book-relative path: OptimizedImage}; empty (with a warning)
+    when Pillow is not installed.
+    """
+    if not pillow_available():
+        print("⚠️  Pillow not installed; images are packed unoptimized (pip install Pillow)")
+        return {}
+
+    settings = settings_for(profile)
+    cache_dir = cache_dir or os.path.join(index.root, IMAGE_CACHE_NAME)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    items = [item for item in index.items
+             if item.media_type in OPTIMIZED_TYPES and os.path.exists(index.full_path(item))]
+    work = [(index.full_path(item), item.media_type, settings, cache_dir) for item in items]
+    if jobs > 1 and len(work) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(_optimize_one, work, chunksize=max(1, len(work) // (jobs * 4))))
+    else:
+        results = [_optimize_one(job) for job in work]
+    return {item.path: result for item, result in zip(items, results)}
+
+
+def print_image_report(results, profile):
+    if not results:
+        return
+    source_bytes = sum(r.source_bytes for r in results.values())
+    output_bytes = sum(r.output_bytes for r in results.values())
+    cached = sum(1 for r in results.values() if r.cached)
+    seconds = sum(r.seconds for r in results.values())
+    print(f"\n🖼️  IMAGES ({profile}): {len(results)} files, {cached} from cache, "
+          f"{source_bytes:,} → {output_bytes:,} bytes ({seconds:.2f}s encoding)")
+
+
+def add_image_arguments(parser):
+    """--images PROFILE for build scripts."""
+    parser.add_argument('--images', choices=sorted(DEVICE_PROFILES), metavar='PROFILE',
+                        help=f"optimize JPEG/PNG for a device profile ({', '.join(sorted(DEVICE_PROFILES))})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Optimize EPUB images into the image cache")
+    parser.add_argument('--source', default='.', metavar='DIR', help="book root")
+    parser.add_argument('--profile', choices=sorted(DEVICE_PROFILES), default='tablet')
+    parser.add_argument('--jobs', '-j', type=int, default=0, help="worker processes (0 = one per CPU)")
+    args = parser.parse_args()
+
+    try:
+        index = PackageIndex.load(args.source)
+    except (FileNotFoundError, PackageError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    results = optimize_images(index, args.profile, jobs=resolve_jobs(args.jobs))
+    for path, result in results.items():
+        saved = result.source_bytes - result.output_bytes
+        print(f"  {'♻️ ' if result.cached else '✅'} {path}: {result.source_bytes:,} → "
+              f"{result.output_bytes:,} bytes ({saved:,} saved)")
+    print_image_report(results, args.profile)
+
+
+if __name__ == "__main__":
+    main()
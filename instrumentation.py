@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Instrumentation - Stage and per-file timers and I/O counters for the EPUB tools
+A tool opens one run with instrumented(); library code (packager, transform
+pipeline, checkers) reports into whatever run is active through active(),
+which is a no-op recorder when nothing is being measured. A run can be
+exported as JSON and as a Prometheus textfile-collector file, and can
+capture a cProfile of the whole run.
+"""
+
+import contextlib
+import cProfile
+import json
+import os
+import pstats
+import time
+
+# When set, every instrumented tool writes <dir>/epub_<tool>.prom by default
+METRICS_DIR_ENV = 'EPUB_METRICS_DIR'
+
+# Slowest files kept per stage in the JSON export
+SLOWEST_FILES = 20
+
+# Profile entries (by cumulative time) kept in the JSON export
+PROFILE_TOP = 25
+
+# Always exported; tools may count other things too (bytes_* names are byte counts)
+COUNTERS = ('bytes_read', 'bytes_written', 'bytes_compressed')
+
+
+class Instrumentation:
+    """Timings and counters for one run of one tool."""
+
+    def __init__(self, tool, profile_path=None):
+        self.tool = tool
+        self.profile_path = profile_path
+        self.stages = {}
+        self.files = {}
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.started = None
+        self.seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.ok = None
+        self.profile = None
+        self._profiler = None
+        self._start = self._cpu_start = 0.0
+
+    # ------------------------------------------------------------------
+    # Recording
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Time a named stage; repeated stages accumulate."""
+        start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            row = self.stages.setdefault(name, {'calls': 0, 'seconds': 0.0, 'cpu_seconds': 0.0})
+            row['calls'] += 1
+            row['seconds'] += time.perf_counter() - start
+            row['cpu_seconds'] += time.process_time() - cpu_start
+
+    @contextlib.contextmanager
+    def file(self, stage, path):
+        """Time the work on one file within a stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_file(stage, path, time.perf_counter() - start)
+
+    def record_file(self, stage, path, seconds):
+        """Add a per-file time measured elsewhere (e.g. in a worker process)."""
+        files = self.files.setdefault(stage, {})
+        key = str(path)
+        files[key] = files.get(key, 0.0) + seconds
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def file_seconds(self, stage, path):
+        """Time recorded for one file in a stage, or None."""
+        return self.files.get(stage, {}).get(str(path))
+
+    # ------------------------------------------------------------------
+    # Run
+
+    def start(self):
+        self.started = time.time()
+        if self.profile_path:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        self._start = time.perf_counter()
+        self._cpu_start = time.process_time()
+
+    def stop(self, ok=True):
+        self.seconds = time.perf_counter() - self._start
+        self.cpu_seconds = time.process_time() - self._cpu_start
+        self.ok = ok
+        if self._profiler:
+            self._profiler.disable()
+            self._profiler.dump_stats(self.profile_path)
+            self.profile = _profile_summary(self._profiler)
+            self._profiler = None
+
+    # ------------------------------------------------------------------
+    # Export
+
+    def as_dict(self):
+        files = {}
+        for stage, times in self.files.items():
+            slowest = sorted(times.items(), key=lambda item: -item[1])[:SLOWEST_FILES]
+            files[stage] = {
+                'files': len(times),
+                'seconds': round(sum(times.values()), 6),
+                'max_seconds': round(slowest[0][1], 6) if slowest else 0.0,
+                'slowest': [{'file': path, 'seconds': round(seconds, 6)} for path, seconds in slowest]
+            }
+        result = {
+            'tool': self.tool,
+            'started': self.started,
+            'ok': self.ok,
+            'seconds': round(self.seconds, 6),
+            'cpu_seconds': round(self.cpu_seconds, 6),
+            'stages': {name: {'calls': row['calls'], 'seconds': round(row['seconds'], 6),
+                              'cpu_seconds': round(row['cpu_seconds'], 6)}
+                       for name, row in self.stages.items()},
+            'files': files,
+            'counters': dict(self.counters)
+        }
+        if self.profile_path:
+            result['profile'] = {'path': self.profile_path, 'top': self.profile or []}
+        return result
+
+    def write_json(self, path):
+        _write_replace(path, json.dumps(self.as_dict(), indent=2))
+
+    def prometheus_text(self):
+        """Gauges describing the last run, in the Prometheus text exposition format."""
+        tool = _label(self.tool)
+        lines = []
+
+        def metric(name, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in samples:
+                label_text = ','.join([f'tool="{tool}"'] + [f'{key}="{_label(val)}"'
+                                                            for key, val in labels])
+                lines.append(f"{name}{{{label_text}}} {value:.6f}"
+                             if isinstance(value, float) else f"{name}{{{label_text}}} {value}")
+
+        metric('epub_run_seconds', "Wall time of the last run.", [((), self.seconds)])
+        metric('epub_run_cpu_seconds', "CPU time of the last run (main process).", [((), self.cpu_seconds)])
+        metric('epub_run_success', "1 if the last run finished without an exception.", [((), int(bool(self.ok)))])
+        metric('epub_run_timestamp_seconds', "Unix time the last run started.", [((), float(self.started or 0))])
+        if self.stages:
+            metric('epub_stage_seconds', "Wall time per stage in the last run.",
+                   [((('stage', name),), row['seconds']) for name, row in self.stages.items()])
+            metric('epub_stage_cpu_seconds', "CPU time per stage in the last run.",
+                   [((('stage', name),), row['cpu_seconds']) for name, row in self.stages.items()])
+        if self.files:
+            metric('epub_stage_files', "Files processed per stage in the last run.",
+                   [((('stage', stage),), len(times)) for stage, times in self.files.items()])
+            metric('epub_file_seconds_max', "Slowest single file per stage in the last run.",
+                   [((('stage', stage),), max(times.values())) for stage, times in self.files.items()])
+        metric('epub_bytes', "Bytes read, written and compressed in the last run.",
+               [((('kind', name),), value) for name, value in self.counters.items()
+                if name.startswith('bytes_')])
+        events = [((('kind', name),), value) for name, value in self.counters.items()
+                  if not name.startswith('bytes_')]
+        if events:
+            metric('epub_events', "Other counts from the last run (cache hits, ...).", events)
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        # Written via rename so the collector never reads a half-written file
+        _write_replace(path, self.prometheus_text())
+
+    def print_report(self):
+        print(f"\n⏱️  TIMINGS ({self.tool}): {self.seconds:.3f}s wall, {self.cpu_seconds:.3f}s CPU")
+        print("=" * 60)
+        for name, row in self.stages.items():
+            print(f"{name:<36}{row['calls']:>5}{row['seconds']:>10.3f}s{row['cpu_seconds']:>9.3f}s CPU")
+        for stage, times in self.files.items():
+            slowest = max(times, key=times.get)
+            print(f"  {stage}: {len(times)} files, slowest {os.path.basename(slowest)} "
+                  f"({times[slowest] * 1000:.1f} ms)")
+        print('  ' + ', '.join(f"{name} {value:,}" for name, value in self.counters.items()))
+
+
+class NullInstrumentation:
+    """Recorder used when no run is active: accepts everything, keeps nothing."""
+
+    def __bool__(self):
+        return False
+
+    def stage(self, name):
+        return contextlib.nullcontext()
+
+    def file(self, stage, path):
+        return contextlib.nullcontext()
+
+    def record_file(self, stage, path, seconds):
+        pass
+
+    def count(self, name, amount=1):
+        pass
+
+    def file_seconds(self, stage, path):
+        return None
+
+
+NULL = NullInstrumentation()
+_active = NULL
+
+
+def active():
+    """The Instrumentation of the run in progress, or a no-op recorder."""
+    return _active
+
+
+@contextlib.contextmanager
+def instrumented(tool, json_path=None, prom_path=None, profile_path=None, report=False):
+    """Measure everything inside the block as one run of tool, then export it."""
+    global _active
+    previous = _active
+    metrics = Instrumentation(tool, profile_path)
+    _active = metrics
+    metrics.start()
+    ok = False
+    try:
+        yield metrics
+        ok = True
+    finally:
+        metrics.stop(ok)
+        _active = previous
+        if json_path:
+            metrics.write_json(json_path)
+        if prom_path:
+            metrics.write_prometheus(prom_path)
+        if report:
+            metrics.print_report()
+        if profile_path:
+            print(f"🔬 Profile saved to: {profile_path} (python3 -m pstats {profile_path})")
+
+
+def _profile_summary(profiler):
+    stats = pstats.Stats(profiler)
+    rows = []
+    for (filename, line, function), (_, calls, own, cumulative, _) in stats.stats.items():
+        rows.append({'function': f"{os.path.basename(filename)}:{line}({function})", 'calls': calls,
+                     'own_seconds': round(own, 6), 'cumulative_seconds': round(cumulative, 6)})
+    rows.sort(key=lambda row: -row['cumulative_seconds'])
+    return rows[:PROFILE_TOP]
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _write_replace(path, text):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def add_instrumentation_arguments(parser):
+    """--metrics-json / --metrics-prom / --profile / --timings for the tools."""
+    parser.add_argument('--metrics-json', metavar='PATH', help="write stage/file timings and I/O counters as JSON")
+    parser.add_argument('--metrics-prom', metavar='PATH',
+                        help=f"write a Prometheus textfile-collector file (default with ${METRICS_DIR_ENV}: "
+                             f"${METRICS_DIR_ENV}/epub_<tool>.prom)")
+    parser.add_argument('--profile', metavar='PATH', help="capture a cProfile of the run to PATH")
+    parser.add_argument('--timings', action='store_true', help="print a timing summary at the end")
+
+
+def instrumented_from_args(tool, args):
+    """instrumented() configured from add_instrumentation_arguments options."""
+    prom_path = args.metrics_prom
+    if prom_path is None and os.environ.get(METRICS_DIR_ENV):
+        prom_path = os.path.join(os.environ[METRICS_DIR_ENV], f"epub_{tool}.prom")
+    return instrumented(tool, args.metrics_json, prom_path, args.profile, args.timings)
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+EPUB Package Gate - Decide exactly what goes into the archive
+Every candidate entry of a build is checked before anything is packed:
+files the OPF manifest does not list are left out, each remaining file is
+read and hashed once, byte-identical resources are collapsed into one
+entry (with the OPF and every link pointed at the copy that is kept), and
+per-entry and total size budgets are enforced. A build over budget fails
+with a per-entry size report instead of shipping the bytes to readers.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import posixpath
+import re
+import sys
+from urllib.parse import quote
+
+from package_index import PackageIndex, PackageError, CONTAINER_PATH
+from reference_checker import CSS_URL, files_on_disk, resolve
+from chapter_splitter import prune_cache
+from instrumentation import active
+
+GATE_CACHE_NAME = '.gate-cache'
+
+# Bump when duplicate collapsing or link rewriting changes, so cached results are redone
+GATE_VERSION = 1
+
+DEFAULT_MAX_ENTRY_KB = 1024
+DEFAULT_MAX_TOTAL_MB = 10
+
+# Entries that belong in every EPUB without being manifest items
+ALWAYS_PACKED = ('mimetype', CONTAINER_PATH)
+
+XHTML_TYPES = ('application/xhtml+xml', 'image/svg+xml')
+
+LINK_ATTR = re.compile(rb'(\s(?:href|src|xlink:href|poster)\s*=\s*)(["\'])(.*?)\2', re.DOTALL)
+
+
+class PackageEntry:
+    """One file that will be packed: archive name, file to read, size and content hash."""
+
+    __slots__ = ('arcname', 'source', 'size', 'digest')
+
+    def __init__(self, arcname, source, size, digest):
+        self.arcname = arcname
+        self.source = source
+        self.size = size
+        self.digest = digest
+
+
+class GateResult:
+    """What the gate let through, left out and collapsed, and the budgets it checked."""
+
+    def __init__(self, index, entries, excluded, duplicates, max_entry_bytes, max_total_bytes):
+        self.index = index
+        self.entries = entries
+        self.excluded = excluded          # [(arcname, reason)]
+        self.duplicates = duplicates      # {dropped arcname: arcname kept}
+        self.max_entry_bytes = max_entry_bytes
+        self.max_total_bytes = max_total_bytes
+
+    @property
+    def total(self):
+        return sum(entry.size for entry in self.entries)
+
+    @property
+    def over_budget(self):
+        if not self.max_entry_bytes:
+            return []
+        return [entry for entry in self.entries if entry.size > self.max_entry_bytes]
+
+    @property
+    def over_total(self):
+        return bool(self.max_total_bytes) and self.total > self.max_total_bytes
+
+    @property
+    def ok(self):
+        return not self.over_budget and not self.over_total
+
+
+def add_budget_arguments(parser):
+    """Size budget options shared by create_final_epub.py and rebuild_epub.py."""
+    parser.add_argument('--max-entry-kb', type=int, default=DEFAULT_MAX_ENTRY_KB, metavar='KB',
+                        help=f"fail the build if any entry is larger (default {DEFAULT_MAX_ENTRY_KB}; 0 = no limit)")
+    parser.add_argument('--max-total-mb', type=float, default=DEFAULT_MAX_TOTAL_MB, metavar='MB',
+                        help=f"fail the build if all entries together are larger (default {DEFAULT_MAX_TOTAL_MB}; "
+                             "0 = no limit)")
+
+
+def _hash_file(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    active().count('bytes_read', len(data))
+    return len(data), hashlib.sha256(data).hexdigest()
+
+
+def _collapsible(index, opf_data, path):
+    """A duplicate can be dropped if nothing but its own <item> names it by id."""
+    item = index.by_path[path]
+    if item.properties or item.media_type in XHTML_TYPES or item in index.spine:
+        return False
+    mentions = re.findall(rb'["\'#]' + re.escape(item.id).encode('utf-8') + rb'["\']', opf_data)
+    return len(mentions) == 1
+
+
+def _rewrite_document(data, path, duplicates):
+    doc_dir = posixpath.dirname(path)
+
+    def replace(match):
+        resolved = resolve(path, match.group(3).decode('utf-8'))
+        if resolved is None or resolved[0] not in duplicates:
+            return match.group(0)
+        target, fragment = resolved
+        value = quote(posixpath.relpath(duplicates[target], doc_dir)) + (f"#{quote(fragment)}" if fragment else '')
+        return match.group(1) + match.group(2) + value.encode('utf-8') + match.group(2)
+
+    return LINK_ATTR.sub(replace, data)
+
+
+def _rewrite_stylesheet(data, path, duplicates):
+    doc_dir = posixpath.dirname(path)
+
+    def replace(match):
+        raw = match.group(2) or match.group(4)
+        resolved = resolve(path, raw) if raw else None
+        if resolved is None or resolved[0] not in duplicates:
+            return match.group(0)
+        return match.group(0).replace(raw, quote(posixpath.relpath(duplicates[resolved[0]], doc_dir)))
+
+    text = data.decode('utf-8', 'surrogateescape')
+    return CSS_URL.sub(replace, text).encode('utf-8', 'surrogateescape')
+
+
+def _drop_items(opf_data, index, paths):
+    """OPF bytes without the <item> tags (and their lines, when alone on one) of paths."""
+    for path in paths:
+        item_id = re.escape(index.by_path[path].id).encode('utf-8')
+        tag = re.search(rb'[ \t]*<item\s[^>]*\bid\s*=\s*["\']' + item_id + rb'["\'][^>]*>[ \t]*(\r?\n)?', opf_data)
+        if tag is not None:
+            opf_data = opf_data[:tag.start()] + opf_data[tag.end():]
+    return opf_data
+
+
+def collapse_duplicates(index, entries, cache_dir=None):
+    """Keep one copy of each set of byte-identical manifest resources.
+
+    Returns (index, entries, {dropped path: kept path}). Dropped copies leave
+    the manifest and the archive; the OPF, documents and stylesheets that
+    pointed at them are rewritten into the gate cache to use the kept copy.
+    """
+    first = {}
+    duplicates = {}
+    opf_entry = next((entry for entry in entries if entry.arcname == index.opf_path), None)
+    if opf_entry is None:
+        return index, entries, {}
+    with open(opf_entry.source, 'rb') as f:
+        opf_data = f.read()
+    for entry in entries:
+        if entry.arcname not in index.by_path:
+            continue
+        kept = first.setdefault(entry.digest, entry.arcname)
+        if kept != entry.arcname and _collapsible(index, opf_data, entry.arcname):
+            duplicates[entry.arcname] = kept
+    if not duplicates:
+        return index, entries, {}
+
+    entries = [entry for entry in entries if entry.arcname not in duplicates]
+    rewritable = [entry for entry in entries
+                  if entry.arcname == index.opf_path
+                  or index.media_type(entry.arcname) in XHTML_TYPES + ('text/css',)]
+
+    cache_dir = cache_dir or os.path.join(index.root, GATE_CACHE_NAME)
+    key = hashlib.sha256(f"{GATE_VERSION}:{json.dumps(duplicates, sort_keys=True)}".encode('utf-8'))
+    for entry in rewritable:
+        key.update(entry.arcname.encode('utf-8') + b'\0' + entry.digest.encode('ascii'))
+    out_dir = os.path.join(cache_dir, key.hexdigest()[:32])
+
+    rewritten = {}
+    for entry in rewritable:
+        target = os.path.join(out_dir, *entry.arcname.split('/'))
+        if not os.path.exists(target):
+            with open(entry.source, 'rb') as f:
+                data = f.read()
+            if entry.arcname == index.opf_path:
+                new_data = _drop_items(data, index, duplicates)
+            elif index.media_type(entry.arcname) == 'text/css':
+                new_data = _rewrite_stylesheet(data, entry.arcname, duplicates)
+            else:
+                new_data = _rewrite_document(data, entry.arcname, duplicates)
+            if new_data == data:
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            tmp_path = f"{target}.{os.getpid()}.part"
+            with open(tmp_path, 'wb') as f:
+                f.write(new_data)
+            os.replace(tmp_path, target)
+        size, digest = _hash_file(target)
+        rewritten[entry.arcname] = PackageEntry(entry.arcname, target, size, digest)
+    if os.path.isdir(out_dir):
+        # Results for earlier versions of the book are never read again
+        prune_cache(cache_dir, out_dir)
+
+    entries = [rewritten.get(entry.arcname, entry) for entry in entries]
+    with open(rewritten.get(index.opf_path, opf_entry).source, 'rb') as f:
+        index = PackageIndex.from_opf_bytes(f.read(), index.opf_path, index.root)
+    return index, entries, duplicates
+
+
+def gate_package(index, candidates, max_entry_kb=DEFAULT_MAX_ENTRY_KB, max_total_mb=DEFAULT_MAX_TOTAL_MB,
+                 cache_dir=None):
+    """Filter, hash, deduplicate and measure the entries a build is about to pack.
+
+    candidates is [(arcname, file to read)] in packing order. Returns a
+    GateResult; its index reflects any collapsed duplicates and should be
+    used for media types from here on. Budgets of 0 are not enforced.
+    """
+    allowed = set(ALWAYS_PACKED) | {index.opf_path} | set(index.by_path)
+    entries, excluded = [], []
+    seen = set()
+    for arcname, source in candidates:
+        if arcname in seen:
+            continue
+        seen.add(arcname)
+        if arcname not in allowed:
+            excluded.append((arcname, 'not in the OPF manifest'))
+        elif not os.path.exists(source):
+            excluded.append((arcname, 'file not found'))
+        else:
+            size, digest = _hash_file(source)
+            entries.append(PackageEntry(arcname, source, size, digest))
+
+    index, entries, duplicates = collapse_duplicates(index, entries, cache_dir)
+    return GateResult(index, entries, excluded, duplicates,
+                      max_entry_kb * 1024, int(max_total_mb * 1024 * 1024))
+
+
+def print_gate_report(result, full=False):
+    """Summary of the gate; every entry with its size when full or over budget."""
+    for arcname, reason in result.excluded:
+        print(f"  🚫 Left out {arcname} ({reason})")
+    for dropped, kept in result.duplicates.items():
+        print(f"  🔁 {dropped} is identical to {kept}; packed once")
+
+    if full or not result.ok:
+        print(f"\n📏 Entry sizes (budget {result.max_entry_bytes // 1024 or '∞'} KB per entry):")
+        for entry in sorted(result.entries, key=lambda e: e.size, reverse=True):
+            over = result.max_entry_bytes and entry.size > result.max_entry_bytes
+            print(f"  {'❌' if over else '  '} {entry.size:>12,}  {entry.arcname}")
+
+    budget = f"{result.max_total_bytes / 1024 / 1024:.2f} MB" if result.max_total_bytes else 'no limit'
+    mark = '❌' if result.over_total else '✅' if result.ok else '⚠️ '
+    print(f"{mark} {len(result.entries)} entries, {result.total:,} bytes before compression (budget {budget})")
+    if result.over_budget:
+        print(f"❌ {len(result.over_budget)} entries over the {result.max_entry_bytes // 1024} KB per-entry budget")
+
+
+def book_candidates(source_dir, index):
+    """Files of an extracted book: the package order, then the rest of META-INF and the OPF folder."""
+    paths = ['mimetype'] + index.package_order()
+    on_disk = files_on_disk(source_dir, 'META-INF') | files_on_disk(source_dir, index.opf_dir or '.')
+    paths += sorted(on_disk.difference(paths))
+    return [(path, os.path.join(source_dir, *path.split('/'))) for path in paths]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check what a build would pack against the manifest and size budgets")
+    parser.add_argument('--source', default='.', metavar='DIR', help="book root")
+    add_budget_arguments(parser)
+    args = parser.parse_args()
+
+    print("📦 Checking package contents...")
+    print("=" * 60)
+    try:
+        index = PackageIndex.load(args.source)
+    except (FileNotFoundError, PackageError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    # Candidates from disk, so stray files show up; the book itself is not changed
+    result = gate_package(index, book_candidates(args.source, index), args.max_entry_kb, args.max_total_mb)
+    print_gate_report(result, full=True)
+    if not result.ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
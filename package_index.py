@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+EPUB Package Index - One parse of content.opf for every build and check script
+Gives O(1) lookups of manifest items by id, OPF-relative href or
+book-relative path, the spine in reading order, and per-item media types.
+"""
+
+import json
+import os
+import posixpath
+import zipfile
+import xml.etree.ElementTree as ET
+from urllib.parse import unquote
+
+CONTAINER_PATH = 'META-INF/container.xml'
+DEFAULT_OPF_PATH = 'OEBPS/content.opf'
+
+OPF_NS = '{http://www.idpf.org/2007/opf}'
+CONTAINER_NS = '{urn:oasis:names:tc:opendocument:xmlns:container}'
+
+CACHE_VERSION = 1
+
+# Conventional cache location for scripts that opt into caching
+INDEX_CACHE_NAME = '.package-index.json'
+
+
+class PackageError(ValueError):
+    """The OPF package document exists but cannot be parsed."""
+
+    def __init__(self, opf_path, error):
+        self.opf_path = opf_path
+        self.line = error.position[0] if getattr(error, 'position', None) else 0
+        super().__init__(f"{opf_path} cannot be parsed: {error}")
+
+
+class ManifestItem:
+    """One <item> of the OPF manifest."""
+
+    def __init__(self, item_id, href, media_type, properties, path):
+        self.id = item_id
+        self.href = href              # as written in the OPF (relative to the OPF)
+        self.media_type = media_type
+        self.properties = properties
+        self.path = path              # relative to the book root, '/' separated
+
+    @property
+    def name(self):
+        return posixpath.basename(self.path)
+
+    def as_dict(self):
+        return {
+            'id': self.id,
+            'href': self.href,
+            'media_type': self.media_type,
+            'properties': self.properties,
+            'path': self.path
+        }
+
+    def __repr__(self):
+        return f"ManifestItem({self.id!r}, {self.path!r}, {self.media_type!r})"
+
+
+class PackageIndex:
+    """Manifest and spine of one book, keyed for constant-time lookups."""
+
+    def __init__(self, root, opf_path, items, spine_ids):
+        self.root = str(root)
+        self.opf_path = opf_path
+        self.opf_dir = posixpath.dirname(opf_path)
+        self.items = items
+        self.by_id = {item.id: item for item in items}
+        self.by_href = {item.href: item for item in items}
+        self.by_path = {item.path: item for item in items}
+        self.spine = [self.by_id[idref] for idref in spine_ids if idref in self.by_id]
+        self.spine_ids = [item.id for item in self.spine]
+
+    # ------------------------------------------------------------------
+    # Construction
+
+    @classmethod
+    def load(cls, root='.', cache_path=None):
+        """Parse the book at root, reusing cache_path while the OPF is unchanged.
+
+        Raises FileNotFoundError if the book has no OPF, PackageError if the
+        OPF is not well-formed XML.
+        """
+        root = str(root)
+        opf_path = find_opf_path(root)
+        opf_file = os.path.join(root, opf_path)
+        stat = os.stat(opf_file)
+        stamp = [stat.st_mtime_ns, stat.st_size]
+
+        if cache_path and os.path.exists(cache_path):
+            try:
+                with open(cache_path, 'r', encoding='utf-8') as f:
+                    cached = json.load(f)
+                if (cached.get('version') == CACHE_VERSION and
+                        cached.get('opf_path') == opf_path and
+                        cached.get('opf_stamp') == stamp):
+                    items = [ManifestItem(d['id'], d['href'], d['media_type'],
+                                          d['properties'], d['path'])
+                             for d in cached['items']]
+                    return cls(root, opf_path, items, cached['spine'])
+            except (OSError, ValueError, KeyError):
+                pass
+
+        with open(opf_file, 'rb') as f:
+            index = cls._parse(f.read(), opf_path, root)
+
+        if cache_path:
+            index._save_cache(cache_path, stamp)
+        return index
+
+    @classmethod
+    def load_epub(cls, epub_path):
+        """Index a packed .epub straight from its zip, without extracting it.
+
+        Only container.xml and the OPF are decompressed. Raises
+        FileNotFoundError or PackageError like load().
+        """
+        with zipfile.ZipFile(epub_path) as zf:
+            names = set(zf.namelist())
+            opf_path = None
+            if CONTAINER_PATH in names:
+                opf_path = rootfile_path(zf.read(CONTAINER_PATH))
+            if opf_path is None and DEFAULT_OPF_PATH in names:
+                opf_path = DEFAULT_OPF_PATH
+            if opf_path is None or opf_path not in names:
+                raise FileNotFoundError(f"No OPF package document found in {epub_path}")
+            return cls._parse(zf.read(opf_path), opf_path, epub_path)
+
+    @classmethod
+    def _parse(cls, data, opf_path, root):
+        try:
+            return cls.from_opf_bytes(data, opf_path, root)
+        except ET.ParseError as e:
+            raise PackageError(opf_path, e) from e
+
+    @classmethod
+    def from_opf_bytes(cls, data, opf_path=DEFAULT_OPF_PATH, root='.'):
+        """Build an index from raw OPF XML (e.g. read out of an .epub)."""
+        opf_dir = posixpath.dirname(opf_path)
+        tree = ET.fromstring(data)
+
+        items = []
+        manifest = tree.find(f'{OPF_NS}manifest')
+        if manifest is not None:
+            for item in manifest.findall(f'{OPF_NS}item'):
+                href = item.get('href', '')
+                path = posixpath.normpath(posixpath.join(opf_dir, unquote(href)))
+                items.append(ManifestItem(item.get('id', ''), href, item.get('media-type', ''),
+                                          item.get('properties', ''), path))
+
+        spine_ids = []
+        spine = tree.find(f'{OPF_NS}spine')
+        if spine is not None:
+            spine_ids = [ref.get('idref') for ref in spine.findall(f'{OPF_NS}itemref')]
+
+        return cls(root, opf_path, items, spine_ids)
+
+    def _save_cache(self, cache_path, stamp):
+        cached = {
+            'version': CACHE_VERSION,
+            'opf_path': self.opf_path,
+            'opf_stamp': stamp,
+            'items': [item.as_dict() for item in self.items],
+            'spine': self.spine_ids
+        }
+        tmp_path = f"{cache_path}.part"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(cached, f)
+        os.replace(tmp_path, cache_path)
+
+    # ------------------------------------------------------------------
+    # Queries
+
+    def item(self, key):
+        """Look up by id, OPF-relative href or book-relative path."""
+        return self.by_id.get(key) or self.by_href.get(key) or self.by_path.get(key)
+
+    def media_type(self, path):
+        item = self.by_path.get(path)
+        return item.media_type if item else None
+
+    def full_path(self, item):
+        """Location of an item on disk."""
+        return os.path.join(self.root, *item.path.split('/'))
+
+    def chapters(self):
+        """Spine documents whose file name marks them as a chapter, in reading order."""
+        return [item for item in self.spine if 'chapter' in item.name.lower()]
+
+    def package_order(self):
+        """Book-relative paths to pack after mimetype: container, OPF, spine, then the rest of the manifest."""
+        paths = [CONTAINER_PATH, self.opf_path]
+        seen = set(paths)
+        for item in self.spine + self.items:
+            if item.path not in seen:
+                seen.add(item.path)
+                paths.append(item.path)
+        return paths
+
+
+def find_opf_path(root='.'):
+    """Book-relative path of the OPF, read from META-INF/container.xml when present."""
+    container = os.path.join(str(root), *CONTAINER_PATH.split('/'))
+    if os.path.exists(container):
+        with open(container, 'rb') as f:
+            opf_path = rootfile_path(f.read())
+        if opf_path:
+            return opf_path
+
+    if os.path.exists(os.path.join(str(root), *DEFAULT_OPF_PATH.split('/'))):
+        return DEFAULT_OPF_PATH
+    raise FileNotFoundError(f"No OPF package document found under {root}")
+
+
+def rootfile_path(container_xml):
+    """full-path of the first rootfile in container.xml, or None."""
+    try:
+        rootfile = ET.fromstring(container_xml).find(f'.//{CONTAINER_NS}rootfile')
+    except ET.ParseError:
+        return None
+    if rootfile is not None and rootfile.get('full-path'):
+        return rootfile.get('full-path')
+    return None
@@ -7,63 +7,65 @@ Ensures correct EPUB packaging format with mimetype-first approach
 
 import os
 import zipfile
+import argparse
 from pathlib import Path
 
-def rebuild_epub():
+from epub_packager import EpubPackager, add_packaging_arguments, resolve_jobs
+from compression_policy import CompressionPolicy
+from package_index import PackageIndex, PackageError
+from package_gate import (gate_package, book_candidates, print_gate_report, add_budget_arguments,
+                          DEFAULT_MAX_ENTRY_KB, DEFAULT_MAX_TOTAL_MB)
+from instrumentation import active, add_instrumentation_arguments, instrumented_from_args
+
+def rebuild_epub(jobs=1, compression='table', max_entry_kb=DEFAULT_MAX_ENTRY_KB, max_total_mb=DEFAULT_MAX_TOTAL_MB):
     """Rebuild EPUB file with proper packaging format"""
     source_dir = "test_epub_extract"
     output_file = "Curls-Contemplation-WORKING-EPUB-20250905.epub"
     
     print("🔧 Rebuilding EPUB with proper packaging...")
     
-    # Remove existing output file if it exists
-    if os.path.exists(output_file):
-        os.remove(output_file)
-        print(f"✅ Removed existing {output_file}")
+    # An existing output file is only replaced once the new archive is complete
+    
+    if not os.path.exists(os.path.join(source_dir, "mimetype")):
+        print("❌ Missing mimetype file!")
+        return False
+    try:
+        with active().stage('index'):
+            index = PackageIndex.load(source_dir)
+    except (FileNotFoundError, PackageError) as e:
+        print(f"❌ {e}")
+        return False
     
-    # Create ZIP file with proper EPUB structure
-    with zipfile.ZipFile(output_file, 'w', zipfile.ZIP_DEFLATED) as epub_zip:
-        
-        # 1. First, add mimetype (uncompressed, must be first)
-        mimetype_path = os.path.join(source_dir, "mimetype")
-        if os.path.exists(mimetype_path):
-            epub_zip.write(mimetype_path, "mimetype", compress_type=zipfile.ZIP_STORED)
-            print("✅ Added mimetype (uncompressed)")
-        else:
-            print("❌ Missing mimetype file!")
-            return False
-        
-        # 2. Add META-INF directory
-        meta_inf_dir = os.path.join(source_dir, "META-INF")
-        if os.path.exists(meta_inf_dir):
-            for root, dirs, files in os.walk(meta_inf_dir):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    arc_path = os.path.relpath(file_path, source_dir)
-                    epub_zip.write(file_path, arc_path)
-            print("✅ Added META-INF directory")
-        
-        # 3. Add OEBPS directory (content)
-        oebps_dir = os.path.join(source_dir, "OEBPS")
-        if os.path.exists(oebps_dir):
-            for root, dirs, files in os.walk(oebps_dir):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    arc_path = os.path.relpath(file_path, source_dir)
-                    epub_zip.write(file_path, arc_path)
-            print("✅ Added OEBPS directory")
-        
-        # 4. Add any other files at root level (excluding already added)
-        for item in os.listdir(source_dir):
-            item_path = os.path.join(source_dir, item)
-            if item not in ["mimetype", "META-INF", "OEBPS"] and os.path.isfile(item_path):
-                epub_zip.write(item_path, item)
+    # Everything extracted is a candidate; only what the manifest lists gets packed
+    candidates = book_candidates(source_dir, index)
+    for item in sorted(os.listdir(source_dir)):
+        if os.path.isfile(os.path.join(source_dir, item)):
+            candidates.append((item, os.path.join(source_dir, item)))
+    with active().stage('gate'):
+        gate = gate_package(index, candidates, max_entry_kb, max_total_mb)
+    print_gate_report(gate)
+    if not gate.ok:
+        print("❌ Package over its size budget; no EPUB written")
+        return False
+    
+    # Create ZIP file with proper EPUB structure: mimetype (uncompressed, must be first),
+    # the container, the OPF, then the manifest with the spine first, in reading order
+    with EpubPackager(output_file, jobs=jobs, policy=CompressionPolicy(compression)) as epub_zip:
+        for entry in gate.entries:
+            if entry.arcname == "mimetype":
+                epub_zip.write(entry.source, "mimetype", compress_type=zipfile.ZIP_STORED, digest=entry.digest)
+                print("✅ Added mimetype (uncompressed)")
+            else:
+                epub_zip.write(entry.source, entry.arcname, media_type=gate.index.media_type(entry.arcname),
+                               digest=entry.digest)
+        print(f"✅ Added {index.opf_path} and {len(gate.index.items)} manifest items")
     
     # Verify the created EPUB
     if os.path.exists(output_file):
         file_size = os.path.getsize(output_file)
         print(f"✅ EPUB created successfully: {output_file}")
         print(f"📊 File size: {file_size:,} bytes ({file_size / 1024 / 1024:.2f} MB)")
+        epub_zip.stats.print_report()
         return True
     else:
         print("❌ Failed to create EPUB file")
@@ -126,6 +128,12 @@ def test_epub_structure():
         return False
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild EPUB from extracted contents")
+    add_packaging_arguments(parser)
+    add_instrumentation_arguments(parser)
+    add_budget_arguments(parser)
+    args = parser.parse_args()
+
     print("🚀 EPUB Rebuilder Starting...")
     
     # Check if source directory exists
@@ -135,7 +143,10 @@ if __name__ == "__main__":
         exit(1)
     
     # Rebuild EPUB
-    if rebuild_epub():
+    with instrumented_from_args('rebuild_epub', args):
+        rebuilt = rebuild_epub(jobs=resolve_jobs(args.jobs), compression=args.compression,
+                               max_entry_kb=args.max_entry_kb, max_total_mb=args.max_total_mb)
+    if rebuilt:
         print("\n" + "="*50)
         test_epub_structure()
         print("="*50)
@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""
+EPUB Reference Checker - Cross-file link integrity in one pass
+Every XHTML document and stylesheet in the manifest, and the OPF itself,
+is parsed once to build a global index of element ids and of every
+reference made (href, src, #fragment, stylesheet links, CSS url(), nav
+entries, spine idrefs). References are then resolved against that index
+with dictionary lookups, so the check stays linear in the size of the book.
+Reports broken links, orphaned manifest items and unreferenced files.
+"""
+
+import argparse
+import json
+import os
+import posixpath
+import re
+import sys
+from urllib.parse import unquote, urlsplit
+from xml.parsers import expat
+
+from package_index import PackageIndex, PackageError, CONTAINER_PATH
+from instrumentation import active, add_instrumentation_arguments, instrumented_from_args
+
+DEFAULT_REPORT = 'reference_report.json'
+
+# Attributes that point at another resource or fragment
+LINK_ATTRIBUTES = ('href', 'src', 'xlink:href', 'poster', 'data')
+
+XHTML_TYPES = ('application/xhtml+xml', 'image/svg+xml')
+
+CSS_URL = re.compile(r'url\(\s*(["\']?)([^"\')]*)\1\s*\)|@import\s+(["\'])([^"\']*)\3')
+CSS_COMMENT = re.compile(r'/\*.*?\*/', re.DOTALL)
+
+# Files next to the OPF that never belong in the manifest
+NOT_ASSETS = ('mimetype',)
+
+# Manifest properties that make an item used without any document linking to it
+REFERENCED_BY_ROLE = {'nav', 'cover-image'}
+
+
+class Reference:
+    """One link from a source file, resolved to a book-relative target."""
+
+    __slots__ = ('source', 'line', 'raw', 'target', 'fragment', 'kind')
+
+    def __init__(self, source, line, raw, target, fragment, kind):
+        self.source = source
+        self.line = line
+        self.raw = raw
+        self.target = target          # book-relative path (the source itself for '#id' links)
+        self.fragment = fragment
+        self.kind = kind
+
+    def as_dict(self):
+        return {'source': self.source, 'line': self.line, 'reference': self.raw, 'kind': self.kind}
+
+
+def resolve(base_path, raw):
+    """(target path, fragment) of a reference made from base_path, or None if it is external."""
+    raw = raw.strip()
+    parts = urlsplit(raw)
+    if parts.scheme or parts.netloc:
+        return None
+    fragment = unquote(parts.fragment)
+    if not parts.path:
+        return base_path, fragment
+    target = posixpath.normpath(posixpath.join(posixpath.dirname(base_path), unquote(parts.path)))
+    return target, fragment
+
+
+class ReferenceIndex:
+    """Ids defined and references made across the whole book."""
+
+    def __init__(self, index):
+        self.index = index
+        self.ids = {}                 # book-relative path -> set of ids
+        self.references = []
+        self.unparsed = []            # documents that are not well-formed (scanned with a regex)
+
+    def _add(self, source, line, raw, kind):
+        resolved = resolve(source, raw)
+        if resolved is None:
+            return
+        target, fragment = resolved
+        self.references.append(Reference(source, line, raw, target, fragment, kind))
+
+    # ------------------------------------------------------------------
+    # Collection
+
+    def add_document(self, path, data):
+        """Ids and outgoing links of one XHTML/SVG document."""
+        ids = self.ids.setdefault(path, set())
+        parser = expat.ParserCreate()
+
+        def start(name, attrs):
+            if 'id' in attrs:
+                ids.add(attrs['id'])
+            elif 'xml:id' in attrs:
+                ids.add(attrs['xml:id'])
+            tag = name.rpartition(':')[2].lower()
+            for attr in LINK_ATTRIBUTES:
+                value = attrs.get(attr)
+                if value and not (attr == 'data' and tag != 'object'):
+                    self._add(path, parser.CurrentLineNumber, value, tag)
+
+        parser.StartElementHandler = start
+        try:
+            parser.Parse(data, True)
+        except expat.ExpatError:
+            # Not well-formed: pick ids and links out with a regex instead
+            self.unparsed.append(path)
+            text = data.decode('utf-8', 'ignore')
+            ids.update(re.findall(r'\bid\s*=\s*["\']([^"\']*)["\']', text))
+            for match in re.finditer(r'\b(?:href|src)\s*=\s*["\']([^"\']*)["\']', text):
+                self._add(path, text.count('\n', 0, match.start()) + 1, match.group(1), 'regex')
+
+    def add_stylesheet(self, path, data):
+        """url() and @import references of one stylesheet."""
+        text = CSS_COMMENT.sub(lambda m: '\n' * m.group(0).count('\n'), data.decode('utf-8', 'ignore'))
+        for match in CSS_URL.finditer(text):
+            raw = match.group(2) or match.group(4)
+            if raw:
+                self._add(path, text.count('\n', 0, match.start()) + 1, raw, 'css')
+
+    def add_package(self, data):
+        """Ids, refines, spine idrefs (the NCX named by spine/@toc and an EPUB 2
+        cover meta included) and guide references of the OPF."""
+        opf_path = self.index.opf_path
+        ids = self.ids.setdefault(opf_path, set())
+        self.id_refs = []               # (line, manifest id, kind) named by the OPF
+        self.refines = []
+        self.package_error = None
+        parser = expat.ParserCreate(namespace_separator=' ')
+
+        def start(name, attrs):
+            tag = name.rpartition(' ')[2]
+            line = parser.CurrentLineNumber
+            if 'id' in attrs:
+                ids.add(attrs['id'])
+            if tag == 'itemref':
+                self.id_refs.append((line, attrs.get('idref', ''), 'itemref'))
+            elif tag == 'spine' and attrs.get('toc'):
+                self.id_refs.append((line, attrs['toc'], 'spine toc'))
+            elif tag == 'meta' and attrs.get('name') == 'cover' and attrs.get('content'):
+                self.id_refs.append((line, attrs['content'], 'cover meta'))
+            elif tag == 'reference' and attrs.get('href'):
+                self._add(opf_path, line, attrs['href'], 'guide')
+            if attrs.get('refines'):
+                self.refines.append((line, attrs['refines']))
+
+        parser.StartElementHandler = start
+        try:
+            parser.Parse(data, True)
+        except expat.ExpatError as e:
+            self.package_error = (e.lineno, f"OPF cannot be parsed: {expat.ErrorString(e.code)}")
+
+    @classmethod
+    def build(cls, index):
+        """Parse the OPF and every XHTML, SVG and CSS item of the manifest exactly once."""
+        refs = cls(index)
+        with open(os.path.join(index.root, *index.opf_path.split('/')), 'rb') as f:
+            refs.add_package(f.read())
+        for item in index.items:
+            if item.media_type not in XHTML_TYPES and item.media_type != 'text/css':
+                continue
+            path = index.full_path(item)
+            if not os.path.exists(path):
+                continue
+            with open(path, 'rb') as f:
+                data = f.read()
+            active().count('bytes_read', len(data))
+            if item.media_type == 'text/css':
+                refs.add_stylesheet(item.path, data)
+            else:
+                refs.add_document(item.path, data)
+        return refs
+
+
+def files_on_disk(root, top):
+    """Book-relative paths of every file under top (hidden files and caches skipped)."""
+    found = set()
+    for dirpath, dirnames, filenames in os.walk(os.path.join(root, top)):
+        dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+        for name in filenames:
+            if name.startswith('.'):
+                continue
+            relative = os.path.relpath(os.path.join(dirpath, name), root)
+            found.add(relative.replace(os.sep, '/'))
+    return found
+
+
+def check_references(index):
+    """Build the reference index and resolve everything against it; returns the report dict."""
+    metrics = active()
+    with metrics.stage('index'):
+        refs = ReferenceIndex.build(index)
+        on_disk = files_on_disk(index.root, index.opf_dir or '.')
+
+    with metrics.stage('resolve'):
+        broken = []
+        referenced = set()
+        for ref in refs.references:
+            if ref.target not in index.by_path and ref.target not in on_disk:
+                broken.append(dict(ref.as_dict(), problem='missing file'))
+                continue
+            referenced.add(ref.target)
+            if ref.target not in index.by_path:
+                broken.append(dict(ref.as_dict(), problem='target not in manifest'))
+            elif ref.fragment and ref.target in refs.ids and ref.fragment not in refs.ids[ref.target]:
+                broken.append(dict(ref.as_dict(), problem=f"no id '{ref.fragment}' in {ref.target}"))
+
+        for line, idref, kind in refs.id_refs:
+            item = index.by_id.get(idref)
+            if item is None:
+                broken.append({'source': index.opf_path, 'line': line, 'reference': idref,
+                               'kind': kind, 'problem': 'idref not in manifest'})
+            else:
+                referenced.add(item.path)
+        if refs.package_error:
+            line, problem = refs.package_error
+            broken.append({'source': index.opf_path, 'line': line, 'reference': '',
+                           'kind': 'package', 'problem': problem})
+        opf_ids = refs.ids.get(index.opf_path, set())
+        for line, target in refs.refines:
+            if target.startswith('#') and target[1:] not in opf_ids:
+                broken.append({'source': index.opf_path, 'line': line, 'reference': target,
+                               'kind': 'refines', 'problem': 'no such id in the OPF'})
+
+        missing = []
+        orphaned = []
+        for item in index.items:
+            if item.path not in on_disk:
+                missing.append({'id': item.id, 'href': item.href})
+            elif item.path not in referenced and not REFERENCED_BY_ROLE.intersection(item.properties.split()):
+                orphaned.append({'id': item.id, 'href': item.href, 'media_type': item.media_type})
+
+        skip = {index.opf_path, CONTAINER_PATH}
+        skip.update(posixpath.join(index.opf_dir, name) for name in NOT_ASSETS)
+        unlisted = sorted(path for path in on_disk if path not in index.by_path and path not in skip)
+
+    return {
+        'documents_scanned': len(refs.ids),
+        'references': len(refs.references) + len(refs.id_refs) + len(refs.refines),
+        'ids': sum(len(ids) for ids in refs.ids.values()),
+        'not_well_formed': refs.unparsed,
+        'broken_links': broken,
+        'missing_manifest_items': missing,
+        'orphaned_manifest_items': orphaned,
+        'unreferenced_assets': unlisted
+    }
+
+
+def unreadable_package_report(error):
+    """Report for a book whose OPF cannot be parsed (a PackageError), so nothing else can be resolved."""
+    return {
+        'documents_scanned': 0,
+        'references': 0,
+        'ids': 0,
+        'not_well_formed': [],
+        'broken_links': [{'source': error.opf_path, 'line': error.line, 'reference': '', 'kind': 'package',
+                          'problem': str(error)}],
+        'missing_manifest_items': [],
+        'orphaned_manifest_items': [],
+        'unreferenced_assets': []
+    }
+
+
+def print_report(report):
+    print(f"📚 {report['documents_scanned']} files, {report['ids']:,} ids, "
+          f"{report['references']:,} internal references")
+    for path in report['not_well_formed']:
+        print(f"  ⚠️  {path}: not well-formed, links found by pattern only")
+
+    print(f"\n🔗 Broken links: {len(report['broken_links'])}")
+    for entry in report['broken_links']:
+        print(f"  ❌ {entry['source']}:{entry['line']} {entry['reference']} ({entry['problem']})")
+
+    print(f"\n📦 Manifest items missing on disk: {len(report['missing_manifest_items'])}")
+    for entry in report['missing_manifest_items']:
+        print(f"  ❌ {entry['id']}: {entry['href']}")
+
+    print(f"\n🗂️  Orphaned manifest items (never referenced): {len(report['orphaned_manifest_items'])}")
+    for entry in report['orphaned_manifest_items']:
+        print(f"  ⚠️  {entry['id']}: {entry['href']} ({entry['media_type']})")
+
+    print(f"\n🧹 Unreferenced assets (on disk, not in the manifest): {len(report['unreferenced_assets'])}")
+    for path in report['unreferenced_assets']:
+        print(f"  ⚠️  {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check links, fragment ids and manifest items across the book")
+    parser.add_argument('--source', default='.', metavar='DIR', help="book root")
+    parser.add_argument('--json', default=DEFAULT_REPORT, metavar='PATH', help="report path")
+    parser.add_argument('--strict', action='store_true',
+                        help="also fail on orphaned manifest items and unreferenced assets")
+    add_instrumentation_arguments(parser)
+    args = parser.parse_args()
+
+    print("🔍 Checking cross-file references...")
+    print("=" * 60)
+    try:
+        index = PackageIndex.load(args.source)
+    except FileNotFoundError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    except PackageError as e:
+        index = None
+        report = unreadable_package_report(e)
+    if index is not None:
+        with instrumented_from_args('reference_checker', args):
+            report = check_references(index)
+    print_report(report)
+
+    with open(args.json, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"\n💾 Report saved to: {args.json}")
+
+    failures = len(report['broken_links']) + len(report['missing_manifest_items'])
+    if args.strict:
+        failures += len(report['orphaned_manifest_items']) + len(report['unreferenced_assets'])
+    if failures:
+        sys.exit(1)
+    print("✅ All references resolve")
+
+
+if __name__ == "__main__":
+    main()
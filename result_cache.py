@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Result Cache - Reuse compliance results for unchanged chapters
+Results are stored in the epub_qa.db SQLite database, keyed by file path,
+a hash of the file contents and a hash of the checker's ruleset, so a
+repeat run only re-checks files that changed (or everything, when the
+rules change).
+"""
+
+import hashlib
+import inspect
+import json
+import sqlite3
+
+from parallel_checks import run_checks
+from epub_source import chapter_key, chapter_digest
+from instrumentation import active
+
+RESULT_DB = 'epub_qa.db'
+
+CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS check_cache (
+    file_path TEXT NOT NULL,
+    checker TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    ruleset_hash TEXT NOT NULL,
+    result TEXT NOT NULL,
+    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (file_path, checker)
+)
+"""
+
+
+def ruleset_hash(checker, method_name):
+    """Hash of checker.ruleset() plus the source of the module defining the checker.
+
+    The whole module is hashed, not just the check method, so editing a
+    pattern list, a scanner class or any helper the verdicts depend on
+    invalidates the cache. If the source cannot be read, the check method's
+    qualified name is used and only ruleset() changes are detected.
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps(checker.ruleset(), sort_keys=True).encode('utf-8'))
+    method = getattr(type(checker), method_name)
+    try:
+        digest.update(inspect.getsource(inspect.getmodule(method)).encode('utf-8'))
+    except (OSError, TypeError):
+        digest.update(method.__qualname__.encode('utf-8'))
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """Per-checker view of the check_cache table."""
+
+    def __init__(self, checker_name, ruleset, db_path=RESULT_DB):
+        self.checker = checker_name
+        self.ruleset = ruleset
+        self.db_path = str(db_path)
+        self.hits = 0
+        self.conn = sqlite3.connect(self.db_path)
+        self.conn.execute(CACHE_SCHEMA)
+
+    def lookup(self, path, digest):
+        """Stored result for path if its content and the ruleset are unchanged."""
+        row = self.conn.execute(
+            "SELECT result FROM check_cache WHERE file_path = ? AND checker = ? "
+            "AND content_hash = ? AND ruleset_hash = ?",
+            (chapter_key(path), self.checker, digest, self.ruleset)
+        ).fetchone()
+        if row is None:
+            return None
+        self.hits += 1
+        return json.loads(row[0])
+
+    def store(self, path, digest, result):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO check_cache "
+            "(file_path, checker, content_hash, ruleset_hash, result) VALUES (?, ?, ?, ?, ?)",
+            (chapter_key(path), self.checker, digest, self.ruleset, json.dumps(result))
+        )
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def cached_checks(checker, method_name, files, db_path=RESULT_DB, jobs=1, chunksize=None):
+    """Like run_checks, but files whose content and ruleset are unchanged
+    since the last run are answered from the cache instead of re-checked.
+
+    Yields (file, result) in the order of files; prints a hit/miss summary.
+    """
+    files = list(files)
+    ruleset = ruleset_hash(checker, method_name)
+    with ResultCache(type(checker).__name__, ruleset, db_path) as cache:
+        digests = [chapter_digest(path) for path in files]
+        # Unreadable files are always re-checked so the checker reports the error
+        cached = [cache.lookup(path, digest) if digest else None
+                  for path, digest in zip(files, digests)]
+
+        # Only the misses go to the (possibly parallel) checker; they come back
+        # in order, so they can be interleaved with the hits as we go
+        misses = [path for path, result in zip(files, cached) if result is None]
+        fresh = run_checks(checker, method_name, misses, jobs, chunksize)
+        for path, digest, result in zip(files, digests, cached):
+            if result is None:
+                _, result = next(fresh)
+                if digest:
+                    cache.store(path, digest, result)
+            yield path, result
+
+        print(f"🗄️  Result cache: {cache.hits} reused, {len(misses)} checked ({db_path})")
+        active().count('cache_hits', cache.hits)
+        active().count('cache_misses', len(misses))
+
+
+def add_cache_arguments(parser):
+    """--db / --no-cache for the compliance checkers."""
+    parser.add_argument('--db', default=RESULT_DB, metavar='PATH',
+                        help=f"SQLite database holding cached results (default: {RESULT_DB})")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="re-check every file and leave the cache untouched")
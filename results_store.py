@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+Results Store - QA history in epub_qa.db, written in batches and indexed for queries
+Opens the database in WAL mode, so reports can be queried while a run is
+writing, and buffers rows so each run costs a handful of short write
+transactions instead of one per file. Parallel checker workers never open
+the database: their results come back to the parent (see parallel_checks)
+and only the parent writes. Older databases are migrated in place: missing
+tables, columns and indexes from create_database.sql are added.
+"""
+
+import argparse
+import json
+import sqlite3
+import time
+
+from result_cache import RESULT_DB
+from epub_source import chapter_key
+
+# Rows buffered before they are written in one transaction
+BATCH_SIZE = 500
+
+# How long a writer waits for another writer's transaction (ms)
+BUSY_TIMEOUT_MS = 30000
+
+TABLES = {
+    'validation_results': """
+        CREATE TABLE IF NOT EXISTS validation_results (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            file_path TEXT NOT NULL,
+            batch_number INTEGER,
+            validation_status TEXT,
+            errors_found TEXT,
+            fix_suggestions TEXT,
+            duration_seconds REAL,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )""",
+    'factcheck_results': """
+        CREATE TABLE IF NOT EXISTS factcheck_results (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            file_path TEXT NOT NULL,
+            claim TEXT,
+            verification_status TEXT,
+            sources TEXT,
+            confidence_score REAL,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )""",
+    'consistency_analysis': """
+        CREATE TABLE IF NOT EXISTS consistency_analysis (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            file_path TEXT NOT NULL,
+            inconsistency_type TEXT,
+            description TEXT,
+            severity TEXT,
+            cross_references TEXT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )""",
+    'processing_state': """
+        CREATE TABLE IF NOT EXISTS processing_state (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            agent_name TEXT NOT NULL,
+            batch_number INTEGER,
+            status TEXT,
+            results_summary TEXT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )"""
+}
+
+# Columns a table may be missing in a database created from an older schema
+# (ALTER TABLE cannot add a CURRENT_TIMESTAMP default, so rows are always
+# written with an explicit timestamp)
+ADDED_COLUMNS = {
+    'validation_results': (('batch_number', 'INTEGER'), ('duration_seconds', 'REAL'), ('timestamp', 'DATETIME')),
+}
+
+INDEXED_COLUMNS = ('file_path', 'batch_number', 'timestamp')
+
+
+def _now():
+    # Same format as SQLite's CURRENT_TIMESTAMP (UTC), so both sort together
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+
+
+class ResultsStore:
+    """Buffered writer and query helpers over the QA history tables."""
+
+    def __init__(self, db_path=RESULT_DB, batch_size=BATCH_SIZE):
+        self.db_path = str(db_path)
+        self.batch_size = batch_size
+        self.pending = {}             # table -> (columns, [rows])
+        self.pending_rows = 0
+        # Autocommit mode: transactions are opened explicitly in flush()
+        self.conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        # In WAL mode NORMAL only risks the last transactions on power loss, never corruption
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT_MS}')
+        self._ensure_schema()
+
+    def _columns(self, table):
+        return [row[1] for row in self.conn.execute(f'PRAGMA table_info({table})')]
+
+    def _ensure_schema(self):
+        with self.transaction():
+            for table, ddl in TABLES.items():
+                self.conn.execute(ddl)
+                columns = self._columns(table)
+                for name, kind in ADDED_COLUMNS.get(table, ()):
+                    if name not in columns:
+                        self.conn.execute(f'ALTER TABLE {table} ADD COLUMN {name} {kind}')
+                        if name == 'timestamp' and 'created_at' in columns:
+                            self.conn.execute(f'UPDATE {table} SET timestamp = created_at')
+                for column in INDEXED_COLUMNS:
+                    if column not in columns and column not in dict(ADDED_COLUMNS.get(table, ())):
+                        continue
+                    self.conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_{column} ON {table} ({column})')
+
+    def transaction(self):
+        return _Transaction(self.conn)
+
+    # ------------------------------------------------------------------
+    # Writing
+
+    def begin_batch(self, agent_name):
+        """Register a run in processing_state and return its batch number."""
+        with self.transaction():
+            row = self.conn.execute('SELECT COALESCE(MAX(batch_number), 0) + 1 FROM processing_state').fetchone()
+            self.conn.execute(
+                'INSERT INTO processing_state (agent_name, batch_number, status, timestamp) VALUES (?, ?, ?, ?)',
+                (agent_name, row[0], 'running', _now()))
+        return row[0]
+
+    def finish_batch(self, batch_number, status='completed', summary=None):
+        self.flush()
+        with self.transaction():
+            self.conn.execute(
+                'UPDATE processing_state SET status = ?, results_summary = ?, timestamp = ? WHERE batch_number = ?',
+                (status, json.dumps(summary) if summary is not None else None, _now(), batch_number))
+
+    def add(self, table, **values):
+        """Buffer one row; the buffer is written once it holds batch_size rows."""
+        values.setdefault('timestamp', _now())
+        columns = tuple(sorted(values))
+        known, rows = self.pending.get(table, (columns, []))
+        if known != columns:
+            # A different column set: write what is buffered for this table first
+            self.flush()
+            known, rows = columns, []
+        rows.append(tuple(values[name] for name in columns))
+        self.pending[table] = (columns, rows)
+        self.pending_rows += 1
+        if self.pending_rows >= self.batch_size:
+            self.flush()
+
+    def add_validation(self, file_path, batch_number, result, seconds=None):
+        """One compliance checker result (a dict with 'compliant' and 'issues')."""
+        self.add('validation_results',
+                 file_path=str(file_path),
+                 batch_number=batch_number,
+                 validation_status='compliant' if result.get('compliant') else 'non_compliant',
+                 errors_found=json.dumps(result.get('issues', [])),
+                 fix_suggestions=json.dumps(result.get('missing_required') or result.get('missing_elements') or []),
+                 duration_seconds=seconds)
+
+    def flush(self):
+        if not self.pending_rows:
+            return
+        with self.transaction():
+            for table, (columns, rows) in self.pending.items():
+                placeholders = ', '.join('?' * len(columns))
+                self.conn.executemany(f'INSERT INTO {table} ({", ".join(columns)}) VALUES ({placeholders})', rows)
+        self.pending = {}
+        self.pending_rows = 0
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ------------------------------------------------------------------
+    # Queries
+
+    def latest_status(self):
+        """[(file_path, status, batch_number, timestamp)] from each file's most recent validation."""
+        # MAX(id) per file_path is answered from the file_path index alone
+        return self.conn.execute("""
+            SELECT v.file_path, v.validation_status, v.batch_number, v.timestamp
+            FROM validation_results v
+            JOIN (SELECT file_path, MAX(id) AS id FROM validation_results GROUP BY file_path) latest
+              ON v.id = latest.id
+            ORDER BY v.file_path""").fetchall()
+
+    def issue_trends(self, batches=10, agent_name=None):
+        """{issue: {batch_number: files with that issue}} over the last batches runs (of one tool)."""
+        rows = self.conn.execute("""
+            SELECT v.batch_number, issue.value, COUNT(*)
+            FROM validation_results v, json_each(v.errors_found) issue
+            WHERE v.batch_number IN (SELECT batch_number FROM processing_state
+                                     WHERE ?1 IS NULL OR agent_name = ?1
+                                     ORDER BY batch_number DESC LIMIT ?2)
+              AND json_valid(v.errors_found)
+            GROUP BY v.batch_number, issue.value""", (agent_name, batches)).fetchall()
+        trends = {}
+        for batch_number, issue, count in rows:
+            trends.setdefault(issue, {})[batch_number] = count
+        return trends
+
+    def slowest_files(self, limit=10, since=None):
+        """[(file_path, slowest seconds, mean seconds, checks)] since a 'YYYY-MM-DD[ HH:MM:SS]' time."""
+        return self.conn.execute("""
+            SELECT file_path, MAX(duration_seconds), AVG(duration_seconds), COUNT(duration_seconds)
+            FROM validation_results
+            WHERE timestamp >= ? AND duration_seconds IS NOT NULL
+            GROUP BY file_path
+            ORDER BY MAX(duration_seconds) DESC
+            LIMIT ?""", (since or '', limit)).fetchall()
+
+    def batches(self, limit=10):
+        """[(batch_number, agent_name, status, timestamp)] of the most recent runs."""
+        return self.conn.execute("""
+            SELECT batch_number, agent_name, status, timestamp FROM processing_state
+            WHERE batch_number IS NOT NULL ORDER BY batch_number DESC LIMIT ?""", (limit,)).fetchall()
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT (or ROLLBACK), on a connection in autocommit mode."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        # Take the write lock up front so a busy database waits here, not mid-transaction
+        self.conn.execute('BEGIN IMMEDIATE')
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute('ROLLBACK' if exc_type else 'COMMIT')
+
+
+def record_checks(db_path, agent_name, checks, metrics=None):
+    """Store (chapter file, result) pairs from a checker run as one batch; returns the batch number."""
+    with ResultsStore(db_path) as store:
+        batch_number = store.begin_batch(agent_name)
+        compliant = total = 0
+        for chapter_file, result in checks:
+            seconds = metrics.file_seconds('check', chapter_file) if metrics else None
+            store.add_validation(chapter_key(chapter_file), batch_number, result, seconds)
+            total += 1
+            compliant += bool(result.get('compliant'))
+        store.finish_batch(batch_number, summary={'files': total, 'compliant': compliant})
+    print(f"🗄️  Results stored as batch {batch_number} ({total} files, {db_path})")
+    return batch_number
+
+
+def add_store_arguments(parser):
+    """--record for the compliance checkers (stores into the --db database)."""
+    parser.add_argument('--record', action='store_true',
+                        help="append this run's results to the QA history in the --db database")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the QA results history")
+    parser.add_argument('--db', default=RESULT_DB, metavar='PATH', help=f"database (default: {RESULT_DB})")
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('latest', help="latest validation status of every file")
+    trends = sub.add_parser('trends', help="issue counts across recent runs")
+    trends.add_argument('--batches', type=int, default=10, help="runs to include")
+    trends.add_argument('--agent', help="only runs of this tool (e.g. simple_compliance_check)")
+    slowest = sub.add_parser('slowest', help="files that took longest to check")
+    slowest.add_argument('--limit', type=int, default=10)
+    slowest.add_argument('--since', metavar='DATE', help="only runs since DATE (YYYY-MM-DD)")
+    sub.add_parser('batches', help="recent runs")
+    args = parser.parse_args()
+
+    with ResultsStore(args.db) as store:
+        if args.command == 'latest':
+            rows = store.latest_status()
+            print(f"📋 Latest status of {len(rows)} files")
+            for file_path, status, batch_number, timestamp in rows:
+                icon = '✅' if status == 'compliant' else '❌'
+                print(f"  {icon} {file_path} ({status}, batch {batch_number}, {timestamp})")
+        elif args.command == 'trends':
+            trends = store.issue_trends(args.batches, args.agent)
+            numbers = sorted({n for counts in trends.values() for n in counts})
+            print(f"📈 Issue trends over batches {', '.join(map(str, numbers)) or '-'}")
+            for issue, counts in sorted(trends.items(), key=lambda item: -max(item[1].values())):
+                series = ' → '.join(str(counts.get(n, 0)) for n in numbers)
+                print(f"  {issue}: {series}")
+        elif args.command == 'slowest':
+            print("🐢 Slowest files")
+            for file_path, slowest_seconds, mean_seconds, checks in store.slowest_files(args.limit, args.since):
+                print(f"  {slowest_seconds * 1000:8.1f} ms max, {mean_seconds * 1000:8.1f} ms mean "
+                      f"over {checks} checks  {file_path}")
+        else:
+            for batch_number, agent_name, status, timestamp in store.batches():
+                print(f"  #{batch_number} {agent_name}: {status} ({timestamp})")
+
+
+if __name__ == "__main__":
+    main()
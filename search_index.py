@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+"""
+EPUB Search Index - Full-text index over the spine, queried without the XHTML
+Plain text is streamed out of every spine document in reading order and
+split into paragraphs (p, li, headings, ...), each located by the nearest
+element id. Every word is posted with its paragraph and position, and the
+result is written as one little-endian binary file of fixed-width arrays
+that queries read through mmap: a term lookup is a binary search over the
+sorted dictionary, and phrases are matched on positions.
+"""
+
+import argparse
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+import time
+from array import array
+from xml.parsers import expat
+
+from package_index import PackageIndex, PackageError
+from instrumentation import active, add_instrumentation_arguments, instrumented_from_args
+
+DEFAULT_INDEX = 'search.idx'
+
+MAGIC = b'EPUBSRCH'
+FORMAT_VERSION = 1
+
+# magic, version, terms, paragraphs, then (offset, length) of each section
+HEADER = struct.Struct('<8sIII')
+SECTIONS = ('meta', 'term_offsets', 'terms', 'posting_offsets', 'postings', 'paragraphs', 'text')
+SECTION_TABLE = struct.Struct(f'<{2 * len(SECTIONS)}Q')
+
+# Paragraph table row: document number, text start, text length, anchor start, anchor length
+PARAGRAPH_FIELDS = 5
+
+# Elements whose text forms a paragraph of its own
+BLOCK_TAGS = {'p', 'li', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'blockquote', 'dt', 'dd',
+              'td', 'th', 'figcaption', 'caption', 'pre', 'div', 'section', 'aside', 'header', 'footer'}
+SKIP_TAGS = {'head', 'script', 'style', 'svg'}
+
+WORD = re.compile(r"\w+(?:['’]\w+)*")
+# Positions are stored as 16-bit numbers; longer paragraphs index their first 65535 words
+MAX_POSITION = 0xFFFF
+
+
+def tokenize(text):
+    return [word.replace('’', "'") for word in WORD.findall(text.casefold())]
+
+
+class TextExtractor:
+    """Paragraphs of one XHTML document as (anchor id, text), streamed with expat."""
+
+    def __init__(self):
+        self.paragraphs = []
+        self.title = ''
+        self._buffer = []
+        self._ids = []                # id (or None) of each open element
+        self._last_id = ''
+        self._skip = 0
+        self._in_title = False
+
+    def _flush(self):
+        text = ' '.join(''.join(self._buffer).split())
+        self._buffer = []
+        if text:
+            anchor = next((i for i in reversed(self._ids) if i), self._last_id)
+            self.paragraphs.append((anchor, text))
+
+    def _start(self, name, attrs):
+        tag = name.rpartition(':')[2].lower()
+        element_id = attrs.get('id')
+        if tag in BLOCK_TAGS:
+            self._flush()
+        elif tag == 'br':
+            self._buffer.append(' ')
+        if tag in SKIP_TAGS:
+            self._skip += 1
+        self._in_title = tag == 'title'
+        self._ids.append(element_id)
+        if element_id:
+            self._last_id = element_id
+
+    def _end(self, name):
+        tag = name.rpartition(':')[2].lower()
+        if tag in BLOCK_TAGS:
+            self._flush()
+        if tag in SKIP_TAGS:
+            self._skip -= 1
+        self._in_title = False
+        self._ids.pop()
+
+    def _text(self, data):
+        if self._in_title:
+            self.title += data
+        elif not self._skip:
+            self._buffer.append(data)
+
+    def parse(self, data):
+        parser = expat.ParserCreate()
+        parser.StartElementHandler = self._start
+        parser.EndElementHandler = self._end
+        parser.CharacterDataHandler = self._text
+        parser.Parse(data, True)
+        self._flush()
+        return self.paragraphs
+
+
+def build_search_index(index, output=DEFAULT_INDEX, files=None):
+    """Index the spine of index into output; files maps book paths to substitute sources.
+
+    Returns (documents, paragraphs, distinct terms).
+    """
+    files = files or {}
+    documents = []
+    table = array('I')
+    text_blob = bytearray()
+    postings = {}                     # term -> (array of paragraphs, array of positions)
+
+    metrics = active()
+    for item in index.spine:
+        if item.media_type != 'application/xhtml+xml':
+            continue
+        source = files.get(item.path) or index.full_path(item)
+        with metrics.file('search', item.path):
+            with open(source, 'rb') as f:
+                data = f.read()
+            metrics.count('bytes_read', len(data))
+            extractor = TextExtractor()
+            try:
+                paragraphs = extractor.parse(data)
+            except expat.ExpatError as e:
+                print(f"  ⚠️  {item.path}: not well-formed ({e}), skipped")
+                continue
+
+            doc_number = len(documents)
+            documents.append({'path': item.path, 'title': ' '.join(extractor.title.split())})
+            for anchor, text in paragraphs:
+                paragraph = len(table) // PARAGRAPH_FIELDS
+                encoded = text.encode('utf-8')
+                anchor_bytes = anchor.encode('utf-8')
+                table.extend((doc_number, len(text_blob), len(encoded),
+                              len(text_blob) + len(encoded), len(anchor_bytes)))
+                text_blob += encoded + anchor_bytes
+                for position, word in enumerate(tokenize(text)[:MAX_POSITION + 1]):
+                    entry = postings.get(word)
+                    if entry is None:
+                        entry = postings[word] = (array('I'), array('H'))
+                    entry[0].append(paragraph)
+                    entry[1].append(position)
+
+    terms = sorted(postings)
+    term_offsets, posting_offsets = array('Q', [0]), array('Q', [0])
+    term_blob, posting_blob = bytearray(), bytearray()
+    for term in terms:
+        paragraphs, positions = postings[term]
+        term_blob += term.encode('utf-8')
+        term_offsets.append(len(term_blob))
+        posting_blob += _little(paragraphs) + _little(positions)
+        # Keep every term's paragraph array 4-byte aligned
+        posting_blob += b'\0' * (-len(posting_blob) % 4)
+        posting_offsets.append(len(posting_blob))
+
+    meta = json.dumps({'documents': documents, 'opf': index.opf_path}).encode('utf-8')
+    sections = [meta, _little(term_offsets), bytes(term_blob), _little(posting_offsets),
+                bytes(posting_blob), _little(table), bytes(text_blob)]
+
+    # Sections start on 8-byte boundaries so each can be cast in place
+    offset = HEADER.size + SECTION_TABLE.size
+    layout = []
+    for section in sections:
+        offset += -offset % 8
+        layout += [offset, len(section)]
+        offset += len(section)
+
+    tmp_path = f"{output}.{os.getpid()}.part"
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(terms), len(table) // PARAGRAPH_FIELDS))
+        f.write(SECTION_TABLE.pack(*layout))
+        for section, start in zip(sections, layout[::2]):
+            f.write(b'\0' * (start - f.tell()))
+            f.write(section)
+        metrics.count('bytes_written', f.tell())
+    os.replace(tmp_path, output)
+    return len(documents), len(table) // PARAGRAPH_FIELDS, len(terms)
+
+
+def _little(values):
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+class SearchIndex:
+    """A built index, memory-mapped; only the pages a query touches are read."""
+
+    def __init__(self, path=DEFAULT_INDEX):
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.term_count, self.paragraph_count = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"{path} is not a version {FORMAT_VERSION} search index")
+        layout = SECTION_TABLE.unpack_from(self._map, HEADER.size)
+        view = memoryview(self._map)
+        self._sections = {name: view[start:start + length]
+                          for name, start, length in zip(SECTIONS, layout[::2], layout[1::2])}
+        meta = json.loads(bytes(self._sections['meta']))
+        self.documents = meta['documents']
+        self._term_offsets = self._ints('term_offsets', 'Q')
+        self._posting_offsets = self._ints('posting_offsets', 'Q')
+        self._paragraphs = self._ints('paragraphs', 'I')
+
+    def _ints(self, section, typecode, start=0, end=None):
+        data = self._sections[section][start:end]
+        if sys.byteorder == 'little':
+            return data.cast(typecode)
+        values = array(typecode, bytes(data))
+        values.byteswap()
+        return values
+
+    def close(self):
+        self._sections = self._term_offsets = self._posting_offsets = self._paragraphs = None
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def term(self, number):
+        return bytes(self._sections['terms'][self._term_offsets[number]:self._term_offsets[number + 1]])
+
+    def lookup(self, word):
+        """(paragraph numbers, positions) posted for word, or None."""
+        key = word.encode('utf-8')
+        low, high = 0, self.term_count
+        while low < high:
+            middle = (low + high) // 2
+            if self.term(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low == self.term_count or self.term(low) != key:
+            return None
+        start, end = self._posting_offsets[low], self._posting_offsets[low + 1]
+        # n paragraph numbers (uint32), n positions (uint16), then 0 or 2 bytes of padding
+        count = (end - start) // 6
+        return (self._ints('postings', 'I', start, start + 4 * count),
+                self._ints('postings', 'H', start + 4 * count, start + 6 * count))
+
+    def paragraph(self, number):
+        """{'document', 'path', 'anchor', 'text'} of one paragraph."""
+        row = self._paragraphs[number * PARAGRAPH_FIELDS:(number + 1) * PARAGRAPH_FIELDS]
+        document, text_start, text_length, anchor_start, anchor_length = row
+        text = self._sections['text']
+        return {
+            'document': self.documents[document]['title'],
+            'path': self.documents[document]['path'],
+            'anchor': bytes(text[anchor_start:anchor_start + anchor_length]).decode('utf-8'),
+            'text': bytes(text[text_start:text_start + text_length]).decode('utf-8')
+        }
+
+    def phrase(self, words):
+        """{paragraph: match count} where words occur consecutively."""
+        postings = [self.lookup(word) for word in words]
+        if not words or any(p is None for p in postings):
+            return {}
+        # Start from the rarest word and check the others at their offsets
+        rarest = min(range(len(words)), key=lambda n: len(postings[n][0]))
+        others = [(n - rarest, set(zip(*postings[n]))) for n in range(len(words)) if n != rarest]
+        hits = {}
+        for paragraph, position in zip(*postings[rarest]):
+            if all((paragraph, position + shift) in entries for shift, entries in others):
+                hits[paragraph] = hits.get(paragraph, 0) + 1
+        return hits
+
+    def search(self, query, limit=20):
+        """Paragraphs matching every term and "quoted phrase" of query, best first.
+
+        Returns (total matches, [(paragraph number, hits)]).
+        """
+        phrases = query_parts(query)
+        if not phrases:
+            return 0, []
+
+        matches = None
+        for words in phrases:
+            if len(words) == 1:
+                posted = self.lookup(words[0])
+                hits = {}
+                for paragraph in (posted[0] if posted is not None else ()):
+                    hits[paragraph] = hits.get(paragraph, 0) + 1
+            else:
+                hits = self.phrase(words)
+            if matches is None:
+                matches = hits
+            else:
+                matches = {p: matches[p] + count for p, count in hits.items() if p in matches}
+            if not matches:
+                return 0, []
+        # Most hits first, then reading order
+        ranked = sorted(matches.items(), key=lambda item: (-item[1], item[0]))
+        return len(ranked), ranked[:limit]
+
+
+def query_parts(query):
+    """Word lists of the query: one per "quoted phrase", then one per loose term."""
+    parts = [tokenize(p) for p in re.findall(r'"([^"]*)"', query)]
+    parts += [[word] for word in tokenize(re.sub(r'"[^"]*"', ' ', query))]
+    return [p for p in parts if p]
+
+
+def snippet(text, parts, width=160):
+    """Part of text around the first match of the query, with matches marked."""
+    patterns = [re.compile(r'(?i)\b' + r'\W+'.join(re.escape(w).replace("'", "['’]") for w in words) + r'\b')
+                for words in parts]
+    found = [m.start() for m in (p.search(text) for p in patterns) if m]
+    start = max(0, min(found, default=0) - width // 3)
+    excerpt = text[start:start + width]
+    for pattern in patterns:
+        excerpt = pattern.sub(lambda m: f"«{m.group(0)}»", excerpt)
+    return ('…' if start else '') + excerpt + ('…' if start + width < len(text) else '')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and query a full-text index of the book")
+    sub = parser.add_subparsers(dest='command', required=True)
+    build = sub.add_parser('build', help="index the spine of a book")
+    build.add_argument('--source', default='.', metavar='DIR', help="book root")
+    build.add_argument('--output', default=DEFAULT_INDEX, metavar='PATH', help="index file")
+    add_instrumentation_arguments(build)
+    query = sub.add_parser('query', help='search for terms and "quoted phrases" (all must match)')
+    query.add_argument('terms', nargs='+')
+    query.add_argument('--index', default=DEFAULT_INDEX, metavar='PATH', help="index file")
+    query.add_argument('--limit', type=int, default=20, help="paragraphs to show")
+    query.add_argument('--json', action='store_true', help="print matches as JSON")
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        print("🔎 Building search index...")
+        start = time.perf_counter()
+        try:
+            index = PackageIndex.load(args.source)
+        except (FileNotFoundError, PackageError) as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+        with instrumented_from_args('search_index', args):
+            documents, paragraphs, terms = build_search_index(index, args.output)
+        print(f"✅ {documents} documents, {paragraphs:,} paragraphs, {terms:,} terms → {args.output} "
+              f"({os.path.getsize(args.output):,} bytes, {time.perf_counter() - start:.2f}s)")
+        return
+
+    text = ' '.join(args.terms)
+    start = time.perf_counter()
+    with SearchIndex(args.index) as search:
+        total, ranked = search.search(text, args.limit)
+        results = [dict(search.paragraph(number), hits=hits) for number, hits in ranked]
+    elapsed = (time.perf_counter() - start) * 1000
+
+    if args.json:
+        print(json.dumps({'query': text, 'total': total, 'results': results}, indent=2))
+        return
+    parts = query_parts(text)
+    print(f"🔎 {total} paragraphs match {text!r} ({elapsed:.1f} ms)")
+    for result in results:
+        location = f"{result['path']}#{result['anchor']}" if result['anchor'] else result['path']
+        print(f"\n📄 {location} ({result['document']})")
+        print(f"   {snippet(result['text'], parts)}")
+    if total > len(results):
+        print(f"\n… and {total - len(results)} more (--limit)")
+    if not total:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
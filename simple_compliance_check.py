@@ -5,14 +5,108 @@ Uses only built-in Python modules.
 """
 
 import os
+import sys
 import re
 from pathlib import Path
 import json
+import argparse
+
+from package_index import PackageError
+from epub_source import chapter_sources, open_chapter, close_archives
+from parallel_checks import run_checks, add_parallel_arguments, resolve_jobs
+from result_cache import cached_checks, add_cache_arguments
+from results_store import record_checks, add_store_arguments
+from instrumentation import active, add_instrumentation_arguments, instrumented_from_args
+
+TITLE_PATTERN = r'<title>([^<]+)</title>'
+FONT_KEYS = ('google_fonts', 'cinzel_font', 'baskerville_font')
+STRUCTURE_KEYS = ('chapter_structure', 'title_container', 'title_word')
+
+class RuleScanner:
+    """Find the first match of many rules in one left-to-right pass.
+    
+    Rules are (key, pattern, flags). A single alternation of every pattern,
+    run over a lowercased copy of the text, yields candidate positions; each
+    candidate is confirmed with the rule's own compiled regex at that
+    position, so scan() returns exactly what one re.search per rule would.
+    Rules drop out once matched, and the pass stops when none are left.
+    """
+    
+    # Characters that re.IGNORECASE folds onto ASCII letters but str.lower() does not
+    # (or folds with a change of length), which would desync the lowercased copy
+    FOLD_MISMATCH = re.compile('[\u0130\u0131\u017f]')
+    
+    def __init__(self, rules):
+        self.rules = [(key, re.compile(pattern, flags)) for key, pattern, flags in rules]
+        
+        patterns = [pattern for _, pattern, _ in rules]
+        if all(p.isascii() and not re.search(r'\\[A-Za-z0-9]', p) for p in patterns):
+            self._candidates = re.compile(self._combine([p.lower() for p in patterns]))
+        else:
+            # Lowercasing would change escapes like \S, and backreferences would be
+            # renumbered in the alternation; use plain searches
+            self._candidates = None
+    
+    @staticmethod
+    def _combine(patterns):
+        """Alternation with patterns grouped by their leading literal, so each
+        candidate position tries one branch instead of every rule."""
+        groups = {}
+        loose = []
+        for pattern in patterns:
+            if pattern[:1] == '\\' and len(pattern) > 1 and not pattern[1].isalnum():
+                head, rest = pattern[:2], pattern[2:]
+            elif pattern and pattern[0] not in '.^$*+?{}[]|()\\':
+                head, rest = pattern[0], pattern[1:]
+            else:
+                loose.append(f'(?:{pattern})')
+                continue
+            if rest[:1] in ('*', '+', '?', '{') or '|' in rest:
+                # Quantified leading literal or alternation; keep the pattern whole
+                loose.append(f'(?:{pattern})')
+                continue
+            groups.setdefault(head, []).append(rest)
+        branches = [f"{head}(?:{'|'.join(rests)})" for head, rests in groups.items()]
+        return '|'.join(branches + loose)
+    
+    def scan(self, content):
+        """Return {key: match} for every rule found in content."""
+        if self._candidates is None or self.FOLD_MISMATCH.search(content):
+            found = {}
+            for key, regex in self.rules:
+                match = regex.search(content)
+                if match:
+                    found[key] = match
+            return found
+        
+        lowered = content.lower()
+        found = {}
+        pending = self.rules
+        pos = 0
+        while pending:
+            hit = self._candidates.search(lowered, pos)
+            if hit is None:
+                break
+            start = hit.start()
+            remaining = []
+            for key, regex in pending:
+                match = regex.match(content, start)
+                if match:
+                    found[key] = match
+                else:
+                    remaining.append((key, regex))
+            pending = remaining
+            pos = start + 1
+        return found
 
 class SimpleComplianceChecker:
-    def __init__(self):
+    def __init__(self, sources=None):
+        # Book directories and/or packed .epub files
+        self.sources = [str(source) for source in sources] if sources else ['.']
         self.chapter_files = []
+        self.unreadable = []
         self.results = {}
+        self._scanner = None
         
         # Template requirements
         self.required_patterns = {
@@ -45,32 +139,51 @@ class SimpleComplianceChecker:
         ]
     
     def find_chapters(self):
-        """Find all chapter XHTML files."""
-        oebps_text = Path('OEBPS/text')
-        if not oebps_text.exists():
-            print("❌ OEBPS/text directory not found!")
-            return []
-        
-        # Find files with 'chapter' in the name
-        for file in oebps_text.glob('*chapter*.xhtml'):
-            self.chapter_files.append(file)
-        
-        # Sort by roman numeral
-        self.chapter_files.sort(key=self._extract_chapter_num)
+        """Find all chapter XHTML files, in spine order, in every source."""
+        self.chapter_files = []
+        self.unreadable = []
+        for source in self.sources:
+            # Chapters are the spine documents with 'chapter' in the name;
+            # members of a .epub are read from the zip, not extracted
+            try:
+                self.chapter_files.extend(chapter_sources(source))
+            except FileNotFoundError:
+                print(f"❌ OEBPS/content.opf not found in {source}!")
+                self.unreadable.append(source)
+            except PackageError as e:
+                print(f"❌ {e}")
+                self.unreadable.append(source)
         print(f"📁 Found {len(self.chapter_files)} chapter files")
         return self.chapter_files
     
-    def _extract_chapter_num(self, filepath):
-        """Extract chapter number for sorting."""
-        roman_to_num = {'i': 1, 'ii': 2, 'iii': 3, 'iv': 4, 'v': 5, 'vi': 6,
-                        'vii': 7, 'viii': 8, 'ix': 9, 'x': 10, 'xi': 11, 'xii': 12,
-                        'xiii': 13, 'xiv': 14, 'xv': 15, 'xvi': 16}
-        
-        name = filepath.name.lower()
-        for roman, num in roman_to_num.items():
-            if f'chapter-{roman}' in name:
-                return num
-        return 0
+    def _result_key(self, chapter_file):
+        """Report key: the file name, qualified by its archive when checking several books."""
+        if len(self.sources) > 1:
+            return getattr(chapter_file, 'label', str(chapter_file))
+        return chapter_file.name
+    
+    def ruleset(self):
+        """Everything check_chapter's verdict depends on besides the file itself."""
+        return {
+            'required_patterns': self.required_patterns,
+            'mustache_vars': self.mustache_vars,
+            'title_pattern': TITLE_PATTERN,
+            'font_keys': FONT_KEYS,
+            'structure_keys': STRUCTURE_KEYS
+        }
+    
+    def _get_scanner(self):
+        """Compile every rule of check_chapter into one RuleScanner (once)."""
+        if self._scanner is None:
+            rules = [(('required', name), pattern, re.IGNORECASE)
+                     for name, pattern in self.required_patterns.items()]
+            # Font and structure checks are case-sensitive
+            rules += [(('exact', key), self.required_patterns[key], 0)
+                      for key in FONT_KEYS + STRUCTURE_KEYS]
+            rules += [(('var', var), re.escape(var), 0) for var in self.mustache_vars]
+            rules.append((('title',), TITLE_PATTERN, 0))
+            self._scanner = RuleScanner(rules)
+        return self._scanner
     
     def check_chapter(self, chapter_file):
         """Check a single chapter for compliance."""
@@ -86,32 +199,28 @@ class SimpleComplianceChecker:
         }
         
         try:
-            with open(chapter_file, 'r', encoding='utf-8', errors='ignore') as f:
+            with open_chapter(chapter_file, errors='ignore') as f:
                 content = f.read()
             
             result['file_size'] = len(content)
+            found = self._get_scanner().scan(content)
             
             # Check required patterns
-            for name, pattern in self.required_patterns.items():
-                if not re.search(pattern, content, re.IGNORECASE):
+            for name in self.required_patterns:
+                if ('required', name) not in found:
                     result['missing_required'].append(name)
                     result['issues'].append(f"Missing: {name}")
                     result['compliant'] = False
             
             # Check for Google Fonts
-            if (re.search(self.required_patterns['google_fonts'], content) and
-                re.search(self.required_patterns['cinzel_font'], content) and
-                re.search(self.required_patterns['baskerville_font'], content)):
+            if all(('exact', key) in found for key in FONT_KEYS):
                 result['has_fonts'] = True
             else:
                 result['issues'].append("Missing proper Google Fonts links")
                 result['compliant'] = False
             
             # Check chapter structure
-            structure_count = 0
-            for key in ['chapter_structure', 'title_container', 'title_word']:
-                if re.search(self.required_patterns[key], content):
-                    structure_count += 1
+            structure_count = sum(1 for key in STRUCTURE_KEYS if ('exact', key) in found)
             
             result['has_structure'] = structure_count >= 2
             if not result['has_structure']:
@@ -120,7 +229,7 @@ class SimpleComplianceChecker:
             
             # Check for unreplaced mustache variables
             for var in self.mustache_vars:
-                if var in content:
+                if ('var', var) in found:
                     result['unreplaced_vars'].append(var)
                     result['issues'].append(f"Unreplaced variable: {var}")
                     result['compliant'] = False
@@ -130,7 +239,7 @@ class SimpleComplianceChecker:
                 result['issues'].append("Suspiciously short content - possible truncation")
             
             # Check for proper title tag
-            title_match = re.search(r'<title>([^<]+)</title>', content)
+            title_match = found.get(('title',))
             if not title_match or not title_match.group(1).strip():
                 result['issues'].append("Missing or empty title tag")
                 result['compliant'] = False
@@ -141,18 +250,30 @@ class SimpleComplianceChecker:
         
         return result
     
-    def analyze_all(self):
-        """Analyze all chapters."""
+    def analyze_all(self, jobs=1, chunksize=None, cache_db=None):
+        """Analyze all chapters (across jobs worker processes when jobs > 1).
+        
+        With cache_db, unchanged chapters reuse their results from that database.
+        """
         print("\n🔍 Starting Template Compliance Analysis...")
         print("=" * 60)
         
-        if not self.find_chapters():
+        metrics = active()
+        with metrics.stage('discover'):
+            found = self.find_chapters()
+        if not found:
             print("❌ No chapter files found!")
             return {}
         
-        for chapter_file in self.chapter_files:
-            print(f"Checking: {chapter_file.name}...")
-            self.results[chapter_file.name] = self.check_chapter(chapter_file)
+        if cache_db:
+            checks = cached_checks(self, 'check_chapter', self.chapter_files, cache_db, jobs, chunksize)
+        else:
+            checks = run_checks(self, 'check_chapter', self.chapter_files, jobs, chunksize)
+        with metrics.stage('check'):
+            for chapter_file, result in checks:
+                print(f"Checking: {chapter_file.name}...")
+                self.results[self._result_key(chapter_file)] = result
+        close_archives()
         
         return self.results
     
@@ -228,9 +349,25 @@ class SimpleComplianceChecker:
         print(f"\n💾 Detailed JSON report saved to: compliance_report.json")
 
 def main():
-    checker = SimpleComplianceChecker()
-    checker.analyze_all()
+    parser = argparse.ArgumentParser(description="Simple EPUB template compliance check")
+    parser.add_argument('sources', nargs='*', metavar='BOOK',
+                        help="book directories or .epub files to check (default: current directory)")
+    add_parallel_arguments(parser)
+    add_cache_arguments(parser)
+    add_store_arguments(parser)
+    add_instrumentation_arguments(parser)
+    args = parser.parse_args()
+    
+    checker = SimpleComplianceChecker(args.sources)
+    with instrumented_from_args('simple_compliance_check', args) as metrics:
+        checker.analyze_all(jobs=resolve_jobs(args.jobs), chunksize=args.chunksize,
+                            cache_db=None if args.no_cache else args.db)
+        if args.record:
+            record_checks(args.db, 'simple_compliance_check',
+                          ((f, checker.results[checker._result_key(f)]) for f in checker.chapter_files), metrics)
     checker.print_report()
+    if checker.unreadable:
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+Synthetic Book Generator - Emit a valid EPUB source tree of any size
+Chapters follow the README's chapter template (Google Fonts link, chapter
+number/title containers, Bible quote, introduction, content, quiz and
+worksheet sections), so the packaging, fixer and checker scripts do the
+same work per file they do on the real book. Output is deterministic for a
+given seed, which keeps benchmark runs comparable.
+"""
+
+import argparse
+import os
+import random
+import struct
+import uuid
+import zlib
+from xml.sax.saxutils import escape
+
+BOOK_TITLE = "Curls &amp; Contemplation: A Stylist's Interactive Journey Journal"
+
+# (chapters, other spine pages, images): 'book' has the real book's 44 spine documents
+SCALES = {
+    'book': (16, 28, 29),
+    'medium': (400, 100, 300),
+    'large': (4000, 1000, 3000),
+}
+
+GOOGLE_FONTS_LINK = ('<link href="https://fonts.googleapis.com/css2?family=Cinzel+Decorative:wght@400;700'
+                     '&amp;family=Libre+Baskerville:ital,wght@0,400;0,700;1,400&amp;display=swap" '
+                     'rel="stylesheet" />')
+
+WORDS = ('hair texture client salon stylist craft color cut curl growth business network mentor '
+         'wellness practice creative vision ethics legacy confidence culture studio technique '
+         'education resilience community portfolio brand journey balance story care').split()
+
+STYLE_CSS = """body { font-family: 'Libre Baskerville', serif; line-height: 1.6; margin: 0 5%; }
+.chapter-navigation { display: flex; justify-content: space-between; font-size: 0.8rem; }
+.chapter-number-container { text-align: center; margin-top: 2rem; }
+.chapter-number-text { font-family: 'Cinzel Decorative', serif; font-size: 3rem; }
+.chapter-title-container { text-align: center; margin-bottom: 2rem; }
+.chapter-title-word { font-family: 'Cinzel Decorative', serif; font-size: 2rem; margin: 0; }
+.bible-quote-container { margin: 2rem 10%; font-style: italic; }
+.bible-quote-reference { text-align: right; }
+.introduction-heading { text-transform: uppercase; text-align: center; }
+.content-header, .quiz-header, .worksheet-header { color: #1797a6; }
+.quiz-question { margin-bottom: 1rem; }
+.worksheet-input { min-height: 4rem; border: 1px solid #b2dfdb; }
+figure img { max-width: 100%; }
+"""
+
+
+def roman(number):
+    numerals = ((1000, 'M'), (900, 'CM'), (500, 'D'), (400, 'CD'), (100, 'C'), (90, 'XC'),
+                (50, 'L'), (40, 'XL'), (10, 'X'), (9, 'IX'), (5, 'V'), (4, 'IV'), (1, 'I'))
+    out = []
+    for value, letters in numerals:
+        count, number = divmod(number, value)
+        out.append(letters * count)
+    return ''.join(out)
+
+
+def sentence(rng, words=12):
+    text = ' '.join(rng.choice(WORDS) for _ in range(words))
+    return text[0].upper() + text[1:] + '.'
+
+
+def paragraph(rng, sentences=5):
+    return ' '.join(sentence(rng, rng.randint(8, 16)) for _ in range(sentences))
+
+
+def png_bytes(rng, width, height):
+    """An RGB PNG of noise: incompressible, like a photo, and cheap to make."""
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+    row_bytes = width * 3
+    raw = b''.join(b'\0' + rng.randbytes(row_bytes) for _ in range(height))
+    return (b'\x89PNG\r\n\x1a\n' +
+            chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)) +
+            chunk(b'IDAT', zlib.compress(raw, 1)) +
+            chunk(b'IEND', b''))
+
+
+def _head(title, fonts_link=True, charset='UTF-8'):
+    lines = [f'    <meta charset="{charset}" />',
+             '    <meta name="viewport" content="width=device-width, initial-scale=1.0" />',
+             f'    <title>{title}</title>']
+    if fonts_link:
+        lines.append(f'    {GOOGLE_FONTS_LINK}')
+    lines.append('    <link rel="stylesheet" type="text/css" href="../styles/style.css" />')
+    return '\n'.join(lines)
+
+
+def _document(head, body, body_class=''):
+    class_attr = f' class="{body_class}"' if body_class else ''
+    return f"""<?xml version="1.0" encoding="utf-8"?>
+<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" xml:lang="en" lang="en">
+<head>
+{head}
+</head>
+<body{class_attr}>
+{body}
+</body>
+</html>
+"""
+
+
+def chapter_xhtml(rng, number, title, prev_href, next_href, images, paragraphs, defective):
+    """Chapter number in the README template; defective ones lack the Google Fonts
+    link and spell the charset in lower case."""
+    numeral = roman(number)
+    title_words = '\n'.join(f'          <h1 class="chapter-title-word">{escape(word)}</h1>'
+                            for word in title.split())
+    # Figures spread evenly through the content
+    figures = {}
+    for k, image in enumerate(images):
+        figures.setdefault(k * paragraphs // len(images), []).append(image)
+    content = []
+    for i in range(paragraphs):
+        content.append(f'      <p id="ch{number}-p{i + 1}">{paragraph(rng)}</p>')
+        for image in figures.get(i, ()):
+            content.append(f'      <figure class="image-quote"><img src="../{image}" alt="{sentence(rng, 4)}" /></figure>')
+    quiz = '\n'.join(f'        <li class="quiz-question">{sentence(rng)}</li>' for _ in range(5))
+    worksheet = '\n'.join(f'      <div class="worksheet-section"><p class="worksheet-prompt">{sentence(rng)}</p>'
+                          f'<div class="worksheet-input"></div></div>' for _ in range(3))
+
+    body = f"""  <nav class="chapter-navigation" aria-label="Chapter navigation">
+    <a href="{prev_href}">Previous</a> <span class="nav-title">Chapter {numeral} - {escape(title)}</span> <a href="{next_href}">Next</a>
+  </nav>
+  <main role="main" epub:type="bodymatter chapter">
+    <section class="chap-title" role="region">
+      <div class="chapter-number-container" aria-label="Chapter number">
+        <div class="chapter-number-text">{numeral}</div>
+      </div>
+      <div class="chapter-title-container">
+{title_words}
+      </div>
+      <figure class="bible-quote-container" role="group">
+        <blockquote class="bible-quote-text">{sentence(rng, 18)}</blockquote>
+        <figcaption class="bible-quote-reference">— Proverbs {number % 31 + 1}:{number % 20 + 1}</figcaption>
+      </figure>
+      <div class="introduction-heading" role="heading" aria-level="2">Introduction</div>
+      <div class="introduction-paragraph"><p>{paragraph(rng)}</p></div>
+    </section>
+    <section class="main-content">
+      <h2 class="content-header">{escape(title)}</h2>
+{chr(10).join(content)}
+    </section>
+    <section class="quiz-section">
+      <h2 class="quiz-header">Chapter {numeral} Quiz</h2>
+      <ol class="quiz-questions">
+{quiz}
+      </ol>
+    </section>
+    <section class="worksheet-section">
+      <h2 class="worksheet-header">Worksheet</h2>
+{worksheet}
+    </section>
+  </main>"""
+    head = _head(f"{escape(title)} - {BOOK_TITLE}", fonts_link=not defective,
+                 charset='utf-8' if defective else 'UTF-8')
+    return _document(head, body, 'chap-title')
+
+
+def page_xhtml(rng, number, title, paragraphs):
+    body = f"""  <main role="main" epub:type="frontmatter">
+    <section class="page" role="region">
+      <h1>{escape(title)}</h1>
+{chr(10).join(f'      <p id="pg{number}-p{i + 1}">{paragraph(rng)}</p>' for i in range(paragraphs))}
+    </section>
+  </main>"""
+    return _document(_head(f"{escape(title)} - {BOOK_TITLE}"), body)
+
+
+def nav_xhtml(entries):
+    items = '\n'.join(f'  <li><a href="{href}">{escape(title)}</a></li>' for href, title in entries)
+    body = f"""<nav epub:type="toc" id="toc" role="doc-toc">
+<h1>Table of Contents</h1>
+<ol>
+{items}
+</ol>
+</nav>"""
+    return _document(_head('Navigation', fonts_link=False), body, 'nav')
+
+
+def opf_xml(identifier, documents, images):
+    manifest = ['    <item id="nav" href="text/nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>',
+                '    <item id="css1" href="styles/style.css" media-type="text/css"/>']
+    manifest += [f'    <item id="{doc_id}" href="text/{name}" media-type="application/xhtml+xml"/>'
+                 for doc_id, name, *_ in documents]
+    manifest += [f'    <item id="img{i + 1}" href="{image}" media-type="image/png"/>'
+                 for i, image in enumerate(images)]
+    spine = '\n'.join(f'    <itemref idref="{doc[0]}"/>' for doc in documents)
+    return f"""<?xml version="1.0" encoding="UTF-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="BookId">
+  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/">
+    <dc:title>{BOOK_TITLE} (synthetic)</dc:title>
+    <dc:creator>Synthetic Book Generator</dc:creator>
+    <dc:identifier id="BookId">urn:uuid:{identifier}</dc:identifier>
+    <dc:language>en-US</dc:language>
+    <meta property="dcterms:modified">2025-01-01T00:00:00Z</meta>
+  </metadata>
+  <manifest>
+{chr(10).join(manifest)}
+  </manifest>
+  <spine>
+{spine}
+  </spine>
+</package>
+"""
+
+
+CONTAINER_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles>
+    <rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>
+  </rootfiles>
+</container>
+"""
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    mode = 'wb' if isinstance(data, bytes) else 'w'
+    with open(path, mode, **({} if isinstance(data, bytes) else {'encoding': 'utf-8'})) as f:
+        f.write(data)
+
+
+def generate_book(root, chapters=16, pages=28, images=29, paragraphs=24, image_kb=48,
+                  defect_rate=0.25, seed=1):
+    """Write a book root (mimetype, META-INF, OEBPS) under root; returns a summary dict.
+
+    Spine order is one page, then chapters and pages interleaved evenly.
+    A defect_rate share of chapters misses the Google Fonts link and uses a
+    lower-case charset, so the template fixer has real work to do.
+    """
+    rng = random.Random(seed)
+    oebps = os.path.join(root, 'OEBPS')
+    _write(os.path.join(root, 'mimetype'), 'application/epub+zip')
+    _write(os.path.join(root, 'META-INF', 'container.xml'), CONTAINER_XML)
+    _write(os.path.join(oebps, 'styles', 'style.css'), STYLE_CSS)
+
+    side = max(8, int((image_kb * 1024 / 3) ** 0.5))
+    image_paths = [f"images/img-{i + 1:05d}.png" for i in range(images)]
+    for path in image_paths:
+        _write(os.path.join(oebps, path), png_bytes(rng, side, side))
+
+    # Spine: (id, file name, title, chapter number or None), chapters spread
+    # evenly among the pages
+    documents = []
+    total = chapters + pages
+    chapter_no = page_no = 0
+    for position in range(total):
+        if (position + 1) * chapters // total > position * chapters // total:
+            chapter_no += 1
+            title = ' '.join(rng.choice(WORDS).capitalize() for _ in range(rng.randint(2, 5)))
+            documents.append((f"text{position + 1:05d}",
+                              f"{position + 1}-chapter-{roman(chapter_no).lower()}.xhtml", title, chapter_no))
+        else:
+            page_no += 1
+            documents.append((f"text{position + 1:05d}", f"{position + 1}-page-{page_no}.xhtml",
+                              f"Page {page_no}", None))
+
+    # Images go to chapters round-robin
+    chapter_docs = [doc for doc in documents if doc[3]]
+    chapter_images = {doc[1]: [] for doc in chapter_docs}
+    for i, path in enumerate(image_paths):
+        if chapter_docs:
+            chapter_images[chapter_docs[i % len(chapter_docs)][1]].append(path)
+
+    defective = 0
+    for i, (doc_id, name, title, number) in enumerate(documents):
+        prev_href = documents[i - 1][1] if i else 'nav.xhtml'
+        next_href = documents[i + 1][1] if i + 1 < len(documents) else 'nav.xhtml'
+        if number:
+            broken = rng.random() < defect_rate
+            defective += broken
+            text = chapter_xhtml(rng, number, title, prev_href, next_href, chapter_images[name],
+                                 paragraphs, broken)
+        else:
+            text = page_xhtml(rng, i + 1, title, max(1, paragraphs // 4))
+        _write(os.path.join(oebps, 'text', name), text)
+
+    _write(os.path.join(oebps, 'text', 'nav.xhtml'), nav_xhtml([(name, title) for _, name, title, _ in documents]))
+    identifier = uuid.UUID(int=rng.getrandbits(128), version=4)
+    _write(os.path.join(oebps, 'content.opf'), opf_xml(identifier, documents, image_paths))
+
+    return {'chapters': chapters, 'pages': pages, 'images': images, 'paragraphs': paragraphs,
+            'image_kb': image_kb, 'defect_rate': defect_rate, 'seed': seed,
+            'defective_chapters': defective}
+
+
+def add_book_arguments(parser):
+    """Size options shared by the generator and the benchmark harness."""
+    parser.add_argument('--scale', choices=sorted(SCALES), default='book',
+                        help="preset size: " + ', '.join(f"{name}={c}+{p} docs/{i} images"
+                                                          for name, (c, p, i) in SCALES.items()))
+    parser.add_argument('--chapters', type=int, help="chapter documents (overrides --scale)")
+    parser.add_argument('--pages', type=int, help="other spine documents (overrides --scale)")
+    parser.add_argument('--images', type=int, help="PNG images (overrides --scale)")
+    parser.add_argument('--paragraphs', type=int, default=24, help="paragraphs per chapter")
+    parser.add_argument('--image-kb', type=int, default=48, help="approximate size of each image")
+    parser.add_argument('--defect-rate', type=float, default=0.25,
+                        help="share of chapters the template fixer has to repair")
+    parser.add_argument('--seed', type=int, default=1)
+
+
+def book_options(args):
+    """generate_book keyword arguments from add_book_arguments options."""
+    chapters, pages, images = SCALES[args.scale]
+    return {
+        'chapters': chapters if args.chapters is None else args.chapters,
+        'pages': pages if args.pages is None else args.pages,
+        'images': images if args.images is None else args.images,
+        'paragraphs': args.paragraphs,
+        'image_kb': args.image_kb,
+        'defect_rate': args.defect_rate,
+        'seed': args.seed
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic EPUB source tree")
+    parser.add_argument('root', help="directory to create the book root in")
+    add_book_arguments(parser)
+    args = parser.parse_args()
+
+    if os.path.exists(os.path.join(args.root, 'OEBPS')):
+        parser.error(f"{args.root} already holds a book")
+    summary = generate_book(args.root, **book_options(args))
+    print(f"✅ Generated {summary['chapters']} chapters, {summary['pages']} pages and "
+          f"{summary['images']} images in {args.root} "
+          f"({summary['defective_chapters']} chapters need template fixes)")
+
+
+if __name__ == "__main__":
+    main()
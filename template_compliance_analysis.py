@@ -5,16 +5,87 @@ Analyzes all 16 chapters against the required template structure.
 """
 
 import os
+import sys
 import re
 from pathlib import Path
 import xml.etree.ElementTree as ET
-from bs4 import BeautifulSoup
+from xml.parsers import expat
 import json
+import argparse
+
+from package_index import PackageError
+from epub_source import chapter_sources, open_chapter, close_archives
+from parallel_checks import run_checks, add_parallel_arguments, resolve_jobs
+from result_cache import cached_checks, add_cache_arguments
+from results_store import record_checks, add_store_arguments
+from instrumentation import active, add_instrumentation_arguments, instrumented_from_args
+
+NAV_CLASS = re.compile(r'nav|navigation')
+NAV_TAGS = ('nav', 'div')
+
+# Characters handed to the streaming parser at a time
+SCAN_CHUNK = 16 * 1024
+
+
+class StructureScan:
+    """Find the <title> text and any navigation nav/div in one streaming pass.
+    
+    Tag names are matched on their local part whatever the prefix, as
+    BeautifulSoup's 'xml' mode does, and parsing stops as soon as both facts
+    are known, so no tree is built. Raises expat.ExpatError on markup
+    expat cannot read (e.g. HTML entities); callers then fall back to a
+    full, recovering parse.
+    """
+    
+    def __init__(self):
+        self.title = None      # text of the first <title>, once it has closed
+        self.has_nav = False
+        self._title_depth = 0  # > 0 while inside the first <title>
+        self._title_parts = []
+    
+    @property
+    def done(self):
+        return self.title is not None and self.has_nav
+    
+    def _start(self, name, attrs):
+        name = name.rpartition(':')[2]
+        if self._title_depth:
+            self._title_depth += 1
+        elif name == 'title' and self.title is None:
+            self._title_depth = 1
+        if not self.has_nav and name in NAV_TAGS and NAV_CLASS.search(attrs.get('class', '')):
+            self.has_nav = True
+    
+    def _end(self, name):
+        if self._title_depth:
+            self._title_depth -= 1
+            if not self._title_depth:
+                self.title = ''.join(self._title_parts)
+    
+    def _text(self, data):
+        if self._title_depth:
+            self._title_parts.append(data)
+    
+    def run(self, content):
+        parser = expat.ParserCreate()
+        parser.StartElementHandler = self._start
+        parser.EndElementHandler = self._end
+        parser.CharacterDataHandler = self._text
+        for start in range(0, len(content), SCAN_CHUNK):
+            parser.Parse(content[start:start + SCAN_CHUNK], False)
+            if self.done:
+                return self
+        parser.Parse('', True)
+        return self
+
 
 class TemplateComplianceAnalyzer:
-    def __init__(self, epub_path):
+    def __init__(self, epub_path, *more_books):
+        # Book directories or packed .epubs (read in place, not extracted)
         self.epub_path = Path(epub_path)
+        self.books = [self.epub_path] + [Path(book) for book in more_books]
         self.chapter_files = []
+        self.unreadable = []
         self.compliance_results = {}
         
         # Required template elements
@@ -52,30 +123,29 @@ class TemplateComplianceAnalyzer:
         ]
     
     def find_chapter_files(self):
-        """Find all chapter XHTML files."""
-        text_dir = self.epub_path / 'OEBPS' / 'text'
-        pattern = re.compile(r'.*chapter.*\.xhtml$', re.IGNORECASE)
-        
-        for file in text_dir.glob('*.xhtml'):
-            if pattern.match(str(file)):
-                self.chapter_files.append(file)
-        
-        # Sort by chapter number
-        self.chapter_files.sort(key=lambda x: self._extract_chapter_number(x.name))
+        """Find all chapter XHTML files, in spine order, book by book."""
+        self.chapter_files = []
+        self.unreadable = []
+        for book in self.books:
+            try:
+                self.chapter_files.extend(chapter_sources(book))
+            except (FileNotFoundError, PackageError) as e:
+                print(f"❌ {e}")
+                self.unreadable.append(book)
         return self.chapter_files
     
-    def _extract_chapter_number(self, filename):
-        """Extract chapter number for sorting."""
-        roman_map = {'i': 1, 'ii': 2, 'iii': 3, 'iv': 4, 'v': 5, 'vi': 6, 
-                    'vii': 7, 'viii': 8, 'ix': 9, 'x': 10, 'xi': 11, 'xii': 12,
-                    'xiii': 13, 'xiv': 14, 'xv': 15, 'xvi': 16}
-        
-        # Extract roman numeral from filename
-        match = re.search(r'chapter-([ivx]+)', filename.lower())
-        if match:
-            roman = match.group(1)
-            return roman_map.get(roman, 0)
-        return 0
+    def _result_key(self, chapter_file):
+        """Report key: the file name, qualified by its archive when analyzing several books."""
+        if len(self.books) > 1:
+            return getattr(chapter_file, 'label', str(chapter_file))
+        return chapter_file.name
+    
+    def ruleset(self):
+        """Everything analyze_chapter's verdict depends on besides the file itself."""
+        return {
+            'required_elements': self.required_elements,
+            'mustache_variables': self.mustache_variables
+        }
     
     def analyze_chapter(self, chapter_file):
         """Analyze a single chapter for template compliance."""
@@ -92,7 +162,7 @@ class TemplateComplianceAnalyzer:
         }
         
         try:
-            with open(chapter_file, 'r', encoding='utf-8') as f:
+            with open_chapter(chapter_file) as f:
                 content = f.read()
             
             # Check DOCTYPE
@@ -154,19 +224,22 @@ class TemplateComplianceAnalyzer:
                 results['content_truncated'] = True
                 results['issues'].append('Potentially truncated content (very short)')
             
-            # Parse with BeautifulSoup for more detailed analysis
+            # Title and navigation checks: a streaming scan, or a full
+            # BeautifulSoup tree when the markup is not well-formed XML
             try:
-                soup = BeautifulSoup(content, 'xml')
+                try:
+                    scan = StructureScan().run(content)
+                    title_text, has_nav = scan.title, scan.has_nav
+                except expat.ExpatError:
+                    title_text, has_nav = self._parse_full(content)
                 
                 # Check for proper title
-                title_tag = soup.find('title')
-                if not title_tag or not title_tag.text.strip():
+                if not title_text or not title_text.strip():
                     results['issues'].append('Missing or empty title tag')
                     results['compliant'] = False
                 
                 # Check for navigation structure
-                nav_elements = soup.find_all(['nav', 'div'], class_=re.compile(r'nav|navigation'))
-                if not nav_elements:
+                if not has_nav:
                     results['issues'].append('Missing navigation structure')
                     results['compliant'] = False
                 
@@ -180,15 +253,37 @@ class TemplateComplianceAnalyzer:
         
         return results
     
-    def analyze_all_chapters(self):
-        """Analyze all chapters and generate comprehensive report."""
-        self.find_chapter_files()
+    def _parse_full(self, content):
+        """(title text or None, has navigation) from a recovering BeautifulSoup parse."""
+        # Only needed for markup the streaming scan rejects
+        from bs4 import BeautifulSoup
+        
+        soup = BeautifulSoup(content, 'xml')
+        title_tag = soup.find('title')
+        nav_elements = soup.find_all(list(NAV_TAGS), class_=NAV_CLASS)
+        return (title_tag.text if title_tag else None), bool(nav_elements)
+    
+    def analyze_all_chapters(self, jobs=1, chunksize=None, cache_db=None):
+        """Analyze all chapters (across jobs worker processes when jobs > 1).
+        
+        With cache_db, unchanged chapters reuse their results from that database.
+        """
+        metrics = active()
+        with metrics.stage('discover'):
+            self.find_chapter_files()
         
         print(f"Found {len(self.chapter_files)} chapter files")
         
-        for chapter_file in self.chapter_files:
-            print(f"Analyzing: {chapter_file.name}")
-            self.compliance_results[chapter_file.name] = self.analyze_chapter(chapter_file)
+        # Results arrive in spine order, so the report matches a serial run
+        if cache_db:
+            checks = cached_checks(self, 'analyze_chapter', self.chapter_files, cache_db, jobs, chunksize)
+        else:
+            checks = run_checks(self, 'analyze_chapter', self.chapter_files, jobs, chunksize)
+        with metrics.stage('check'):
+            for chapter_file, result in checks:
+                print(f"Analyzing: {chapter_file.name}")
+                self.compliance_results[self._result_key(chapter_file)] = result
+        close_archives()
         
         return self.compliance_results
     
@@ -234,13 +329,27 @@ class TemplateComplianceAnalyzer:
         return sorted(critical, key=lambda x: x['issue_count'], reverse=True)
 
 def main():
-    analyzer = TemplateComplianceAnalyzer('/home/warrenm115/Man-main')
+    parser = argparse.ArgumentParser(description="EPUB template compliance analysis")
+    parser.add_argument('books', nargs='*', default=['/home/warrenm115/Man-main'], metavar='BOOK',
+                        help="book directories or .epub files to analyze")
+    add_parallel_arguments(parser)
+    add_cache_arguments(parser)
+    add_store_arguments(parser)
+    add_instrumentation_arguments(parser)
+    args = parser.parse_args()
+    
+    analyzer = TemplateComplianceAnalyzer(*args.books)
     
     print("🔍 Starting Template Compliance Analysis...")
     print("=" * 60)
     
     # Analyze all chapters
-    results = analyzer.analyze_all_chapters()
+    with instrumented_from_args('template_compliance_analysis', args) as metrics:
+        results = analyzer.analyze_all_chapters(jobs=resolve_jobs(args.jobs), chunksize=args.chunksize,
+                                                cache_db=None if args.no_cache else args.db)
+        if args.record:
+            record_checks(args.db, 'template_compliance_analysis',
+                          ((f, results[analyzer._result_key(f)]) for f in analyzer.chapter_files), metrics)
     
     # Generate report
     report = analyzer.generate_report()
@@ -271,6 +380,8 @@ def main():
         json.dump(report, f, indent=2)
     
     print(f"\n✅ Detailed report saved to: template_compliance_report.json")
+    if analyzer.unreadable:
+        sys.exit(1)
     
     return report
 
@@ -6,16 +6,30 @@ Adds Google Fonts and ensures template compliance while preserving content.
 
 import os
 import re
+import argparse
+import sys
 from pathlib import Path
-import shutil
 from datetime import datetime
 
+from package_index import PackageIndex, PackageError
+from transform_pipeline import TransformPipeline
+from backup_store import BackupStore
+from instrumentation import active, add_instrumentation_arguments, instrumented_from_args
+
 class TemplateEnforcer:
-    def __init__(self):
+    def __init__(self, remote_fonts=True):
+        # remote_fonts=False: never add the Google Fonts <link> (epub_font_fixer.py
+        # removes it again); the head only gains the local stylesheets it lacks
+        self.remote_fonts = remote_fonts
         self.backup_dir = Path('chapter_backups')
+        self.backup_store = BackupStore(self.backup_dir)
+        self.last_snapshot = None
         self.oebps_path = Path('OEBPS')
         self.fixed_count = 0
         
+        self.pipeline = TransformPipeline()
+        self.pipeline.register('template', self.template_stage)
+        
         # Google Fonts link to inject
         self.google_fonts_link = '''    <link href="https://fonts.googleapis.com/css2?family=Cinzel+Decorative:wght@400;700&amp;family=Libre+Baskerville:ital,wght@0,400;0,700;1,400&amp;display=swap" rel="stylesheet" />'''
         
@@ -25,108 +39,126 @@ class TemplateEnforcer:
     <title>{{TITLE_PLACEHOLDER}}</title>
     <link href="https://fonts.googleapis.com/css2?family=Cinzel+Decorative:wght@400;700&amp;family=Libre+Baskerville:ital,wght@0,400;0,700;1,400&amp;display=swap" rel="stylesheet" />'''
     
+    def find_chapter_files(self):
+        """Chapter documents from the OPF spine, in reading order."""
+        index = PackageIndex.load(self.oebps_path.parent)
+        return [Path(index.full_path(item)) for item in index.chapters()]
+    
     def create_backup(self):
-        """Create backup of all chapter files."""
-        if self.backup_dir.exists():
-            shutil.rmtree(self.backup_dir)
-        
-        self.backup_dir.mkdir(exist_ok=True)
-        
-        text_dir = self.oebps_path / 'text'
-        chapter_files = list(text_dir.glob('*chapter*.xhtml'))
+        """Snapshot all chapter files into the content-addressed backup store."""
+        chapter_files = self.find_chapter_files()
         
         print(f"📁 Creating backup of {len(chapter_files)} chapter files...")
         
-        for chapter_file in chapter_files:
-            shutil.copy2(chapter_file, self.backup_dir / chapter_file.name)
+        # Unchanged chapters are neither re-read nor re-copied
+        snapshot_id = self.backup_store.snapshot(chapter_files, label='template_fixer')
+        self.last_snapshot = snapshot_id
+        stats = self.backup_store.stats
         
-        print(f"✅ Backup created in: {self.backup_dir}")
+        print(f"✅ Backup snapshot {snapshot_id} in: {self.backup_dir} "
+              f"({stats['stored']} new blobs, {stats['bytes_stored']:,} bytes)")
+        print(f"   Restore with: python3 backup_store.py --store {self.backup_dir} restore {snapshot_id}")
         return len(chapter_files)
     
-    def fix_chapter_template(self, chapter_file):
-        """Fix a single chapter to match template requirements."""
-        print(f"🔧 Fixing: {chapter_file.name}")
+    def template_stage(self, content, chapter_file, fixes_applied):
+        """Transform-pipeline stage: bring chapter text in line with the template."""
+        # 1. Fix DOCTYPE (should be correct already)
+        if '<!DOCTYPE html>' not in content:
+            content = re.sub(r'<!DOCTYPE[^>]*>', '<!DOCTYPE html>', content)
+            fixes_applied.append('Fixed DOCTYPE')
         
-        try:
-            with open(chapter_file, 'r', encoding='utf-8') as f:
-                content = f.read()
-            
-            original_content = content
-            fixes_applied = []
-            
-            # 1. Fix DOCTYPE (should be correct already)
-            if '<!DOCTYPE html>' not in content:
-                content = re.sub(r'<!DOCTYPE[^>]*>', '<!DOCTYPE html>', content)
-                fixes_applied.append('Fixed DOCTYPE')
-            
-            # 2. Ensure UTF-8 charset
-            if 'charset="UTF-8"' not in content and 'charset="utf-8"' in content:
-                content = content.replace('charset="utf-8"', 'charset="UTF-8"')
-                fixes_applied.append('Standardized charset to UTF-8')
+        # 2. Ensure UTF-8 charset
+        if 'charset="UTF-8"' not in content and 'charset="utf-8"' in content:
+            content = content.replace('charset="utf-8"', 'charset="UTF-8"')
+            fixes_applied.append('Standardized charset to UTF-8')
+        
+        # 3. Add Google Fonts link if missing
+        if not self.remote_fonts:
+            content = self._add_local_stylesheets(content, chapter_file, fixes_applied)
+        elif 'fonts.googleapis.com' not in content:
+            # Find the head section and add Google Fonts
+            head_pattern = r'(<head[^>]*>)(.*?)(</head>)'
+            head_match = re.search(head_pattern, content, re.DOTALL)
             
-            # 3. Add Google Fonts link if missing
-            if 'fonts.googleapis.com' not in content:
-                # Find the head section and add Google Fonts
-                head_pattern = r'(<head[^>]*>)(.*?)(</head>)'
-                head_match = re.search(head_pattern, content, re.DOTALL)
+            if head_match:
+                head_start = head_match.group(1)
+                head_content = head_match.group(2)
+                head_end = head_match.group(3)
+                
+                # Extract title for preservation
+                title_match = re.search(r'<title>([^<]+)</title>', head_content)
+                title = title_match.group(0) if title_match else '<title>Chapter Title</title>'
                 
-                if head_match:
-                    head_start = head_match.group(1)
-                    head_content = head_match.group(2)
-                    head_end = head_match.group(3)
-                    
-                    # Extract title for preservation
-                    title_match = re.search(r'<title>([^<]+)</title>', head_content)
-                    title = title_match.group(0) if title_match else '<title>Chapter Title</title>'
-                    
-                    # Build new head content with template structure
-                    new_head_content = f'''
+                # Build new head content with template structure
+                new_head_content = f'''
     <meta charset="UTF-8" />
     <meta name="viewport" content="width=device-width, initial-scale=1.0" />
     {title}
     <link href="https://fonts.googleapis.com/css2?family=Cinzel+Decorative:wght@400;700&amp;family=Libre+Baskerville:ital,wght@0,400;0,700;1,400&amp;display=swap" rel="stylesheet" />
     <link rel="stylesheet" type="text/css" href="../styles/fonts.css" />
     <link rel="stylesheet" type="text/css" href="../styles/style.css" />'''
-                    
-                    content = content.replace(head_match.group(0), 
-                                            head_start + new_head_content + '\n  ' + head_end)
-                    fixes_applied.append('Added Google Fonts link')
-                    fixes_applied.append('Updated head structure')
-                else:
-                    print(f"  ⚠️ Could not find head section in {chapter_file.name}")
-            
-            # 4. Ensure proper HTML attributes
-            html_pattern = r'<html([^>]*)>'
-            html_match = re.search(html_pattern, content)
-            
-            if html_match:
-                html_attrs = html_match.group(1)
-                required_attrs = {
-                    'xmlns': 'http://www.w3.org/1999/xhtml',
-                    'xml:lang': 'en',
-                    'lang': 'en'
-                }
-                
-                new_attrs = html_attrs
-                for attr, value in required_attrs.items():
-                    if f'{attr}=' not in html_attrs:
-                        new_attrs += f' {attr}="{value}"'
-                        fixes_applied.append(f'Added {attr} attribute')
                 
-                if new_attrs != html_attrs:
-                    content = content.replace(html_match.group(0), f'<html{new_attrs}>')
-            
-            # 5. Verify chapter-title-word structure exists (should already be there)
-            if 'chapter-title-word' in content:
-                fixes_applied.append('Verified chapter-title-word structure')
+                content = content.replace(head_match.group(0), 
+                                      head_start + new_head_content + '\n  ' + head_end)
+                fixes_applied.append('Added Google Fonts link')
+                fixes_applied.append('Updated head structure')
             else:
-                print(f"  ⚠️ Missing chapter-title-word structure in {chapter_file.name}")
+                print(f"  ⚠️ Could not find head section in {chapter_file.name}")
+        
+        # 4. Ensure proper HTML attributes
+        html_pattern = r'<html([^>]*)>'
+        html_match = re.search(html_pattern, content)
+        
+        if html_match:
+            html_attrs = html_match.group(1)
+            required_attrs = {
+                'xmlns': 'http://www.w3.org/1999/xhtml',
+                'xml:lang': 'en',
+                'lang': 'en'
+            }
+            
+            new_attrs = html_attrs
+            for attr, value in required_attrs.items():
+                if f'{attr}=' not in html_attrs:
+                    new_attrs += f' {attr}="{value}"'
+                    fixes_applied.append(f'Added {attr} attribute')
+            
+            if new_attrs != html_attrs:
+                content = content.replace(html_match.group(0), f'<html{new_attrs}>')
+        
+        # 5. Verify chapter-title-word structure exists (should already be there)
+        if 'chapter-title-word' in content:
+            fixes_applied.append('Verified chapter-title-word structure')
+        else:
+            print(f"  ⚠️ Missing chapter-title-word structure in {chapter_file.name}")
+        
+        return content
+    
+    def _add_local_stylesheets(self, content, chapter_file, fixes_applied):
+        """Link the template's local stylesheets the head lacks, leaving the rest of the head alone."""
+        head_end = content.find('</head>')
+        if head_end < 0:
+            print(f"  ⚠️ Could not find head section in {chapter_file.name}")
+            return content
+        missing = [name for name in ('fonts.css', 'style.css')
+                   if not re.search(r'<link[^>]*href="[^"]*\b' + re.escape(name) + '"', content[:head_end])]
+        if not missing:
+            return content
+        links = ''.join(f'  <link rel="stylesheet" type="text/css" href="../styles/{name}" />\n  '
+                        for name in missing)
+        fixes_applied.append(f"Linked {', '.join(missing)}")
+        return content[:head_end] + links + content[head_end:]
+    
+    def fix_chapter_template(self, chapter_file):
+        """Fix a single chapter to match template requirements."""
+        print(f"🔧 Fixing: {chapter_file.name}")
+        
+        try:
+            # One read; written back (atomically) only if the bytes changed
+            changed, notes = self.pipeline.run_file(chapter_file)
+            fixes_applied = notes['template']
             
-            # Write the fixed content
             if fixes_applied:
-                with open(chapter_file, 'w', encoding='utf-8') as f:
-                    f.write(content)
-                
                 print(f"  ✅ Applied {len(fixes_applied)} fixes:")
                 for fix in fixes_applied:
                     print(f"    • {fix}")
@@ -147,21 +179,21 @@ class TemplateEnforcer:
         print("=" * 60)
         
         # Create backup first
-        backup_count = self.create_backup()
+        with active().stage('backup'):
+            backup_count = self.create_backup()
         
-        # Find all chapter files
-        text_dir = self.oebps_path / 'text'
-        chapter_files = sorted(list(text_dir.glob('*chapter*.xhtml')), 
-                              key=lambda x: self._extract_chapter_num(x.name))
+        # Find all chapter files, in spine order
+        chapter_files = self.find_chapter_files()
         
         print(f"\n🔧 Applying template fixes to {len(chapter_files)} chapters...")
         print("=" * 60)
         
         all_fixes = {}
         
-        for chapter_file in chapter_files:
-            fixes = self.fix_chapter_template(chapter_file)
-            all_fixes[chapter_file.name] = fixes
+        with active().stage('fix'):
+            for chapter_file in chapter_files:
+                fixes = self.fix_chapter_template(chapter_file)
+                all_fixes[chapter_file.name] = fixes
         
         print(f"\n📊 TEMPLATE ENFORCEMENT SUMMARY")
         print("=" * 60)
@@ -174,18 +206,6 @@ class TemplateEnforcer:
         
         return all_fixes
     
-    def _extract_chapter_num(self, filename):
-        """Extract chapter number for sorting."""
-        roman_to_num = {'i': 1, 'ii': 2, 'iii': 3, 'iv': 4, 'v': 5, 'vi': 6,
-                        'vii': 7, 'viii': 8, 'ix': 9, 'x': 10, 'xi': 11, 'xii': 12,
-                        'xiii': 13, 'xiv': 14, 'xv': 15, 'xvi': 16}
-        
-        name = filename.lower()
-        for roman, num in roman_to_num.items():
-            if f'chapter-{roman}' in name:
-                return num
-        return 0
-    
     def save_fix_report(self, all_fixes):
         """Save detailed fix report."""
         report_file = f"template_fixes_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
@@ -212,6 +232,10 @@ class TemplateEnforcer:
         print(f"📄 Fix report saved to: {report_file}")
 
 def main():
+    parser = argparse.ArgumentParser(description="Apply the chapter template to all chapters")
+    add_instrumentation_arguments(parser)
+    args = parser.parse_args()
+    
     enforcer = TemplateEnforcer()
     
     # Check if OEBPS directory exists
@@ -220,7 +244,12 @@ def main():
         return
     
     # Apply template fixes
-    fixes = enforcer.fix_all_chapters()
+    try:
+        with instrumented_from_args('template_fixer', args):
+            fixes = enforcer.fix_all_chapters()
+    except (FileNotFoundError, PackageError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
     
     print(f"\\n🎉 Template enforcement complete!")
     print("\\n🔄 Next steps:")
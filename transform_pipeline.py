@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Transform Pipeline - Apply every chapter fix in one read and one write
+Each fix is a stage that rewrites the chapter text in memory. A file is
+read once, passed through the stages in order, and written back
+atomically only if its bytes changed.
+"""
+
+import argparse
+import os
+import re
+import shutil
+import sys
+from pathlib import Path
+
+from package_index import PackageIndex, PackageError
+from instrumentation import active, add_instrumentation_arguments, instrumented_from_args
+
+# add_landmarks.sh, as a stage: open <main> after the chapter <body> and
+# close it before </body> (first occurrence per line, like sed without /g)
+LANDMARK_MAIN = '    <main role="main" epub:type="bodymatter chapter">'
+LANDMARK_BODY = re.compile(r'^(.*?)(<body class="chap-(?:title|body)">)', re.MULTILINE)
+LANDMARK_BODY_END = re.compile(r'^(.*?)</body>', re.MULTILINE)
+
+
+class TransformPipeline:
+    """Ordered, named in-memory stages run over files.
+
+    A stage is called as stage(content, path, notes) and returns the new
+    content; it appends a description of each change it makes to notes.
+    """
+
+    def __init__(self, encoding='utf-8'):
+        self.encoding = encoding
+        self.stages = []
+        self.reads = 0
+        self.writes = 0
+
+    def register(self, name, stage):
+        self.stages.append((name, stage))
+        return stage
+
+    def apply(self, content, path):
+        """Run all stages over content; returns (content, {stage name: notes})."""
+        notes = {}
+        for name, stage in self.stages:
+            notes[name] = []
+            content = stage(content, path, notes[name])
+        return content, notes
+
+    def run_file(self, path):
+        """Transform one file in place; returns (changed, {stage name: notes})."""
+        metrics = active()
+        with metrics.file('transform', path):
+            with open(path, 'rb') as f:
+                original = f.read()
+            self.reads += 1
+            metrics.count('bytes_read', len(original))
+
+            content, notes = self.apply(original.decode(self.encoding), path)
+            data = content.encode(self.encoding)
+            if data == original:
+                return False, notes
+
+            write_atomic(path, data)
+            self.writes += 1
+            metrics.count('bytes_written', len(data))
+            return True, notes
+
+    def run(self, files):
+        """Yield (path, changed, notes) for each file, in order."""
+        for path in files:
+            changed, notes = self.run_file(path)
+            yield path, changed, notes
+
+
+def write_atomic(path, data):
+    """Replace path with data via a temporary file in the same directory."""
+    path = Path(path)
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    shutil.copymode(path, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def add_landmarks(content, path, notes):
+    """Wrap the chapter body in a bodymatter <main> landmark (once)."""
+    if '<main role="main"' in content or not LANDMARK_BODY.search(content):
+        return content
+    content = LANDMARK_BODY.sub(lambda m: f"{m.group(1)}{m.group(2)}\n{LANDMARK_MAIN}", content)
+    content = LANDMARK_BODY_END.sub(lambda m: f"{m.group(1)}    </main>\n  </body>", content)
+    notes.append('Added main landmark')
+    return content
+
+
+def build_pipeline(stage_names):
+    """Pipeline of the named fix stages, in the order given."""
+    # Imported here: both modules build their own pipelines from this one
+    from template_fixer import TemplateEnforcer
+    from epub_font_fixer import remove_google_fonts
+
+    available = {
+        # Local fonts only, so 'template' and 'fonts' never undo each other
+        'template': TemplateEnforcer(remote_fonts=False).template_stage,
+        'fonts': remove_google_fonts,
+        'landmarks': add_landmarks
+    }
+    pipeline = TransformPipeline()
+    for name in stage_names:
+        pipeline.register(name, available[name])
+    return pipeline
+
+
+STAGE_NAMES = ('template', 'fonts', 'landmarks')
+
+
+def run_stages(stage_names):
+    """Run the named stages over every chapter of the book in the current directory.
+
+    Returns False if the book's OPF is missing or cannot be parsed.
+    """
+    try:
+        index = PackageIndex.load('.')
+    except (FileNotFoundError, PackageError) as e:
+        print(f"❌ {e}")
+        return False
+
+    chapter_files = [Path(index.full_path(item)) for item in index.chapters()]
+    pipeline = build_pipeline(stage_names)
+
+    print(f"🚀 Running {', '.join(stage_names)} over {len(chapter_files)} chapters...")
+    print("=" * 60)
+
+    changed_count = 0
+    with active().stage('fix'):
+        for chapter_file in chapter_files:
+            try:
+                changed, notes = pipeline.run_file(chapter_file)
+            except Exception as e:
+                print(f"  ❌ Error fixing {chapter_file.name}: {str(e)}")
+                continue
+
+            if changed:
+                changed_count += 1
+                applied = [note for stage_notes in notes.values() for note in stage_notes]
+                print(f"  ✅ {chapter_file.name}: {', '.join(applied) or 'rewritten'}")
+            else:
+                print(f"  ℹ️  Unchanged: {chapter_file.name}")
+
+    print(f"\n📊 Summary: {changed_count} of {len(chapter_files)} chapters changed")
+    print(f"   Reads: {pipeline.reads}, writes: {pipeline.writes}")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply chapter fixes in a single pass per file")
+    parser.add_argument('--stage', action='append', choices=STAGE_NAMES, dest='stages', required=True,
+                        help="stage to run (repeatable, in order)")
+    add_instrumentation_arguments(parser)
+    args = parser.parse_args()
+
+    with instrumented_from_args('transform_pipeline', args):
+        ok = run_stages(args.stages)
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,33 +1,15 @@
 #!/bin/bash
 
 # XML validation script for Book-files project
-# Validates XHTML files for EPUB compliance
+# Validates XHTML files for EPUB compliance (well-formedness and XHTML namespace)
+# in a single Python process; pass a book directory or .epub to also check the
+# container, OPF manifest/spine and media types. See epub_validator.py.
 
 if [ $# -eq 0 ]; then
     echo "Usage: $0 <xhtml-file>"
     echo "       $0 *.xhtml  # validate all XHTML files"
+    echo "       $0 <book-dir-or-epub>  # full structural check"
     exit 1
 fi
 
-echo "XML/XHTML Validation Tools Available:"
-echo "- xmlstarlet: $(xmlstarlet --version | head -1)"
-echo "- tidy: $(tidy --version | head -1)"
-echo ""
-
-for file in "$@"; do
-    if [ -f "$file" ]; then
-        echo "Validating: $file"
-        
-        # Check well-formedness
-        echo "  → Checking well-formedness..."
-        xmlstarlet val -w "$file"
-        
-        # Check with HTML Tidy for XHTML compliance
-        echo "  → Checking XHTML compliance..."
-        tidy -xml -errors -quiet "$file" 2>&1 | head -10
-        
-        echo ""
-    else
-        echo "File not found: $file"
-    fi
-done
\ No newline at end of file
+exec python3 "$(dirname "$0")/epub_validator.py" "$@"
@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""
+EPUB Watch Mode - Fix, check and repackage chapters as they are edited
+Watches OEBPS/ (inotify, or stat polling where inotify is unavailable) and,
+for each batch of changes, runs the fix stages asked for with --stage (none
+by default: chapters are never rewritten unless requested) and the
+compliance check on the changed chapters only, then refreshes one EPUB incrementally so only
+changed entries are recompressed. Files the fixer itself rewrites are
+recognized and do not trigger another round.
+"""
+
+import argparse
+import contextlib
+import ctypes
+import ctypes.util
+import io
+import os
+import select
+import struct
+import sys
+import time
+from pathlib import Path
+
+from package_index import PackageIndex, PackageError, find_opf_path
+from transform_pipeline import build_pipeline, STAGE_NAMES
+from simple_compliance_check import SimpleComplianceChecker
+from backup_store import BackupStore, DEFAULT_STORE
+from create_final_epub import create_epub
+from compression_policy import POLICY_MODES
+from instrumentation import instrumented, add_instrumentation_arguments, instrumented_from_args
+
+# inotify(7) event bits
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+INOTIFY_EVENT = struct.Struct('iIII')
+
+DEFAULT_OUTPUT = 'Curls-Contemplation-Stylists-Journey-WATCH'
+
+# Quiet period that ends a batch of changes (editors write in several steps)
+DEFAULT_DEBOUNCE = 0.05
+DEFAULT_POLL_INTERVAL = 0.25
+
+
+def ignored(name):
+    """Temporary and hidden files: editor swap files, our own atomic-write temps."""
+    return name.startswith('.') or name.endswith(('~', '.tmp', '.part', '.swp'))
+
+
+def scan_tree(root):
+    """{path: (size, mtime_ns)} for every file under root."""
+    signatures = {}
+    for directory, dirs, files in os.walk(root):
+        dirs[:] = [d for d in dirs if not ignored(d)]
+        for name in files:
+            if ignored(name):
+                continue
+            path = os.path.normpath(os.path.join(directory, name))
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            signatures[path] = (st.st_size, st.st_mtime_ns)
+    return signatures
+
+
+class InotifyWatcher:
+    """Recursive inotify watch over a directory tree (Linux only)."""
+
+    def __init__(self, root):
+        libc_name = ctypes.util.find_library('c')
+        self._libc = ctypes.CDLL(libc_name, use_errno=True) if libc_name else None
+        if self._libc is None or not hasattr(self._libc, 'inotify_init1'):
+            raise OSError("inotify is not available")
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.root = root
+        self._dirs = {}
+        self._add_tree(root)
+
+    def _add_tree(self, directory):
+        for path, dirs, _ in os.walk(directory):
+            dirs[:] = [d for d in dirs if not ignored(d)]
+            wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+            if wd < 0:
+                raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {path}")
+            self._dirs[wd] = path
+
+    def changes(self, timeout):
+        """Paths touched within timeout seconds; None means 'rescan everything'."""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+
+        paths = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+            name = os.fsdecode(data[offset + INOTIFY_EVENT.size:offset + INOTIFY_EVENT.size + length].rstrip(b'\0'))
+            offset += INOTIFY_EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                return None
+            if mask & IN_IGNORED:
+                self._dirs.pop(wd, None)
+                continue
+            directory = self._dirs.get(wd)
+            if directory is None or not name or ignored(name):
+                continue
+            path = os.path.join(directory, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    # New directory: watch it, and pick up files already inside
+                    self._add_tree(path)
+                    paths.update(scan_tree(path))
+                else:
+                    return None
+                continue
+            paths.add(path)
+        return paths
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Portable fallback: compare file sizes and mtimes every interval."""
+
+    def __init__(self, root, interval=DEFAULT_POLL_INTERVAL):
+        self.root = root
+        self.interval = interval
+        self._signatures = scan_tree(root)
+
+    def changes(self, timeout):
+        time.sleep(min(timeout, self.interval))
+        current = scan_tree(self.root)
+        paths = {path for path, signature in current.items() if self._signatures.get(path) != signature}
+        paths.update(set(self._signatures) - set(current))
+        self._signatures = current
+        return paths
+
+    def close(self):
+        pass
+
+
+def make_watcher(root, polling=False, interval=DEFAULT_POLL_INTERVAL):
+    if not polling:
+        try:
+            return InotifyWatcher(root)
+        except (OSError, AttributeError) as e:
+            print(f"⚠️  inotify unavailable ({e}); polling every {interval}s instead")
+    return PollingWatcher(root, interval)
+
+
+class BookWatcher:
+    """Incremental fix → check → package loop over one book root."""
+
+    def __init__(self, source='.', output_name=DEFAULT_OUTPUT, stages=(), check=True,
+                 backup=True, compression='table', measure=None):
+        self.source = source
+        self.content_root = os.path.join(source, os.path.dirname(find_opf_path(source)))
+        self.output_name = output_name
+        self.pipeline = build_pipeline(stages) if stages else None
+        self.checker = SimpleComplianceChecker([source]) if check else None
+        self.backup_store = BackupStore(os.path.join(source, DEFAULT_STORE)) if backup and stages else None
+        self.compression = compression
+        self.measure = measure or (lambda: instrumented('watch_book'))
+        self.signatures = scan_tree(self.content_root)
+        self.results = {}
+        self._load_index()
+
+    def _load_index(self):
+        self.index = PackageIndex.load(self.source)
+        self.chapters = {os.path.normpath(self.index.full_path(item)) for item in self.index.chapters()}
+
+    def settle(self, paths):
+        """The paths whose size or mtime really changed since we last looked."""
+        changed = set()
+        for path in map(os.path.normpath, paths):
+            try:
+                st = os.stat(path)
+                signature = (st.st_size, st.st_mtime_ns)
+            except OSError:
+                signature = None
+            if self.signatures.get(path) != signature:
+                changed.add(path)
+                if signature is None:
+                    self.signatures.pop(path, None)
+                else:
+                    self.signatures[path] = signature
+        return changed
+
+    def process(self, changed, detected=None):
+        """Fix, check and repackage for one batch of changed paths."""
+        detected = detected or time.perf_counter()
+        with self.measure() as metrics:
+            opf_path = os.path.normpath(os.path.join(self.source, self.index.opf_path))
+            if opf_path in changed:
+                try:
+                    self._load_index()
+                except PackageError as e:
+                    # Likely saved mid-edit; keep the previous index until the next save
+                    print(f"❌ {e}")
+                    return None
+            chapters = sorted(path for path in changed if path in self.chapters and os.path.exists(path))
+            for path in changed - set(chapters):
+                if path in self.chapters:
+                    self.results.pop(Path(path).name, None)
+
+            if chapters and self.backup_store:
+                with metrics.stage('backup'):
+                    self.backup_store.snapshot(chapters, base=self.source, label='watch')
+            if chapters and self.pipeline:
+                with metrics.stage('fix'):
+                    self._fix(chapters)
+            if chapters and self.checker:
+                with metrics.stage('check'):
+                    self._check(chapters)
+
+            # Progress of the build is summarized below rather than printed
+            with contextlib.redirect_stdout(io.StringIO()):
+                epub = create_epub(self.source, self.output_name, incremental=True,
+                                   compression=self.compression, timestamp=False)
+            recompressed = len(metrics.files.get('compress', {}))
+
+        latency = time.perf_counter() - detected
+        compliant = sum(1 for result in self.results.values() if result['compliant'])
+        if epub:
+            print(f"📦 {epub} refreshed: {recompressed} entries recompressed, {latency:.3f}s after "
+                  f"the change ({compliant}/{len(self.results)} chapters compliant)")
+        else:
+            print(f"❌ Packaging failed {latency:.3f}s after the change")
+        return epub
+
+    def _fix(self, chapters):
+        for path in chapters:
+            try:
+                changed, notes = self.pipeline.run_file(Path(path))
+            except Exception as e:
+                print(f"  ❌ Error fixing {Path(path).name}: {e}")
+                continue
+            if changed:
+                applied = [note for stage_notes in notes.values() for note in stage_notes]
+                print(f"  🔧 {Path(path).name}: {', '.join(applied) or 'rewritten'}")
+        # Our own rewrites are not edits to react to
+        self.settle(chapters)
+
+    def _check(self, chapters):
+        for path in chapters:
+            result = self.checker.check_chapter(Path(path))
+            self.results[Path(path).name] = result
+            if result['compliant']:
+                print(f"  ✅ {Path(path).name}: compliant")
+            else:
+                print(f"  ❌ {Path(path).name}: {'; '.join(result['issues'])}")
+
+    def run(self, watcher, debounce=DEFAULT_DEBOUNCE, initial=True):
+        """Process changes until interrupted."""
+        if initial:
+            print(f"🚀 Initial pass over {len(self.chapters)} chapters...")
+            self.process(set(self.chapters))
+        print(f"👀 Watching {self.content_root} ({type(watcher).__name__}); Ctrl+C to stop")
+        while True:
+            paths = watcher.changes(3600)
+            if paths is None:
+                paths = set(self.signatures) | set(scan_tree(self.content_root))
+            if not paths:
+                continue
+            detected = time.perf_counter()
+            # Collect the rest of the burst before acting
+            while True:
+                more = watcher.changes(debounce)
+                if more is None:
+                    more = set(self.signatures) | set(scan_tree(self.content_root))
+                if not more:
+                    break
+                paths |= more
+            changed = self.settle(paths)
+            if not changed:
+                continue
+            names = ', '.join(sorted(Path(path).name for path in changed)[:5])
+            print(f"\n🔄 {len(changed)} changed: {names}{' ...' if len(changed) > 5 else ''}")
+            self.process(changed, detected)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fix, check and repackage chapters as they change")
+    parser.add_argument('--source', default='.', metavar='DIR', help="book root (default: current directory)")
+    parser.add_argument('--output-name', default=DEFAULT_OUTPUT,
+                        help="EPUB written as NAME.epub, refreshed in place")
+    parser.add_argument('--stage', action='append', choices=STAGE_NAMES, dest='stages',
+                        help="fix stage to run on changed chapters (repeatable, in order; default: none)")
+    parser.add_argument('--no-fix', action='store_true', help="do not modify chapters, even with --stage")
+    parser.add_argument('--no-check', action='store_true', help="skip the compliance check")
+    parser.add_argument('--no-backup', action='store_true', help="do not snapshot chapters before fixing")
+    parser.add_argument('--no-initial', action='store_true', help="skip the initial pass over the whole book")
+    parser.add_argument('--poll', action='store_true', help="poll file stats instead of using inotify")
+    parser.add_argument('--interval', type=float, default=DEFAULT_POLL_INTERVAL, help="polling interval (seconds)")
+    parser.add_argument('--debounce', type=float, default=DEFAULT_DEBOUNCE,
+                        help="quiet time that ends a burst of changes (seconds)")
+    parser.add_argument('--compression', choices=POLICY_MODES, default='table')
+    add_instrumentation_arguments(parser)
+    args = parser.parse_args()
+
+    try:
+        book = BookWatcher(args.source, args.output_name,
+                           stages=() if args.no_fix else (args.stages or ()),
+                           check=not args.no_check, backup=not args.no_backup and not args.no_fix,
+                           compression=args.compression,
+                           measure=lambda: instrumented_from_args('watch_book', args))
+    except (FileNotFoundError, PackageError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+    watcher = make_watcher(book.content_root, args.poll, args.interval)
+    try:
+        book.run(watcher, args.debounce, initial=not args.no_initial)
+    except KeyboardInterrupt:
+        print("\n👋 Stopped watching")
+    finally:
+        watcher.close()
+
+
+if __name__ == "__main__":
+    main()